@@ -1,22 +1,27 @@
 import streamlit as st
-import google.generativeai as genai
 from dotenv import load_dotenv
 import os
 import json
 import pandas as pd
-from pathlib import Path
 import datetime
+import functools
+import time
 import uuid
-import firebase_admin
-from firebase_admin import credentials, firestore
-try:
-    from pypdf import PdfReader
-    import io
-    import re
-except ImportError:
-    pass
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import library
+import retrieval
+import prompt_builder
+import generation
+import vam_calculator
+import plan_structure
+import load_analytics
+import player_groups
+import storage
+import cloud_sync
+import pdf_export
 
 # --- 1. Configuración y Seguridad ---
+run_start = time.perf_counter()  # para el log de tiempos de rerun
 load_dotenv()
 
 st.set_page_config(
@@ -170,37 +175,83 @@ api_key = os.getenv("GOOGLE_API_KEY")
 # --- Persistencia y Firebase ---
 DB_EQUIPOS = "equipos_db.json"
 DB_PLANES = "planificaciones_db.json"
+DB_CARGAS = "cargas_db.json"
+# Nombre de cada archivo como colección de Firestore (futsal_data/{nombre}/items) y como tabla de SQLite
+DATA_NAMES = {DB_EQUIPOS: "equipos", DB_PLANES: "planes", DB_CARGAS: "cargas"}
 
-def init_firebase():
-    if not firebase_admin._apps:
-        try:
-            if "firebase" in st.secrets:
-                cred_dict = dict(st.secrets["firebase"])
-                cred = credentials.Certificate(cred_dict)
-                firebase_admin.initialize_app(cred)
-                return True
+def firebase_credentials():
+    """Credenciales de Firebase a probar, en orden (dict o ruta). Se buscan sin importar el SDK."""
+    candidates = []
+    try:
+        if "firebase" in st.secrets:
+            candidates.append(dict(st.secrets["firebase"]))
+    except: pass
+
+    fb_cert = os.getenv("FIREBASE_CERT")
+    if fb_cert:
+        try: candidates.append(json.loads(fb_cert))
         except: pass
-        
-        fb_cert = os.getenv("FIREBASE_CERT")
-        if fb_cert:
-            try:
-                cred_dict = json.loads(fb_cert)
-                cred = credentials.Certificate(cred_dict)
-                firebase_admin.initialize_app(cred)
-                return True
-            except: pass
-                
-        if os.path.exists("firebase_credentials.json"):
-            try:
-                cred = credentials.Certificate("firebase_credentials.json")
-                firebase_admin.initialize_app(cred)
-                return True
+
+    if os.path.exists("firebase_credentials.json"):
+        candidates.append("firebase_credentials.json")
+    return candidates
+
+def connect_firebase(candidates):
+    """Importa firebase_admin e inicializa la app. Devuelve el FirestoreStore o None."""
+    try:
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        for cred in candidates:
+            if firebase_admin._apps: break
+            try: firebase_admin.initialize_app(credentials.Certificate(cred))
             except: pass
-    return bool(firebase_admin._apps)
+        if not firebase_admin._apps: return None
+        # Firestore: un documento por item y cargas incrementales; la caché es del proceso
+        return cloud_sync.FirestoreStore(firestore.client(), timestamp=firestore.SERVER_TIMESTAMP)
+    except Exception as e:
+        print("Error iniciando Firebase:", e)
+        return None
 
-FIREBASE_ENABLED = init_firebase()
-if FIREBASE_ENABLED:
-    db = firestore.client()
+FIREBASE_TIMEOUT = 5  # segundos que se espera la conexión antes de seguir con el guardado local
+
+# Firebase solo se importa si hay credenciales, y se conecta en segundo plano mientras se pinta la UI
+@st.cache_resource(show_spinner=False)
+def start_firebase():
+    candidates = firebase_credentials()
+    if not candidates: return None
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="firebase")
+    future = executor.submit(connect_firebase, candidates)
+    executor.shutdown(wait=False)
+    return future
+
+def resolve_cloud(future):
+    """FirestoreStore si la conexión terminó bien dentro de FIREBASE_TIMEOUT, si no None.
+    Una conexión fallida no queda cacheada: la próxima sesión vuelve a intentar."""
+    if future is None: return None
+    try:
+        connected = future.result(timeout=FIREBASE_TIMEOUT)
+    except TimeoutError:
+        print(f"[firestore] sin conexión tras {FIREBASE_TIMEOUT}s, se sigue con el guardado local")
+        return None
+    except Exception as e:
+        print("Error iniciando Firebase:", e)
+        connected = None
+    if connected is None:
+        start_firebase.clear()
+    return connected
+
+firebase_future = start_firebase()
+
+# Backend local opcional (STORAGE_BACKEND=sqlite): una fila por item y búsqueda FTS5 de planes
+@st.cache_resource(show_spinner=False)
+def get_store():
+    store = storage.SQLiteStore()
+    imported = store.migrate_json(DATA_NAMES)
+    if imported:
+        print(f"[storage] {imported} items migrados de JSON a SQLite")
+    return store
+
+store = get_store() if storage.STORAGE_BACKEND == "sqlite" else None
 
 
 with st.sidebar:
@@ -209,235 +260,101 @@ with st.sidebar:
     st.markdown("---")
     if api_key:
         st.success("🟢 Licencia Activada")
-        if FIREBASE_ENABLED:
-            st.success("☁️ Firebase Conectado (Nube)")
-        else:
-            st.warning("⚠️ Guardando Localmente (Firebase Inactivo)")
-            with st.expander("Configurar Nube"):
-                st.info("Tus datos se borrarán al reiniciar la app local. Para guardar permanentemente, añade FIREBASE_CERT al archivo .env")
-        genai.configure(api_key=api_key)
+        # El estado de Firebase se completa cuando termina la conexión (antes de cargar los datos)
+        cloud_status = st.empty()
+        generation.configure(api_key)
     else:
         st.warning("⚠️ Clave API requerida")
         manual_key = st.text_input("API Key:", type="password")
         if manual_key:
             os.environ["GOOGLE_API_KEY"] = manual_key
-            genai.configure(api_key=manual_key)
+            generation.configure(manual_key)
             st.rerun()
 
-# --- Helper: Model ---
-def get_available_models():
-    # Intenta obtener de manera dinámica priorizando Flash/Lite sobre Pro 
-    # (Pro tira error 429 limit:0, y 1.5 tira error 404)
-    try:
-        available = [m.name for m in genai.list_models() if "generateContent" in m.supported_generation_methods]
-        models_to_try = []
-        preferencias = [
-            "gemini-3.1-flash-lite",
-            "gemini-2.5-flash", 
-            "gemini-3-flash",
-            "gemini-flash"
-        ]
-        for pref in preferencias:
-            for a in available:
-                if pref in a and "pro" not in a.lower() and a not in models_to_try:
-                    models_to_try.append(a)
-        
-        # Fallback de seguridad usando nombres completos
-        if not models_to_try:
-            return ["models/gemini-2.5-flash", "models/gemini-3.1-flash-lite"]
-        return models_to_try
-    except:
-        return ["models/gemini-2.5-flash"]
-
-
-
-
 # --- Helper: PDF RAG ---
 @st.cache_resource(show_spinner=False)
-def load_library_context(max_chars=100000):
-    """Lee PDFs de /biblioteca_futsal extrae texto hasta un límite de caracteres."""
-    path = Path("biblioteca_futsal")
-    full_text = ""
-    file_count = 0
-    
-    if not path.exists():
-        return "", 0
-    
-    files = list(path.glob("*.pdf"))
-    for pdf_file in files:
-        if len(full_text) >= max_chars:
-            break
-            
-        try:
-            reader = PdfReader(pdf_file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-                if len(full_text) + len(text) >= max_chars:
-                    break
-            
-            full_text += f"\n--- INFORMACIÓN DEL LIBRO: {pdf_file.name} ---\n{text}\n"
-            file_count += 1
-        except Exception as e:
-            print(f"Error leyendo {pdf_file}: {e}")
-            
-    return full_text[:max_chars], file_count
+def get_library_state():
+    """Estado de /biblioteca_futsal compartido por todas las sesiones (se sincroniza por archivo)."""
+    return library.LibraryState()
 
 # --- Helper: PDF Generator ---
-# --- Helper: PDF Generator (Advanced) ---
-def create_pdf(title, content):
-    try:
-        from xhtml2pdf import pisa
-        import markdown
-        import base64
-        
-        # Codificar logo en base64
-        logo_path = "logo.jpg"
-        logo_base64 = ""
-        if os.path.exists(logo_path):
-            with open(logo_path, "rb") as image_file:
-                logo_base64 = base64.b64encode(image_file.read()).decode()
-    except ImportError:
-        return None
-        
-    # Convertir Markdown a HTML
-    html_text = markdown.markdown(content, extensions=['tables'])
-    
-    # --- LOGICA DINAMICA DE ANCHOS DE COLUMNA ---
-    # Detectamos las tablas y asignamos anchos segun el contenido de los headers.
-    parts = html_text.split("<table>")
-    new_html = parts[0]
-    
-    for part in parts[1:]:
-        colgroup = ""
-        # Buscar headers en los primeros 2000 caracteres del fragmento de tabla
-        search_area = part[:2000]
-        # Regex para encontrar contenido entre <th>...</th>
-        headers = re.findall(r'<th.*?>(.*?)</th>', search_area, re.IGNORECASE | re.DOTALL)
-        
-        if headers:
-            # Limpiar tags HTML internos de los headers si los hay
-            clean_headers = [re.sub(r'<[^>]+>', '', h).strip().lower() for h in headers]
-            
-            weights = []
-            for h in clean_headers:
-                w = 12 # Peso base
-                # Asignación de pesos heurística
-                if any(x in h for x in ["ejercicio", "tarea", "actividad"]): w = 22
-                elif any(x in h for x in ["foco", "descripción", "observaciones", "notas", "logística"]): w = 45 # Mucho espacio para texto largo
-                elif any(x in h for x in ["intensidad", "intensity", "objetivo", "capacidades"]): w = 25
-                elif any(x in h for x in ["series", "sets", "reps", "repeticiones", "nº", "grupo", "g1", "g2"]): w = 8 # Columnas estrechas
-                elif any(x in h for x in ["pausa", "rest", "recup", "tiempo", "duración", "distancia", "vel", "vam"]): w = 12
-                elif any(x in h for x in ["fase", "mes", "semana"]): w = 18
-                weights.append(w)
-            
-            total_w = sum(weights)
-            # Calcular porcentajes
-            col_widths = [f"{(w/total_w)*100:.1f}%" for w in weights]
-            
-            colgroup = "<colgroup>" + "".join([f'<col width="{w}">' for w in col_widths]) + "</colgroup>"
-        
-        new_html += f"<table>{colgroup}" + part
-
-    html_text = new_html
-    
-    # Estilos CSS para el PDF
-    css_style = """
-    <style>
-        @page { size: A4 landscape; margin: 1cm; }
-        body { font-family: Helvetica, sans-serif; font-size: 10pt; color: #333; }
-        h1 { color: #2E7D32; font-size: 16pt; margin-bottom: 15px; text-align: center; font-weight: bold; }
-        h2 { color: #1565C0; font-size: 13pt; margin-top: 15px; border-bottom: 2px solid #EEE; padding-bottom: 5px; }
-        h3 { color: #444; font-size: 11pt; margin-top: 10px; font-weight: bold; }
-        p { line-height: 1.4; margin-bottom: 8px; text-align: justify; }
-        
-        /* Tablas */
-        table { width: 100%; border-collapse: collapse; margin-top: 10px; margin-bottom: 15px; table-layout: fixed; }
-        th { background-color: #004d40; color: white; padding: 6px; border: 1px solid #444; font-weight: bold; text-align: center; font-size: 9pt; }
-        td { padding: 6px; border: 1px solid #CCC; text-align: left; vertical-align: top; font-size: 9pt; word-wrap: break-word; }
-        
-        /* Listas */
-        ul, ol { margin-bottom: 8px; padding-left: 15px; }
-        li { margin-bottom: 3px; }
-        
-        strong { color: #000; font-weight: bold; }
-
-        /* Logo en esquina superior derecha */
-        #header-logo {
-            position: absolute;
-            top: -20px;
-            right: 0px;
-            width: 80px;
-            height: auto;
-        }
-    </style>
-    """
-    
-    # HTML Completo
-    img_tag = f'<img id="header-logo" src="data:image/jpeg;base64,{logo_base64}"/>' if logo_base64 else ""
-
-    full_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        {css_style}
-    </head>
-    <body>
-        {img_tag}
-        <h1>{title}</h1>
-        <hr/>
-        {html_text}
-    </body>
-    </html>
-    """
-    
-    # Generar PDF en memoria
-    pdf_buffer = io.BytesIO()
-    pisa_status = pisa.CreatePDF(io.BytesIO(full_html.encode("utf-8")), dest=pdf_buffer)
-    
-    if pisa_status.err:
-        return None
-    
-    return pdf_buffer.getvalue()
-
+PDF_WAIT_SECONDS = 3  # al pedir un PDF se espera esto; si tarda más, sigue en segundo plano
 
+@st.cache_resource(show_spinner=False)
+def get_pdf_renderer():
+    """PDFs generados en segundo plano y cacheados, compartidos por todas las sesiones."""
+    return pdf_export.PdfRenderer()
 
 def load_json(filepath):
-    if FIREBASE_ENABLED:
+    if cloud:
         try:
-            doc_id = "equipos" if filepath == DB_EQUIPOS else "planes"
-            doc = db.collection("futsal_data").document(doc_id).get()
-            if doc.exists:
-                data = doc.to_dict().get("data", [])
-                if data: return data
+            # Solo se traen los documentos modificados desde la última carga
+            changes = cloud.pull(DATA_NAMES[filepath])
+            data = cloud.items(DATA_NAMES[filepath])
+            if data:
+                # La nube manda: la copia local (y su índice de búsqueda) se alinea con ella
+                if store and changes: store.replace_all(DATA_NAMES[filepath], data)
+                return data
         except Exception as e:
             print("Error cargando Firebase:", e)
 
+    if store: return store.load(DATA_NAMES[filepath])
     if not os.path.exists(filepath): return []
     try:
         with open(filepath, "r", encoding="utf-8") as f: return json.load(f)
     except: return []
 
-def save_json(filepath, data):
+def save_json(filepath, data, changed=None, removed=()):
+    """Guarda la lista completa. Con SQLite y Firestore, si se indican `changed` (items
+    nuevos o editados) y/o `removed` (claves borradas), solo se escriben esas filas/documentos."""
     local_saved = False
     try:
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        if store:
+            if changed is None and not removed:
+                store.replace_all(DATA_NAMES[filepath], data)
+            else:
+                store.save(DATA_NAMES[filepath], changed or (), removed)
+        else:
+            with open(filepath, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
         local_saved = True
-    except: pass
+    except Exception as e:
+        print("Error guardando local:", e)
     
-    if FIREBASE_ENABLED:
+    if cloud:
         try:
-            doc_id = "equipos" if filepath == DB_EQUIPOS else "planes"
-            db.collection("futsal_data").document(doc_id).set({"data": data})
+            if changed is None and not removed:
+                cloud.replace_all(DATA_NAMES[filepath], data)
+            else:
+                cloud.save(DATA_NAMES[filepath], changed or (), removed)
             return True
-        except: pass
+        except Exception as e:
+            print("Error guardando en Firebase:", e)
         
     return local_saved
 
+# Una sesión que arrancó con datos locales (Firebase lento o caído) sigue local hasta el final,
+# para no pisar la nube con lo que cargó de disco
+cloud = resolve_cloud(firebase_future) if st.session_state.get("use_cloud", True) else None
+st.session_state.use_cloud = FIREBASE_ENABLED = cloud is not None
+if api_key:
+    with cloud_status.container():
+        if FIREBASE_ENABLED:
+            st.success("☁️ Firebase Conectado (Nube)")
+        else:
+            st.warning("⚠️ Guardando Localmente (Firebase Inactivo)")
+            with st.expander("Configurar Nube"):
+                st.info("Tus datos se borrarán al reiniciar la app local. Para guardar permanentemente, añade FIREBASE_CERT al archivo .env")
+
 if "equipos" not in st.session_state: st.session_state.equipos = load_json(DB_EQUIPOS)
-if "planes" not in st.session_state: st.session_state.planes = load_json(DB_PLANES)
+def team_names():
+    return [e["categoria"] for e in st.session_state.equipos]
+
+# Los planes viejos (sin "estructura") se parsean una vez al cargar
+if "planes" not in st.session_state:
+    st.session_state.planes = load_json(DB_PLANES)
+    plan_structure.ensure_all(st.session_state.planes, team_names())
+if "cargas" not in st.session_state: st.session_state.cargas = load_json(DB_CARGAS)
 if "messages" not in st.session_state: st.session_state.messages = []
 if "confirm_delete" not in st.session_state: st.session_state.confirm_delete = False
 
@@ -445,8 +362,271 @@ if "confirm_delete" not in st.session_state: st.session_state.confirm_delete = F
 if "max_context_chars" not in st.session_state:
     st.session_state.max_context_chars = 10000
 
-# Cargamos contexto PDF al iniciar (cacheado)
-library_text, library_count = load_library_context(st.session_state.max_context_chars)
+# Presupuesto total del prompt (tokens estimados), configurable en la UI
+if "prompt_token_budget" not in st.session_state:
+    st.session_state.prompt_token_budget = prompt_builder.DEFAULT_TOKEN_BUDGET
+if "last_prompt_report" not in st.session_state:
+    st.session_state.last_prompt_report = []
+if "last_generation_stats" not in st.session_state:
+    st.session_state.last_generation_stats = None
+if "hedge_delay" not in st.session_state:
+    st.session_state.hedge_delay = generation.HEDGE_DELAY
+
+# Cargamos contexto PDF al iniciar (cacheado). El progreso de la extracción se ve en la barra lateral.
+with st.sidebar:
+    library_progress = st.empty()
+
+def show_library_progress(done, total, label):
+    if total:
+        library_progress.progress(done / total, text=f"📚 Biblioteca: {label} ({done}/{total})")
+
+# Solo se extraen los archivos nuevos o modificados; el resto ya está en memoria
+library_state = get_library_state()
+pdf_renderer = get_pdf_renderer()
+library_state.sync(progress=show_library_progress)
+library_index, library_count = library_state.index(), len(library_state)
+library_progress.empty()
+
+# --- Helper: Prompt de Planificación ---
+def build_plan_prompt(eq_data, sel_tipo, prompt, history_messages=(), selected_prev_plan_content="", relevant_plans=(), library_index=None):
+    """Arma el prompt completo de una planificación. Devuelve (prompt, informe de secciones)."""
+    # --- CONSTRUCCIÓN DEL CONTEXTO RAG ---
+    # Definir instrucciones de formato según el tipo de plan
+    format_instructions = ""
+    
+    # --- TIPO 1: MACRO PLANES (ANUAL / SEMESTRAL) ---
+    if sel_tipo in ["Anual", "Semestral"]:
+        format_instructions = """
+        FORMATO OBLIGATORIO (MACRO - VISIÓN GENERAL):
+        1. Breve Introducción del ciclo.
+        2. TABLA ÚNICA (Fases y Objetivos):
+           | FASE | MES | OBJETIVO GENERAL | CAPACIDADES (Fuerza, Velocidad, Resistencia) |
+        
+        PROHIBIDO:
+        - NO pongas ejercicios específicos.
+        - NO pongas ejemplos de microciclos ni sesiones.
+        """
+
+    # --- TIPO 2: MENSUAL ---
+    elif sel_tipo == "Mensual":
+        format_instructions = """
+        FORMATO OBLIGATORIO (MENSUAL - MATRIZ DETALLADA):
+        1. TABLA RESUMEN DE OBJETIVOS (Semana 1-4).
+        
+        2. GRAN MATRIZ DE TRABAJO (Crucial):
+        Genera una tabla detallada donde:
+        - Columnas: SEMANA 1 | SEMANA 2 | SEMANA 3 | SEMANA 4.
+        - Filas: DÍAS DE ENTRENO (Lunes, Miércoles, etc. según datos del equipo).
+        - Celdas: Contenido específico de la sesión (Foco y Ejercicio Principal).
+        
+        Ejemplo Visual:
+        | DÍA | SEMANA 1 (Adaptación) | SEMANA 2 (Carga) | ... |
+        |---|---|---|---|
+        | Lunes (Fuerza) | Circuito General con Autocargas... | Fuerza Máxima 85% 3x5... | ... |
+        
+        IMPORTANTE: Quiero ver el detalle día por día para todo el mes, no solo un resumen general.
+        """
+
+    # --- TIPO 3: SEMANAL ---
+    elif sel_tipo == "Semanal":
+        format_instructions = """
+        FORMATO OBLIGATORIO (SEMANAL - DOSIFICACIÓN DETALLADA):
+        Genera una tabla por CADA DÍA DE ENTRENO.
+        - Campos: Ejercicio | Series | Repeticiones | Pausa | Intensidad Exacta.
+        - Sé muy preciso con los números (Dosis de entreno).
+        - FOCO: Fuerza, Velocidad y HIIT detallado.
+        """
+
+    # --- TIPO 4: SESIÓN DIARIA / SEMANAL (DETALLE MATEMÁTICO) ---
+    else: 
+        format_instructions = """
+        FORMATO OBLIGATORIO (CALCULADORA VAM + TIMING INTELIGENTE):
+        
+        1. DECISIÓN DE TIMING (CRUCIAL):
+        Analiza el objetivo fisiológico y DECIDE dónde ubicar la sesión PF:
+        - CASO A (ANTES DEL TÁCTICO): Para Velocidad, Fuerza Máxima/Potencia o Pliometría (Frescura necesaria). -> DEBES INCLUIR CALENTAMIENTO (5-8 min).
+        - CASO B (DESPUÉS DEL TÁCTICO): Para Resistencia Metabólica, HIIT de fatiga o Fuerza Resistencia. -> NO INCLUYAS CALENTAMIENTO (Asume que vienen activos del táctico).
+        * INICIA TU RESPUESTA EXTRICTAMENTE CON: "**UBICACIÓN SUGERIDA:** [ANTES/DESPUÉS] del DT. **Motivo:** [Justificación breve]."
+        
+        2. VUELTA A LA CALMA (COOL DOWN):
+        - NO ASIGNES TIEMPO. Ponla SOLO como una nota al pie ("Sugerencia: Estirar..."). 
+        - Tiempo asignado: 0 MINUTOS. (No restes tiempo de la sesión principal).
+
+        3. ESTRUCTURA CENTRAL (HIIT/Resistencia):
+        Para ejercicios de Resistencia/HIIT, DEBES usar este formato exacto:
+        
+        **[Nombre Ejercicio]**
+        - Estructura: **SERIES x (REPETICIONES x TIEMPO_TRABAJO" x TIEMPO_PAUSA")**.
+        - Macro-Pausa entre Series: **TIEMPO_MACRO_PAUSA**.
+        
+        TABLA DE CARGAS (OBLIGATORIA SI HAY DATOS VAM):
+        | GRUPO | % VAM | Vel (m/s) | Distancia a Recorrer (por rep) | Logística (Conos) |
+        |---|---|---|---|---|
+        | G1 | ... | ... | ... | Ida y Vuelta: Conos a X metros |
+        
+        IMPORTANTE "LOGISTICA":
+        """
+        # Las cargas se calculan acá (vam_calculator); la IA solo copia las filas
+        load_tables = vam_calculator.precomputed_tables(eq_data, prompt)
+        if load_tables:
+            format_instructions += f"""- NO CALCULES METROS: copia las filas de las TABLAS DE CARGAS PRECALCULADAS del protocolo elegido (el "Protocolo solicitado" si existe).
+        - Si usas otra estructura, mantén las mismas velocidades por grupo y la misma lógica de conos.
+
+        TABLAS DE CARGAS PRECALCULADAS:
+{load_tables}
+        """
+        else:
+            format_instructions += """- Calcula EXACTAMENTE los metros: (Vel m/s * Tiempo Trabajo).
+        - Si es IDA Y VUELTA, divide la distancia / 2 para decir a cuántos metros poner el cono.
+        - Ejemplo: "G1 (4.5 m/s) x 15 seg = 67.5m. Logística: Ida y Vuelta (67.5m / 2) -> Conos a 33-34 metros."
+        """
+
+    # Construir contexto de planes guardados
+    # A) Si seleccionó un PLAN ESPECÍFICO en el UI, ese es el contexto REY.
+    specific_plan_context = ""
+    if selected_prev_plan_content:
+        specific_plan_context = (
+            "\n=== PLAN BASE SELECCIONADO (PRIORIDAD ABSOLUTA) ===\n"
+            "El usuario ha seleccionado explícitamente continuar o basarse en este plan previo:\n"
+            f"{selected_prev_plan_content}\n"
+            "==========================================================\n"
+        )
+    
+    # B) Si no, usamos la lista de referencia general (lo que ya teniamos)
+    saved_plans_str = ""
+    if not selected_prev_plan_content and relevant_plans:
+        saved_plans_str = "=== PLANIFICACIONES PREVIAS DEL EQUIPO (ÚLTIMAS 3) ===\n"
+        for p in relevant_plans[-3:]: # Solo las últimas 3 planificaciones para evitar límite de Tokens Gratuitos
+            # Resumen estructurado (secciones + cargas) en vez del markdown completo
+            saved_plans_str += f"\n--- TÍTULO: {p['titulo']} ---\n{plan_structure.prompt_summary(p)}\n"
+        saved_plans_str += "======================================================================\n"
+
+    # Fragmentos de la biblioteca relevantes para la solicitud, el tipo de plan y el nivel
+    library_query = f"{prompt} {sel_tipo} {eq_data.get('nivel', '')}"
+    library_text = retrieval.build_context(library_index, library_query, st.session_state.max_context_chars)
+
+    # Construir historial (Contexto): últimos turnos literales + resumen de los anteriores
+    history_str = prompt_builder.compact_history(history_messages)
+
+    # Definir ROL y CONTEXTO según tipo de plan
+    if sel_tipo == "Sesión Diaria":
+        role_instruction = "ERES UN PREPARADOR FISICO EXPERTO EN FUTSAL. TIENES 30 MINUTOS POR DEFECTO (SALVO QUE EL USUARIO INDIQUE OTRO TIEMPO)."
+    else:
+        role_instruction = f"ERES EL DIRECTOR DE RENDIMIENTO DEL CLUB. TU OBJETIVO ES DISEÑAR UNA PLANIFICACION {sel_tipo.upper()} ESTRUCTURAL Y COHERENTE."
+
+    # ==========================================
+    # CONSTRUCCION DE PROMPT (SIN TRIPLE COMILLAS PARA EVITAR ERRORES)
+    # Cada sección entra según prioridad dentro del presupuesto total de tokens:
+    # plan base > equipo > biblioteca > historial > planes previos.
+    # ==========================================
+    builder = prompt_builder.PromptBuilder(st.session_state.prompt_token_budget)
+    builder.add("Rol", role_instruction)
+    
+    builder.add("Plan base", specific_plan_context, priority=1)
+    
+    builder.add(
+        "Biblioteca", library_text, priority=3,
+        header="=== BIBLIOTECA TECNICA (Contexto Real de Archivos) ===",
+        footer="(Nota: Fragmentos seleccionados por relevancia para esta solicitud, usa esto como base teorica prioritaria).\n=====================================================",
+    )
+    
+    builder.add("Planes previos", saved_plans_str, priority=5, max_tokens=6000)
+    
+    team_parts = []
+    team_parts.append("CONTEXTO EQUIPO:")
+    team_parts.append(f"- Equipo: {eq_data.get('categoria')} (Nivel {eq_data.get('nivel')})")
+    team_parts.append(f"- Jugadores: {eq_data.get('cantidad')}")
+    team_parts.append(f"- Dias Entreno: {eq_data.get('dias')}")
+    team_parts.append(f"- Dias Partido: {eq_data.get('dias_partido')}")
+    team_parts.append(f"- Tiempo: {eq_data.get('tiempo')}")
+    team_parts.append(f"- Recursos Disponibles: {eq_data.get('materiales')}")
+    team_parts.append(f"- Sanidad: {eq_data.get('lesiones')}")
+    # Filtrar datos físicos vacíos (0.0) para no ensuciar el prompt
+    def format_pdata(label, data):
+        if not data: return ""
+        # Si todos son 0, retornar vacio
+        if all(v == 0 for v in data.values()): return ""
+        return f"{label}: {data}"
+
+    phys_info = []
+    phys_info.append(f"VAM: {eq_data.get('vam')}") # VAM siempre
+    
+    p_vel = format_pdata("Velocidad", eq_data.get('velocidad'))
+    if p_vel: phys_info.append(p_vel)
+    
+    p_rsa = format_pdata("RSA", eq_data.get('rsa'))
+    if p_rsa: phys_info.append(p_rsa)
+
+    team_parts.append(f"- DATOS FISICOS: {', '.join(phys_info)} (Todo en m/s).")
+    if eq_data.get("jugadores", {}).get("nombre"):
+        labels, _ = player_groups.compute_groups(eq_data["jugadores"], eq_data.get("n_grupos", player_groups.DEFAULT_GROUPS), eq_data.get("agrupar_por", "vam"))
+        members = player_groups.group_members(eq_data["jugadores"], labels)
+        if members:
+            groups_str = "; ".join(f"{g.upper()}: {', '.join(names)}" for g, names in members.items())
+            team_parts.append(f"- GRUPOS DE ENTRENAMIENTO: {groups_str}")
+    builder.add("Equipo", "\n".join(team_parts), priority=2)
+    
+    builder.add(
+        "Historial", history_str, priority=4, max_tokens=8000, keep="end",
+        header="=== HISTORIAL DE CONVERSACION (MEMORIA) ===",
+        footer="===========================================",
+    )
+    
+    sys_parts = []
+    sys_parts.append(f"TAREA ACTUAL: Crear planificacion {sel_tipo}.")
+    
+    sys_parts.append("REGLAS DE ORO (CRITICAS):")
+    sys_parts.append("1. MATERIALES Y FUERZA (MUY IMPORTANTE):")
+    sys_parts.append('   - Revisa "Recursos Disponibles".')
+    sys_parts.append("   - SI NO HAY GIMNASIO/PESAS: PROHIBIDO poner Fuerza Maxima o Hipertrofia pesada en cancha. Haz trabajos de fuerza preventiva/reactiva con peso corporal.")
+    sys_parts.append('   - SUGERENCIA EXTERNA: Si toca fuerza pesada y no hay material, añade una nota: "Recomendado realizar trabajo de gimnasio individual fuera de sesion".')
+    
+    sys_parts.append(f"2. FORMATO SEGUN TIPO: {format_instructions}")
+    
+    sys_parts.append("3. ROL PF: Prioridad a la Dosis Fisica Exacta. Tiempo base 30 min (o lo que pida el usuario).")
+    sys_parts.append("4. ROL DT: Solo sugiere intensidad/tipo de SSG si aplica.")
+    sys_parts.append(f"5. INTENSIDAD: Resistencia SIEMPRE en % de VAM ({eq_data.get('vam')} m/s).")
+    sys_parts.append("6. CONTINUIDAD: Si existen PLANES PREVIOS GUARDADOS, usalos como base para mantener coherencia (ej. si hay un mensual, respetalo al hacer la semana).")
+    sys_parts.append("7. FORMATO VISUAL: PROHIBIDO USAR LATEX EN TABLAS (ej. no uses \\multirow, \\multicolumn). Usa tablas Markdown estandar.")
+    
+    sys_parts.append(f"Solicitud Usuario: {prompt}")
+    builder.add("Tarea y reglas", "\n".join(sys_parts))
+    
+    return builder.build()
+
+# --- Helper: Control de Carga ---
+@st.cache_data(show_spinner=False)
+def compute_load_metrics(sessions):
+    """Métricas diarias (ACWR, monotonía, strain) y carga semanal; se recalcula solo si cambian las sesiones."""
+    return load_analytics.load_metrics(sessions), load_analytics.weekly_load(load_analytics.daily_load(sessions))
+
+# --- Helper: Fragmentos ---
+# Cada pestaña (y dentro de "Mis Planificaciones" el refinado, la descarga y la exportación)
+# es un fragmento: un widget suyo vuelve a ejecutar solo ese fragmento, no toda la app.
+# Lo compartido (equipos, planes, cargas, biblioteca) se pasa como argumento; lo que cambia
+# datos que usan otras pestañas termina con st.rerun() completo.
+def log_rerun(name, seconds):
+    print(f"[rerun] {name}: {seconds * 1000:.0f} ms")
+
+def timed_fragment(name):
+    """st.fragment que además registra cuánto tarda cada ejecución."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                log_rerun(name, time.perf_counter() - start)
+        return st.fragment(timed)
+    return decorator
+
+def rerun_fragment():
+    """Vuelve a ejecutar solo el fragmento actual (toda la app si esta ejecución ya es completa)."""
+    try:
+        st.rerun(scope="fragment")
+    except st.errors.StreamlitAPIException:
+        st.rerun()
 
 # --- Layout ---
 # Header con Logo y Título
@@ -456,14 +636,16 @@ with c_logo:
 with c_title:
     st.markdown('<h1 class="main-header" style="text-align: left; margin-top: 0;">Planificador Físico Futsal</h1>', unsafe_allow_html=True)
 
-tab1, tab2, tab3 = st.tabs(["🏢 Gestión de Club", "📋 Planificador IA (Chat)", "🗂️ Mis Planificaciones"])
+tab1, tab2, tab3, tab4 = st.tabs(["🏢 Gestión de Club", "📋 Planificador IA (Chat)", "🗂️ Mis Planificaciones", "📈 Control de Carga"])
 
 # --- TAB 1: GESTIÓN DE CLUB ---
-with tab1:
+@timed_fragment("equipos")
+def team_panel(equipos):
+    """Alta, edición y borrado de equipos (datos, tests, plantilla y grupos)."""
     st.markdown('<h2 class="section-header">Gestión de Equipos</h2>', unsafe_allow_html=True)
     
     c_sel, c_del = st.columns([4, 1])
-    opciones = ["Nueva Categoría"] + [e["categoria"] for e in st.session_state.equipos]
+    opciones = ["Nueva Categoría"] + [e["categoria"] for e in equipos]
     seleccion = c_sel.selectbox("Seleccionar Categoría:", opciones)
     
     equipo_actual = {}
@@ -475,12 +657,12 @@ with tab1:
         if st.session_state.confirm_delete:
             st.warning(f"¿Eliminar '{seleccion}'?")
             if st.button("✅ Confirmar Eliminación"):
-                st.session_state.equipos = [e for e in st.session_state.equipos if e["categoria"] != seleccion]
-                save_json(DB_EQUIPOS, st.session_state.equipos)
+                st.session_state.equipos = [e for e in equipos if e["categoria"] != seleccion]
+                save_json(DB_EQUIPOS, st.session_state.equipos, removed=[seleccion])
                 st.session_state.confirm_delete = False
                 st.rerun()
 
-        for i, eq in enumerate(st.session_state.equipos):
+        for i, eq in enumerate(equipos):
             if eq["categoria"] == seleccion:
                 equipo_actual = eq
                 idx_actual = i
@@ -515,10 +697,10 @@ with tab1:
                 return {"g1": 0.0, "g2": 0.0, "g3": 0.0}
             # Generar KEY única combinando etiqueta y nombre de categoría para forzar refresco
             unique_suffix = f"{k}_{equipo_actual.get('categoria', 'new')}"
+            # Con plantilla puede haber más de 3 grupos (se calculan al guardar)
             return {
-                "g1": st.number_input(f"G1", key=f"{unique_suffix}_1", value=float(d.get("g1", 0.0)), format="%.2f"),
-                "g2": st.number_input(f"G2", key=f"{unique_suffix}_2", value=float(d.get("g2", 0.0)), format="%.2f"),
-                "g3": st.number_input(f"G3", key=f"{unique_suffix}_3", value=float(d.get("g3", 0.0)), format="%.2f")
+                g: st.number_input(g.upper(), key=f"{unique_suffix}_{g[1:]}", value=float(d.get(g, 0.0)), format="%.2f")
+                for g in vam_calculator.group_keys(d)
             }
         
         with t1: 
@@ -537,6 +719,25 @@ with tab1:
                 rsa = {"g1": 0.0, "g2": 0.0, "g3": 0.0}
                 st.info("RSA: Desactivado")
             
+        st.markdown("### 👥 Plantilla (Tests por Jugador)")
+        st.caption("Si cargas los tests de cada jugador, los grupos y sus velocidades se calculan automáticamente al guardar (reemplazan los valores de arriba).")
+        roster = equipo_actual.get("jugadores") or player_groups.empty_roster()
+        c_r1, c_r2 = st.columns(2)
+        n_grupos = c_r1.number_input("Nº de Grupos", min_value=2, max_value=player_groups.MAX_GROUPS, value=equipo_actual.get("n_grupos", player_groups.DEFAULT_GROUPS))
+        test_labels = {"vam": "VAM", "velocidad": "Velocidad Max", "rsa": "RSA"}
+        agrupar_por = c_r2.selectbox("Agrupar por", list(test_labels), format_func=test_labels.get, index=list(test_labels).index(equipo_actual.get("agrupar_por", "vam")))
+        roster_df = st.data_editor(
+            player_groups.roster_frame(roster),
+            key=f"roster_{equipo_actual.get('categoria', 'new')}",
+            num_rows="dynamic", use_container_width=True,
+            column_config={
+                "nombre": st.column_config.TextColumn("Jugador"),
+                "vam": st.column_config.NumberColumn("VAM (m/s)", min_value=0.0, format="%.2f"),
+                "velocidad": st.column_config.NumberColumn("Vel Max (m/s)", min_value=0.0, format="%.2f"),
+                "rsa": st.column_config.NumberColumn("RSA (m/s)", min_value=0.0, format="%.2f"),
+            },
+        )
+            
         st.markdown("### 🚑 Parte Médico")
         lesiones = st.text_area("Lesionados", value=equipo_actual.get("lesiones", "Sin novedades"))
         
@@ -547,23 +748,45 @@ with tab1:
                 new_data = {
                     "categoria": nombre_cat, "profe": profe, "nivel": nivel, "cantidad": cant_jugadors,
                     "dias": dias_entreno, "dias_partido": dias_partido, "tiempo": tiempo_disp, 
-                    "materiales": materiales, "velocidad": vel, "vam": vam, "rsa": rsa, "lesiones": lesiones
+                    "materiales": materiales, "velocidad": vel, "vam": vam, "rsa": rsa, "lesiones": lesiones,
+                    "jugadores": player_groups.roster_from_frame(roster_df),
+                    "n_grupos": int(n_grupos), "agrupar_por": agrupar_por
                 }
-                if idx_actual >= 0: st.session_state.equipos[idx_actual] = new_data
-                else: st.session_state.equipos.append(new_data)
-                save_json(DB_EQUIPOS, st.session_state.equipos)
+                # Los tests con datos por jugador reemplazan a los G1/G2/G3 cargados a mano
+                _, group_speeds = player_groups.compute_groups(new_data["jugadores"], new_data["n_grupos"], agrupar_por)
+                new_data.update(group_speeds)
+                if idx_actual >= 0: equipos[idx_actual] = new_data
+                else: equipos.append(new_data)
+                # Si cambió el nombre, la fila vieja (clave = categoría) se borra
+                renamed = [equipo_actual["categoria"]] if idx_actual >= 0 and equipo_actual["categoria"] != nombre_cat else []
+                save_json(DB_EQUIPOS, equipos, changed=[new_data], removed=renamed)
                 st.success("Guardado")
                 st.rerun()
 
+    # Grupos actuales de la plantilla guardada (k-means vectorizado, instantáneo en cada rerun)
+    if equipo_actual.get("jugadores", {}).get("nombre"):
+        saved_by = equipo_actual.get("agrupar_por", "vam")
+        labels, _ = player_groups.compute_groups(equipo_actual["jugadores"], equipo_actual.get("n_grupos", player_groups.DEFAULT_GROUPS), saved_by)
+        members = player_groups.group_members(equipo_actual["jugadores"], labels)
+        if members:
+            with st.expander(f"👥 Grupos por {saved_by.upper()} ({len(labels)} jugadores)"):
+                for g, names in members.items():
+                    st.markdown(f"**{g.upper()}** ({equipo_actual.get(saved_by, {}).get(g, 0):.2f} m/s): {', '.join(names)}")
+
+with tab1:
+    team_panel(st.session_state.equipos)
+
 # --- TAB 2: CHAT ---
-with tab2:
+@timed_fragment("chat")
+def chat_panel(equipos, planes, library_state, library_index, library_count):
+    """Chat con la IA para generar planes, más la generación por lotes."""
     st.markdown('<h2 class="section-header">Asistente de Planificación</h2>', unsafe_allow_html=True)
-    if not st.session_state.equipos:
+    if not equipos:
         st.info("⚠️ Crea un equipo primero.")
     else:
         with st.container():
             c_eq, c_tp, c_ctx = st.columns(3)
-            ename = [e["categoria"] for e in st.session_state.equipos]
+            ename = [e["categoria"] for e in equipos]
             sel_eq = c_eq.selectbox("Equipo", ename)
             # Quitamos "Trimestral"
             sel_tipo = c_tp.selectbox("Tipo", ["Sesión Diaria", "Semanal", "Mensual", "Semestral", "Anual"])
@@ -574,20 +797,12 @@ with tab2:
             
             # 2. Filtrar planes por Equipo Y Tipo
             relevant_plans = []
-            for p in st.session_state.planes:
-                # Chequeo de Equipo
-                if sel_eq not in p['titulo']: continue
+            for p in planes:
+                # Equipo y tipo detectados al guardar (ver plan_structure)
+                p_struct = p["estructura"]
+                if p_struct["equipo"] != sel_eq: continue
                 
-                # Chequeo de Tipo
-                p_tipo = p.get("tipo", "")
-                if not p_tipo: # Retro-compatibilidad: buscar en título
-                    if "Mensual" in p['titulo']: p_tipo = "Mensual"
-                    elif "Semanal" in p['titulo']: p_tipo = "Semanal"
-                    elif "Semestral" in p['titulo']: p_tipo = "Semestral"
-                    elif "Anual" in p['titulo']: p_tipo = "Anual"
-                    elif "Diaria" in p['titulo']: p_tipo = "Sesión Diaria"
-                
-                if filtro_tipo_ctx == "Todos" or filtro_tipo_ctx == p_tipo:
+                if filtro_tipo_ctx == "Todos" or filtro_tipo_ctx == p_struct["tipo"]:
                     relevant_plans.append(p)
 
             plan_opts = {f"{p['titulo']}": p for p in relevant_plans}
@@ -600,17 +815,20 @@ with tab2:
                 selected_prev_plan_content = plan_opts[sel_plan_key]["contenido"]
                 st.info(f"🔗 Usando plan base: {sel_plan_key}")
 
-            eq_data = next((e for e in st.session_state.equipos if e["categoria"] == sel_eq), {})
+            eq_data = next((e for e in equipos if e["categoria"] == sel_eq), {})
         
         # Mostrar info de biblioteca
         if library_count > 0:
             st.caption(f"📚 {library_count} Documentos cargados. Longitud límite actual: {st.session_state.max_context_chars} caracteres.")
+            dedup = library_state.dedup_report
+            if dedup["chars_saved"]:
+                st.caption(f"♻️ Duplicados omitidos: {dedup['duplicate_files']} archivos y {dedup['duplicate_passages']} pasajes ({dedup['chars_saved']:,} caracteres ahorrados).")
         else:
             st.caption("⚠️ No se detectaron documentos en 'biblioteca_futsal'. Se usará conocimiento general.")
 
         # === SLIDER DE TOKENS VISIBLE AQUÍ ===
         with st.expander("⚙️ Opciones de Consumo de IA (Límites de Lectura)", expanded=True):
-            st.markdown("Si tienes el error **Quota 429**, baja radicalmente esta barra a 0 o a 1000.")
+            st.markdown("Las solicitudes se encolan automáticamente si se alcanza la cuota. Si aun así ves el error **Quota 429**, baja esta barra a 0 o a 1000.")
             nuevo_limite = st.slider(
                 "Límite de lectura de libros (Caracteres)", 
                 min_value=0, 
@@ -620,15 +838,108 @@ with tab2:
                 help="Limita lo que la IA lee de tus libros para ahorrar cuota de la API gratuita."
             )
             if nuevo_limite != st.session_state.max_context_chars:
+                # El límite se aplica al recuperar fragmentos: no hace falta recargar la biblioteca
                 st.session_state.max_context_chars = nuevo_limite
-                # Limpiamos caché forzadamente y recargamos
-                st.cache_resource.clear()
+                rerun_fragment()
+            st.session_state.prompt_token_budget = st.number_input(
+                "Presupuesto total del prompt (tokens estimados)",
+                min_value=2000,
+                max_value=500000,
+                value=st.session_state.prompt_token_budget,
+                step=2000,
+                help="Tope de todo lo que se envía a la IA. Si no cabe, se recortan primero los planes previos, luego el historial y la biblioteca."
+            )
+            st.session_state.hedge_delay = st.number_input(
+                "Espera antes de probar otro modelo (segundos)",
+                min_value=1.0,
+                max_value=60.0,
+                value=float(st.session_state.hedge_delay),
+                step=1.0,
+                help="Si el modelo preferido no empieza a responder en este tiempo, se lanza el siguiente en paralelo y gana el más rápido."
+            )
+            if st.session_state.last_prompt_report:
+                used = sum(r["tokens"] for r in st.session_state.last_prompt_report)
+                st.caption(f"🧮 Último prompt: ~{used:,} tokens de {st.session_state.prompt_token_budget:,}")
+                st.dataframe(pd.DataFrame(st.session_state.last_prompt_report), hide_index=True, use_container_width=True)
+            if st.button("🔄 Reindexar biblioteca", help="Vuelve a leer la carpeta biblioteca_futsal sin borrar el resto de datos en caché."):
+                library_state.clear()
                 st.rerun()
         # =====================================
 
+        # === GENERACIÓN POR LOTES (N equipos x M períodos) ===
+        with st.expander("📦 Generación por Lotes (varios equipos y períodos)"):
+            with st.form("form_lote"):
+                b_teams = st.multiselect("Equipos", ename, default=ename)
+                b_tipo = st.selectbox("Tipo de plan", ["Sesión Diaria", "Semanal", "Mensual", "Semestral", "Anual"], index=1)
+                b_periods = st.text_area("Períodos (uno por línea)", value="Semana 1\nSemana 2\nSemana 3\nSemana 4")
+                b_extra = st.text_area("Indicaciones comunes (opcional)", placeholder="Ej: Mes de pretemporada, foco en resistencia...")
+                b_workers = st.slider("Generaciones en paralelo", min_value=1, max_value=8, value=generation.BATCH_WORKERS)
+                run_lote = st.form_submit_button("🚀 Generar Lote")
+            
+            if run_lote:
+                periods = [line.strip() for line in b_periods.splitlines() if line.strip()]
+                jobs = []
+                for team in b_teams:
+                    team_data = next((e for e in equipos if e["categoria"] == team), {})
+                    team_plans = [p for p in planes if p["estructura"]["equipo"] == team]
+                    for period in periods:
+                        request = f"Planificacion {b_tipo} para: {period}."
+                        if b_extra:
+                            request += f" {b_extra}"
+                        batch_prompt, _ = build_plan_prompt(team_data, b_tipo, request, relevant_plans=team_plans, library_index=library_index)
+                        jobs.append(((team, period), batch_prompt))
+                
+                if not jobs:
+                    st.error("Elige al menos un equipo y un período.")
+                else:
+                    batch_bar = st.progress(0.0, text=f"0/{len(jobs)}")
+                    def show_batch_progress(done, total, key, error):
+                        mark = "❌" if error else "✅"
+                        batch_bar.progress(done / total, text=f"{done}/{total} · {mark} {key[0]} | {key[1]}")
+                    
+                    results, errors, elapsed = generation.run_batch(
+                        jobs, max_workers=b_workers, on_progress=show_batch_progress,
+                        hedge_delay=st.session_state.hedge_delay,
+                    )
+                    
+                    # Guardar en el orden pedido, con las mismas convenciones de título/tipo que el chat
+                    today = datetime.date.today()
+                    new_plans = []
+                    for key, _ in jobs:
+                        if key in results:
+                            team, period = key
+                            new_plan = {
+                                "id": str(uuid.uuid4()),
+                                "titulo": f"{b_tipo} - {team} | {period} ({today})",
+                                "tipo": b_tipo,
+                                "fecha": str(today),
+                                "contenido": results[key][0]
+                            }
+                            plan_structure.ensure_structure(new_plan, team_names())
+                            new_plans.append(new_plan)
+                    st.session_state.batch_report = (len(results), len(jobs), elapsed, {key: str(e) for key, e in errors.items()})
+                    if new_plans:
+                        planes.extend(new_plans)
+                        save_json(DB_PLANES, planes, changed=new_plans)
+                        # Los planes nuevos tienen que aparecer en "Mis Planificaciones" y en Control de Carga
+                        st.rerun()
+
+            if st.session_state.get("batch_report"):
+                n_ok, n_jobs, elapsed, errors = st.session_state.batch_report
+                st.success(f"✅ {n_ok}/{n_jobs} planes generados y guardados en {elapsed:.1f}s.")
+                for (team, period), error in errors.items():
+                    st.error(f"❌ {team} | {period}: {error}")
+
         # Chat logic
         for msg in st.session_state.messages:
             with st.chat_message(msg["role"]): st.markdown(msg["content"])
+        
+        gen_stats = st.session_state.last_generation_stats
+        if gen_stats and st.session_state.messages:
+            if gen_stats.get("cached"):
+                st.caption(f"⚡ {gen_stats['model']} · respuesta desde caché (usa 🔁 Regenerar para pedir una nueva)")
+            else:
+                st.caption(f"⚡ {gen_stats['model']} · primer token {gen_stats['ttft']:.1f}s · total {gen_stats['total']:.1f}s")
             
         if st.session_state.messages and st.session_state.messages[-1]["role"] == "assistant":
             with st.expander("💾 Guardar esta Planificación (Opcional)", expanded=True):
@@ -644,203 +955,47 @@ with tab2:
                         final_title += f" | {custom_label}"
                     final_title += f" ({datetime.date.today()})"
                     
-                    st.session_state.planes.append({
+                    new_plan = {
                         "id": pid, 
                         "titulo": final_title,
                         "tipo": sel_tipo, # Guardamos el tipo explícitamente
                         "fecha": str(datetime.date.today()), 
                         "contenido": st.session_state.messages[-1]["content"]
-                    })
-                    save_json(DB_PLANES, st.session_state.planes)
+                    }
+                    # Se parsea una sola vez al guardar (secciones, tablas de cargas, metadatos)
+                    plan_structure.ensure_structure(new_plan, team_names())
+                    planes.append(new_plan)
+                    save_json(DB_PLANES, planes, changed=[new_plan])
                     st.success(f"✅ Guardado como: {final_title}")
                     # Limpiar chat tras guardar para evitar scroll infinito
                     if st.session_state.messages and st.session_state.messages[-1]["role"] == "assistant":
                         st.session_state.messages.pop()
                     st.rerun()
+            
+            # Regenerar: reenviar la última solicitud ignorando la caché de respuestas
+            if st.button("🔁 Regenerar respuesta", help="Vuelve a pedir la respuesta a la IA sin usar la caché."):
+                st.session_state.messages.pop()
+                if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
+                    st.session_state.regenerate_prompt = st.session_state.messages.pop()["content"]
+                rerun_fragment()
 
-        if prompt := st.chat_input("Escribe tu solicitud..."):
+        prompt = st.chat_input("Escribe tu solicitud...")
+        use_cache = True
+        if not prompt and st.session_state.get("regenerate_prompt"):
+            prompt = st.session_state.pop("regenerate_prompt")
+            use_cache = False
+        if prompt:
             st.session_state.messages.append({"role": "user", "content": prompt})
             with st.chat_message("user"): st.markdown(prompt)
             
-            # --- CONSTRUCCIÓN DEL CONTEXTO RAG ---
-            # Definir instrucciones de formato según el tipo de plan
-            format_instructions = ""
-            
-            # --- TIPO 1: MACRO PLANES (ANUAL / SEMESTRAL) ---
-            if sel_tipo in ["Anual", "Semestral"]:
-                format_instructions = """
-                FORMATO OBLIGATORIO (MACRO - VISIÓN GENERAL):
-                1. Breve Introducción del ciclo.
-                2. TABLA ÚNICA (Fases y Objetivos):
-                   | FASE | MES | OBJETIVO GENERAL | CAPACIDADES (Fuerza, Velocidad, Resistencia) |
-                
-                PROHIBIDO:
-                - NO pongas ejercicios específicos.
-                - NO pongas ejemplos de microciclos ni sesiones.
-                """
-
-            # --- TIPO 2: MENSUAL ---
-            elif sel_tipo == "Mensual":
-                format_instructions = """
-                FORMATO OBLIGATORIO (MENSUAL - MATRIZ DETALLADA):
-                1. TABLA RESUMEN DE OBJETIVOS (Semana 1-4).
-                
-                2. GRAN MATRIZ DE TRABAJO (Crucial):
-                Genera una tabla detallada donde:
-                - Columnas: SEMANA 1 | SEMANA 2 | SEMANA 3 | SEMANA 4.
-                - Filas: DÍAS DE ENTRENO (Lunes, Miércoles, etc. según datos del equipo).
-                - Celdas: Contenido específico de la sesión (Foco y Ejercicio Principal).
-                
-                Ejemplo Visual:
-                | DÍA | SEMANA 1 (Adaptación) | SEMANA 2 (Carga) | ... |
-                |---|---|---|---|
-                | Lunes (Fuerza) | Circuito General con Autocargas... | Fuerza Máxima 85% 3x5... | ... |
-                
-                IMPORTANTE: Quiero ver el detalle día por día para todo el mes, no solo un resumen general.
-                """
-
-            # --- TIPO 3: SEMANAL ---
-            elif sel_tipo == "Semanal":
-                format_instructions = """
-                FORMATO OBLIGATORIO (SEMANAL - DOSIFICACIÓN DETALLADA):
-                Genera una tabla por CADA DÍA DE ENTRENO.
-                - Campos: Ejercicio | Series | Repeticiones | Pausa | Intensidad Exacta.
-                - Sé muy preciso con los números (Dosis de entreno).
-                - FOCO: Fuerza, Velocidad y HIIT detallado.
-                """
-
-            # --- TIPO 4: SESIÓN DIARIA / SEMANAL (DETALLE MATEMÁTICO) ---
-            else: 
-                format_instructions = """
-                FORMATO OBLIGATORIO (CALCULADORA VAM + TIMING INTELIGENTE):
-                
-                1. DECISIÓN DE TIMING (CRUCIAL):
-                Analiza el objetivo fisiológico y DECIDE dónde ubicar la sesión PF:
-                - CASO A (ANTES DEL TÁCTICO): Para Velocidad, Fuerza Máxima/Potencia o Pliometría (Frescura necesaria). -> DEBES INCLUIR CALENTAMIENTO (5-8 min).
-                - CASO B (DESPUÉS DEL TÁCTICO): Para Resistencia Metabólica, HIIT de fatiga o Fuerza Resistencia. -> NO INCLUYAS CALENTAMIENTO (Asume que vienen activos del táctico).
-                * INICIA TU RESPUESTA EXTRICTAMENTE CON: "**UBICACIÓN SUGERIDA:** [ANTES/DESPUÉS] del DT. **Motivo:** [Justificación breve]."
-                
-                2. VUELTA A LA CALMA (COOL DOWN):
-                - NO ASIGNES TIEMPO. Ponla SOLO como una nota al pie ("Sugerencia: Estirar..."). 
-                - Tiempo asignado: 0 MINUTOS. (No restes tiempo de la sesión principal).
-
-                3. ESTRUCTURA CENTRAL (HIIT/Resistencia):
-                Para ejercicios de Resistencia/HIIT, DEBES usar este formato exacto:
-                
-                **[Nombre Ejercicio]**
-                - Estructura: **SERIES x (REPETICIONES x TIEMPO_TRABAJO" x TIEMPO_PAUSA")**.
-                - Macro-Pausa entre Series: **TIEMPO_MACRO_PAUSA**.
-                
-                TABLA DE CARGAS (OBLIGATORIA SI HAY DATOS VAM):
-                | GRUPO | % VAM | Vel (m/s) | Distancia a Recorrer (por rep) | Logística (Conos) |
-                |---|---|---|---|---|
-                | G1 | ... | ... | ... | Ida y Vuelta: Conos a X metros |
-                
-                IMPORTANTE "LOGISTICA":
-                - Calcula EXACTAMENTE los metros: (Vel m/s * Tiempo Trabajo).
-                - Si es IDA Y VUELTA, divide la distancia / 2 para decir a cuántos metros poner el cono.
-                - Ejemplo: "G1 (4.5 m/s) x 15 seg = 67.5m. Logística: Ida y Vuelta (67.5m / 2) -> Conos a 33-34 metros."
-                """
-
-            # Construir contexto de planes guardados
-            # A) Si seleccionó un PLAN ESPECÍFICO en el UI, ese es el contexto REY.
-            specific_plan_context = ""
-            if selected_prev_plan_content:
-                specific_plan_context = (
-                    "\n=== PLAN BASE SELECCIONADO (PRIORIDAD ABSOLUTA) ===\n"
-                    "El usuario ha seleccionado explícitamente continuar o basarse en este plan previo:\n"
-                    f"{selected_prev_plan_content}\n"
-                    "==========================================================\n"
-                )
-            
-            # B) Si no, usamos la lista de referencia general (lo que ya teniamos)
-            saved_plans_str = ""
-            if not selected_prev_plan_content and relevant_plans:
-                saved_plans_str = "=== PLANIFICACIONES PREVIAS DEL EQUIPO (ÚLTIMAS 3) ===\n"
-                for p in relevant_plans[-3:]: # Solo las últimas 3 planificaciones para evitar límite de Tokens Gratuitos
-                    saved_plans_str += f"\n--- TÍTULO: {p['titulo']} ---\n{p['contenido']}\n"
-                saved_plans_str += "======================================================================\n"
-
-            # Construir historial (Contexto)
-            history_str = ""
-            for msg in st.session_state.messages[:-1]:
-                r = "USUARIO" if msg["role"] == "user" else "ASISTENTE"
-                history_str += f"{r}: {msg['content']}\n\n"
-
-            # Definir ROL y CONTEXTO según tipo de plan
-            if sel_tipo == "Sesión Diaria":
-                role_instruction = "ERES UN PREPARADOR FISICO EXPERTO EN FUTSAL. TIENES 30 MINUTOS POR DEFECTO (SALVO QUE EL USUARIO INDIQUE OTRO TIEMPO)."
-            else:
-                role_instruction = f"ERES EL DIRECTOR DE RENDIMIENTO DEL CLUB. TU OBJETIVO ES DISEÑAR UNA PLANIFICACION {sel_tipo.upper()} ESTRUCTURAL Y COHERENTE."
-
-            # ==========================================
-            # CONSTRUCCION DE PROMPT (SIN TRIPLE COMILLAS PARA EVITAR ERRORES)
-            # ==========================================
-            sys_parts = []
-            sys_parts.append(f"{role_instruction}")
-            
-            if specific_plan_context:
-                sys_parts.append(specific_plan_context)
-            
-            if library_text:
-                sys_parts.append("=== BIBLIOTECA TECNICA (Contexto Real de Archivos) ===")
-                # Asegurar envío acorde al slider
-                sys_parts.append(f"{library_text}")
-                sys_parts.append("(Nota: Texto truncado si es excesivo, usa esto como base teorica prioritaria).")
-                sys_parts.append("=====================================================")
-            
-            if saved_plans_str:
-                sys_parts.append(saved_plans_str)
-            
-            sys_parts.append("CONTEXTO EQUIPO:")
-            sys_parts.append(f"- Equipo: {eq_data.get('categoria')} (Nivel {eq_data.get('nivel')})")
-            sys_parts.append(f"- Jugadores: {eq_data.get('cantidad')}")
-            sys_parts.append(f"- Dias Entreno: {eq_data.get('dias')}")
-            sys_parts.append(f"- Dias Partido: {eq_data.get('dias_partido')}")
-            sys_parts.append(f"- Tiempo: {eq_data.get('tiempo')}")
-            sys_parts.append(f"- Recursos Disponibles: {eq_data.get('materiales')}")
-            sys_parts.append(f"- Sanidad: {eq_data.get('lesiones')}")
-            # Filtrar datos físicos vacíos (0.0) para no ensuciar el prompt
-            def format_pdata(label, data):
-                if not data: return ""
-                # Si todos son 0, retornar vacio
-                if all(v == 0 for v in data.values()): return ""
-                return f"{label}: {data}"
-
-            phys_info = []
-            phys_info.append(f"VAM: {eq_data.get('vam')}") # VAM siempre
-            
-            p_vel = format_pdata("Velocidad", eq_data.get('velocidad'))
-            if p_vel: phys_info.append(p_vel)
-            
-            p_rsa = format_pdata("RSA", eq_data.get('rsa'))
-            if p_rsa: phys_info.append(p_rsa)
-
-            sys_parts.append(f"- DATOS FISICOS: {', '.join(phys_info)} (Todo en m/s).")
-            
-            sys_parts.append("=== HISTORIAL DE CONVERSACION (MEMORIA) ===")
-            sys_parts.append(f"{history_str}")
-            sys_parts.append("===========================================")
-            
-            sys_parts.append(f"TAREA ACTUAL: Crear planificacion {sel_tipo}.")
-            
-            sys_parts.append("REGLAS DE ORO (CRITICAS):")
-            sys_parts.append("1. MATERIALES Y FUERZA (MUY IMPORTANTE):")
-            sys_parts.append('   - Revisa "Recursos Disponibles".')
-            sys_parts.append("   - SI NO HAY GIMNASIO/PESAS: PROHIBIDO poner Fuerza Maxima o Hipertrofia pesada en cancha. Haz trabajos de fuerza preventiva/reactiva con peso corporal.")
-            sys_parts.append('   - SUGERENCIA EXTERNA: Si toca fuerza pesada y no hay material, añade una nota: "Recomendado realizar trabajo de gimnasio individual fuera de sesion".')
-            
-            sys_parts.append(f"2. FORMATO SEGUN TIPO: {format_instructions}")
-            
-            sys_parts.append("3. ROL PF: Prioridad a la Dosis Fisica Exacta. Tiempo base 30 min (o lo que pida el usuario).")
-            sys_parts.append("4. ROL DT: Solo sugiere intensidad/tipo de SSG si aplica.")
-            sys_parts.append(f"5. INTENSIDAD: Resistencia SIEMPRE en % de VAM ({eq_data.get('vam')} m/s).")
-            sys_parts.append("6. CONTINUIDAD: Si existen PLANES PREVIOS GUARDADOS, usalos como base para mantener coherencia (ej. si hay un mensual, respetalo al hacer la semana).")
-            sys_parts.append("7. FORMATO VISUAL: PROHIBIDO USAR LATEX EN TABLAS (ej. no uses \\multirow, \\multicolumn). Usa tablas Markdown estandar.")
-            
-            sys_parts.append(f"Solicitud Usuario: {prompt}")
-            
-            sys = "\n".join(sys_parts)
+            sys, prompt_report = build_plan_prompt(
+                eq_data, sel_tipo, prompt,
+                history_messages=st.session_state.messages[:-1],
+                selected_prev_plan_content=selected_prev_plan_content,
+                relevant_plans=relevant_plans,
+                library_index=library_index,
+            )
+            st.session_state.last_prompt_report = prompt_report
 
             
             with st.chat_message("assistant"):
@@ -849,33 +1004,209 @@ with tab2:
                     st.error("Falta API Key")
                 else:
                     try:
-                        models_to_try = get_available_models()
-                        success = False
-                        last_error = ""
-                        for mname in models_to_try:
-                            try:
-                                model = genai.GenerativeModel(mname)
-                                resp = model.generate_content(sys)
-                                txt = resp.text
-                                ph.markdown(txt)
-                                st.session_state.messages.append({"role": "assistant", "content": txt})
-                                success = True
-                                break # Salir del loop si funciona correctamente
-                            except Exception as e:
-                                last_error = str(e)
-                                if "429" in last_error or "Quota" in last_error or "quota" in last_error:
-                                    break # No intentar otros modelos si es límite de cuota (evitar errores extraños)
-                                continue # Intentar el siguiente modelo si es otro error
-                        
-                        if success:
-                            st.rerun()
+                        models_to_try = generation.get_available_models()
+                        # Streaming con cobertura: si el modelo preferido no arranca a tiempo se lanza el siguiente
+                        txt, gen_stats = generation.hedged_generate(
+                            models_to_try, sys, on_text=lambda t: ph.markdown(t + "▌"),
+                            use_cache=use_cache, hedge_delay=st.session_state.hedge_delay,
+                            on_status=ph.info
+                        )
+                        ph.markdown(txt)
+                        st.session_state.messages.append({"role": "assistant", "content": txt})
+                        st.session_state.last_generation_stats = gen_stats
+                        rerun_fragment()
+                    except TimeoutError as e:
+                        st.error(f"Error AI: {e}. Intenta de nuevo o baja el presupuesto del prompt.")
+                    except Exception as e:
+                        if generation.classify_error(e) == "429":
+                            st.error(f"Error AI: Límite de cuota o bloqueado en capa gratuita. Intenta bajar el Límite de Contexto. Error Técnico: {e}")
                         else:
-                            st.error(f"Error AI: Límite de cuota o bloqueado en capa gratuita. Intenta bajar el Límite de Contexto. Error Técnico: {last_error}")
-                    except Exception as e: 
-                        st.error(f"Error AI Crítico: {e}")
+                            st.error(f"Error AI Crítico: {e}")
+
+with tab2:
+    chat_panel(st.session_state.equipos, st.session_state.planes, library_state, library_index, library_count)
 
 # --- TAB 3: MIS PLANES ---
-with tab3:
+@timed_fragment("exportación")
+def bulk_export(filtered_planes):
+    """Exportación masiva a ZIP o PDF único de los planes que deja el filtro."""
+    with st.expander(f"📦 Exportar los {len(filtered_planes)} planes filtrados"):
+        c_exp_fmt, c_exp_workers = st.columns(2)
+        exp_fmt = c_exp_fmt.radio(
+            "Formato", pdf_export.EXPORT_FORMATS,
+            format_func=lambda f: {"zip": "ZIP (un PDF por plan)", "pdf": "PDF único con índice"}[f],
+            horizontal=True,
+        )
+        exp_workers = c_exp_workers.number_input("Procesos en paralelo", 1, 16, min(4, os.cpu_count() or 1))
+        if st.button("⚙️ Generar exportación"):
+            # El archivo anterior ya no hace falta
+            prev = st.session_state.get("export_result")
+            if prev and os.path.exists(prev.path):
+                os.remove(prev.path)
+            exp_bar = st.progress(0.0, text=f"0/{len(filtered_planes)}")
+            def show_export_progress(done, total, title):
+                exp_bar.progress(done / total, text=f"{done}/{total} · {title}")
+            st.session_state.export_result = pdf_export.export_plans(
+                filtered_planes, fmt=exp_fmt, max_workers=int(exp_workers), progress=show_export_progress
+            )
+            exp_bar.empty()
+
+        exp = st.session_state.get("export_result")
+        if exp and os.path.exists(exp.path):
+            if exp.failed:
+                st.warning(f"No se pudieron generar {len(exp.failed)} planes: " + ", ".join(exp.failed))
+            if exp.plans:
+                st.caption(
+                    f"{exp.plans} planes · {exp.pages} páginas en {exp.seconds:.1f} s "
+                    f"({exp.pages / max(exp.seconds, 1e-9):.1f} páginas/s)"
+                )
+                with open(exp.path, "rb") as f:
+                    st.download_button(
+                        label=f"📥 Descargar exportación ({exp.path.rsplit('.', 1)[-1].upper()})",
+                        data=f,
+                        file_name=os.path.basename(exp.path),
+                        mime="application/zip" if exp.path.endswith(".zip") else "application/pdf",
+                    )
+
+@timed_fragment("refinar")
+def refine_panel(planes, real_idx):
+    """Propuesta de cambios de la IA sobre el plan elegido, para aceptar o descartar."""
+    cur = planes[real_idx]
+    st.info("💡 Describe el cambio. La IA generará una PROPUESTA que podrás revisar antes de guardar.")
+    refine_prompt = st.text_area("Instrucción de Edición", placeholder="Ej: Agrega un ejercicio de zona media al calentamiento...")
+    
+    # Inicializar estado de propuesta si no existe
+    if 'refine_proposal' not in st.session_state:
+        st.session_state.refine_proposal = None
+    
+    # 1. Botón Generar
+    st.checkbox("🔁 Regenerar (ignorar caché)", key="refine_no_cache", help="Pide una propuesta nueva aunque ya exista una idéntica en caché.")
+    if st.button("✨ Generar Propuesta"):
+        if not refine_prompt:
+            st.error("Escribe una instrucción primero.")
+        else:
+            with st.spinner("Generando propuesta de cambios..."):
+                try:
+                    # Prompt de refinamiento
+                    sys_refine = f"""
+                    ACTUA COMO UN EDITOR EXPERTO DE PLANIFICACIONES DE PHYSICAL FITNESS (FUTSAL).
+                    TU TAREA ES MODIFICAR EL SIGUIENTE PLAN EXISTENTE SEGUN LA SOLICITUD DEL USUARIO.
+                    
+                    PLAN ORIGINAL:
+                    {cur["contenido"]}
+                    
+                    SOLICITUD DE CAMBIO (USUARIO):
+                    "{refine_prompt}"
+                    
+                    INSTRUCCIONES CRÍTICAS DE FORMATO:
+                    1. TU OBJETIVO ES EDITAR EL CONTENIDO, NO CAMBIAR LA ESTRUCTURA.
+                    2. SI HAY TABLAS EN EL PLAN ORIGINAL, DEBES MANTENERLAS COMO TABLAS MARKDOWN (`| Col |...`). PROHIBIDO CONVERTIRLAS A LISTAS O TEXTO PLANO.
+                    3. Aplica el cambio solicitado de forma coherente dentro del formato existente.
+                    4. MANTEN las negritas, cursivas y encabezados.
+                    5. NO SALUDES. EMPIEZA DIRECTAMENTE con el Título del Plan (`# ...` o `## ...`).
+                    
+                    FORMATO DE RESPUESTA OBLIGATORIO:
+                       [CONTENIDO MARKDOWN DEL PLAN (LIMPIO Y FORMATEADO)]
+                       ---JUSTIFICACION---
+                       [Breve explicación técnica de por qué hiciste estos cambios]
+                    """
+                    
+                    refine_ph = st.empty()
+                    full_text, gen_stats = generation.hedged_generate(
+                        generation.get_available_models(), sys_refine,
+                        on_text=lambda t: refine_ph.markdown(t + "▌"),
+                        use_cache=not st.session_state.get("refine_no_cache", False),
+                        hedge_delay=st.session_state.hedge_delay,
+                        on_status=refine_ph.info
+                    )
+                    st.session_state.last_generation_stats = gen_stats
+                    
+                    # Parsear respuesta (Separar Plan de Justificación)
+                    if "---JUSTIFICACION---" in full_text:
+                        parts = full_text.split("---JUSTIFICACION---")
+                        new_content = parts[0].strip()
+                        reasoning = parts[1].strip()
+                    else:
+                        new_content = full_text
+                        reasoning = "La IA no proporcionó una justificación explícita."
+                    
+                    # GUARDAR EN ESTADO TEMPORAL (NO EN BD)
+                    st.session_state.refine_proposal = {
+                        "idx": real_idx,
+                        "content": new_content,
+                        "reasoning": reasoning,
+                        "prompt": refine_prompt
+                    }
+                    rerun_fragment()
+                    
+                except Exception as e:
+                    st.error(f"Error al refinar: {e}")
+
+    # 2. Mostrar Propuesta si existe para este plan
+    if st.session_state.refine_proposal and st.session_state.refine_proposal.get("idx") == real_idx:
+        st.markdown("---")
+        st.warning("⚠️ **PROPUESTA PENDIENTE DE APROBACIÓN**")
+        
+        # Mostrar Justificación
+        st.info(f"🤖 **RAZÓN DEL CAMBIO (IA):** {st.session_state.refine_proposal['reasoning']}")
+        
+        st.markdown(f"> *Tu Solicitud: {st.session_state.refine_proposal['prompt']}*")
+        
+        with st.expander("📄 Ver Plan Completo (Clic para desplegar)", expanded=False):
+            st.markdown(st.session_state.refine_proposal["content"])
+        
+        col_accept, col_discard = st.columns(2)
+        
+        if col_accept.button("✅ ACEPTAR Y GUARDAR CAMBIOS"):
+            # Comprometer cambios
+            cur["contenido"] = st.session_state.refine_proposal["content"]
+            plan_structure.refresh_structure(cur, team_names())
+            save_json(DB_PLANES, planes, changed=[cur])
+            st.session_state.refine_proposal = None # Limpiar
+            st.success("✅ Plan Actualizado y Guardado.")
+            st.rerun()
+        
+        if col_discard.button("❌ DESCARTAR PROPUESTA"):
+            st.session_state.refine_proposal = None # Limpiar
+            st.info("Propuesta descartada.")
+            rerun_fragment()
+            
+    elif st.session_state.refine_proposal:
+        st.info(f"Tienes una propuesta pendiente en otro plan (Índice {st.session_state.refine_proposal['idx']}).")
+
+@timed_fragment("descarga")
+def pdf_download(cur):
+    """PDF del plan elegido; se genera solo al pedirlo, en segundo plano (navegar no espera nunca)."""
+    pdf_status, pdf_bytes = pdf_renderer.get(cur["titulo"], cur["contenido"])
+    if pdf_status == "missing":
+        if st.button("📄 Preparar PDF", key=f"pdf_{cur['id']}"):
+            pdf_renderer.request(cur["titulo"], cur["contenido"])
+            # Los planes cortos suelen estar en un par de segundos
+            pdf_status, pdf_bytes = pdf_renderer.wait(cur["titulo"], cur["contenido"], PDF_WAIT_SECONDS)
+    if pdf_status == "ready":
+        st.download_button(
+            label="📥 Descargar Planificación (PDF)",
+            data=pdf_bytes,
+            file_name=f"Plan_{cur['id'][:8]}.pdf",
+            mime="application/pdf"
+        )
+        render_s = pdf_renderer.render_seconds(cur["titulo"], cur["contenido"])
+        if render_s is not None:
+            st.caption(f"PDF generado en {render_s:.2f} s ({len(pdf_bytes) / 1024:.0f} KB)")
+    elif pdf_status == "pending":
+        st.info("⏳ Generando PDF en segundo plano...")
+        if st.button("🔄 Comprobar", key=f"pdf_check_{cur['id']}"):
+            rerun_fragment()
+    elif pdf_status == "error":
+        st.warning("El módulo PDF no está disponible o falló la generación.")
+        if st.button("🔁 Reintentar PDF", key=f"pdf_retry_{cur['id']}"):
+            pdf_renderer.discard(cur["titulo"], cur["contenido"])
+            pdf_renderer.request(cur["titulo"], cur["contenido"])
+            rerun_fragment()
+
+@timed_fragment("planes")
+def plan_browser(planes, equipos):
+    """Listado con filtros, vista previa y edición de los planes guardados."""
     c_logo_tab3, c_title_tab3 = st.columns([1, 12])
     with c_logo_tab3:
         st.image("logo.jpg", width=60)
@@ -884,15 +1215,16 @@ with tab3:
 
     if st.button("🔄 Refrescar Listado"):
         st.session_state.planes = load_json(DB_PLANES)
+        plan_structure.ensure_all(st.session_state.planes, team_names())
         st.success("Listado actualizado correctamente.")
         st.rerun()
     
     # --- FILTRO POR EQUIPO ---
-    if not st.session_state.planes:
+    if not planes:
         st.info("Sin planes guardados.")
     else:
         # Obtener lista de equipos disponibles + "Todos"
-        all_teams = ["Todos"] + [e["categoria"] for e in st.session_state.equipos]
+        all_teams = ["Todos"] + [e["categoria"] for e in equipos]
         
         c_fill_team, c_fill_cat = st.columns(2)
         filter_team = c_fill_team.selectbox("Filtrar por Equipo:", all_teams)
@@ -901,40 +1233,42 @@ with tab3:
         # Filtro de Texto
         search_text = st.text_input("🔍 Buscar por texto (Título o Contenido)", placeholder="Escribe para buscar...")
 
+        # Con SQLite la búsqueda va al índice FTS5 (sin tildes, por prefijo y ordenada por relevancia)
+        search_rank = None
+        if search_text and store:
+            search_rank = {pid: rank for rank, pid in enumerate(store.search_plans(search_text))}
+
         # Filtrar lista
         filtered_planes = []
-        for p in st.session_state.planes:
+        for p in planes:
              # Lógica Filtro Equipo
-             match_team = False
-             if filter_team == "Todos": match_team = True
-             elif filter_team in p['titulo']: match_team = True
+             p_struct = p["estructura"]
+             match_team = filter_team == "Todos" or filter_team == p_struct["equipo"]
              
              # Lógica Filtro Categoría
-             match_cat = False
-             p_tipo = p.get("tipo", "")
-             if not p_tipo: # Retro-compatibilidad
-                if "Mensual" in p['titulo']: p_tipo = "Mensual"
-                elif "Semanal" in p['titulo']: p_tipo = "Semanal"
-                elif "Semestral" in p['titulo']: p_tipo = "Semestral"
-                elif "Anual" in p['titulo']: p_tipo = "Anual"
-                elif "Diaria" in p['titulo']: p_tipo = "Sesión Diaria"
-            
-             if filter_cat == "Todos": match_cat = True
-             elif filter_cat == p_tipo: match_cat = True
+             match_cat = filter_cat == "Todos" or filter_cat == p_struct["tipo"]
 
              # Lógica Filtro Texto
              match_text = True
-             if search_text:
+             if search_rank is not None:
+                 match_text = p["id"] in search_rank
+             elif search_text:
                  stxt = search_text.lower()
                  if stxt not in p['titulo'].lower() and stxt not in p['contenido'].lower():
                      match_text = False
              
              if match_team and match_cat and match_text:
                  filtered_planes.append(p)
+        if search_rank:
+            filtered_planes.sort(key=lambda p: search_rank[p["id"]])
         
         if not filtered_planes:
             st.warning(f"No hay planes para '{filter_team}'.")
+            return
         else:
+            # --- EXPORTACIÓN MASIVA (todos los planes del filtro actual) ---
+            bulk_export(filtered_planes)
+
             # Dropdown con items filtrados
             titles = [f"{p['fecha']} | {p['titulo']}" for p in filtered_planes]
             # Mapeamos selección local al índice global real si necesitamos editar
@@ -943,8 +1277,8 @@ with tab3:
             # Recuperar el objeto real
             cur = filtered_planes[sel_idx_local]
             
-            # Buscamos el índice real en st.session_state.planes para poder guardar/borrar
-            real_idx = st.session_state.planes.index(cur)
+            # Buscamos el índice real en la lista de planes para poder guardar/borrar
+            real_idx = planes.index(cur)
             
             # Botón de Eliminación Rápida
             col_actions = st.columns([1, 5])
@@ -954,8 +1288,8 @@ with tab3:
             if st.session_state.get(f"confirm_del_{cur['id']}", False):
                 st.warning(f"¿Estás seguro de que quieres borrar '{cur['titulo']}'?")
                 if st.button("✅ Confirmar Borrado", key=f"conf_del_{cur['id']}"):
-                    st.session_state.planes.pop(real_idx)
-                    save_json(DB_PLANES, st.session_state.planes)
+                    planes.pop(real_idx)
+                    save_json(DB_PLANES, planes, removed=[cur["id"]])
                     st.success("Plan eliminado.")
                     st.rerun()
 
@@ -974,133 +1308,109 @@ with tab3:
                 c_b1, c_b2 = st.columns([1,5])
                 
                 if c_b1.form_submit_button("💾 Guardar Cambios"):
-                    st.session_state.planes[real_idx]["titulo"] = nt
-                    st.session_state.planes[real_idx]["contenido"] = nc
-                    save_json(DB_PLANES, st.session_state.planes)
+                    cur["titulo"] = nt
+                    cur["contenido"] = nc
+                    plan_structure.refresh_structure(cur, team_names())
+                    save_json(DB_PLANES, planes, changed=[cur])
                     st.success("✅ Plan Actualizado")
                     st.rerun()
                     
                 if c_b2.form_submit_button("❌ Eliminar Plan"):
-                    st.session_state.planes.pop(real_idx)
-                    save_json(DB_PLANES, st.session_state.planes)
+                    planes.pop(real_idx)
+                    save_json(DB_PLANES, planes, removed=[cur["id"]])
                     st.rerun()
 
         with sub_t3:
-            st.info("💡 Describe el cambio. La IA generará una PROPUESTA que podrás revisar antes de guardar.")
-            refine_prompt = st.text_area("Instrucción de Edición", placeholder="Ej: Agrega un ejercicio de zona media al calentamiento...")
-            
-            # Inicializar estado de propuesta si no existe
-            if 'refine_proposal' not in st.session_state:
-                st.session_state.refine_proposal = None
-            
-            # 1. Botón Generar
-            if st.button("✨ Generar Propuesta"):
-                if not refine_prompt:
-                    st.error("Escribe una instrucción primero.")
-                else:
-                    with st.spinner("Generando propuesta de cambios..."):
-                        try:
-                            # Prompt de refinamiento
-                            sys_refine = f"""
-                            ACTUA COMO UN EDITOR EXPERTO DE PLANIFICACIONES DE PHYSICAL FITNESS (FUTSAL).
-                            TU TAREA ES MODIFICAR EL SIGUIENTE PLAN EXISTENTE SEGUN LA SOLICITUD DEL USUARIO.
-                            
-                            PLAN ORIGINAL:
-                            {cur["contenido"]}
-                            
-                            SOLICITUD DE CAMBIO (USUARIO):
-                            "{refine_prompt}"
-                            
-                            INSTRUCCIONES CRÍTICAS DE FORMATO:
-                            1. TU OBJETIVO ES EDITAR EL CONTENIDO, NO CAMBIAR LA ESTRUCTURA.
-                            2. SI HAY TABLAS EN EL PLAN ORIGINAL, DEBES MANTENERLAS COMO TABLAS MARKDOWN (`| Col |...`). PROHIBIDO CONVERTIRLAS A LISTAS O TEXTO PLANO.
-                            3. Aplica el cambio solicitado de forma coherente dentro del formato existente.
-                            4. MANTEN las negritas, cursivas y encabezados.
-                            5. NO SALUDES. EMPIEZA DIRECTAMENTE con el Título del Plan (`# ...` o `## ...`).
-                            
-                            FORMATO DE RESPUESTA OBLIGATORIO:
-                               [CONTENIDO MARKDOWN DEL PLAN (LIMPIO Y FORMATEADO)]
-                               ---JUSTIFICACION---
-                               [Breve explicación técnica de por qué hiciste estos cambios]
-                            """
-                            
-                            # Intentar usar el modelo preferido
-                            try:
-                                mname = get_available_models()[0]
-                                model_refine = genai.GenerativeModel(mname)
-                            except:
-                                # Fallback extremo si falla la funcion
-                                model_refine = genai.GenerativeModel("models/gemini-2.5-flash")
-                                
-                            resp_refine = model_refine.generate_content(sys_refine)
-                            full_text = resp_refine.text
-                            
-                            # Parsear respuesta (Separar Plan de Justificación)
-                            if "---JUSTIFICACION---" in full_text:
-                                parts = full_text.split("---JUSTIFICACION---")
-                                new_content = parts[0].strip()
-                                reasoning = parts[1].strip()
-                            else:
-                                new_content = full_text
-                                reasoning = "La IA no proporcionó una justificación explícita."
-                            
-                            # GUARDAR EN ESTADO TEMPORAL (NO EN BD)
-                            st.session_state.refine_proposal = {
-                                "idx": real_idx,
-                                "content": new_content,
-                                "reasoning": reasoning,
-                                "prompt": refine_prompt
-                            }
-                            st.rerun()
-                            
-                        except Exception as e:
-                            st.error(f"Error al refinar: {e}")
-
-            # 2. Mostrar Propuesta si existe para este plan
-            if st.session_state.refine_proposal and st.session_state.refine_proposal.get("idx") == real_idx:
-                st.markdown("---")
-                st.warning("⚠️ **PROPUESTA PENDIENTE DE APROBACIÓN**")
-                
-                # Mostrar Justificación
-                st.info(f"🤖 **RAZÓN DEL CAMBIO (IA):** {st.session_state.refine_proposal['reasoning']}")
-                
-                st.markdown(f"> *Tu Solicitud: {st.session_state.refine_proposal['prompt']}*")
-                
-                with st.expander("📄 Ver Plan Completo (Clic para desplegar)", expanded=False):
-                    st.markdown(st.session_state.refine_proposal["content"])
-                
-                col_accept, col_discard = st.columns(2)
-                
-                if col_accept.button("✅ ACEPTAR Y GUARDAR CAMBIOS"):
-                    # Comprometer cambios
-                    st.session_state.planes[real_idx]["contenido"] = st.session_state.refine_proposal["content"]
-                    save_json(DB_PLANES, st.session_state.planes)
-                    st.session_state.refine_proposal = None # Limpiar
-                    st.success("✅ Plan Actualizado y Guardado.")
-                    st.rerun()
-                
-                if col_discard.button("❌ DESCARTAR PROPUESTA"):
-                    st.session_state.refine_proposal = None # Limpiar
-                    st.info("Propuesta descartada.")
-                    st.rerun()
-                    
-            elif st.session_state.refine_proposal:
-                st.info(f"Tienes una propuesta pendiente en otro plan (Índice {st.session_state.refine_proposal['idx']}).")
+            refine_panel(planes, real_idx)
         
         # Botón descarga PDF fuera del form para evitar recargas incorrectas
         st.markdown("---")
         st.markdown("---")
-        try:
-            pdf_bytes = create_pdf(cur["titulo"], cur["contenido"])
-            if pdf_bytes:
-                st.download_button(
-                    label="📥 Descargar Planificación (PDF)",
-                    data=pdf_bytes,
-                    file_name=f"Plan_{cur['id'][:8]}.pdf",
-                    mime="application/pdf"
-                )
-            else:
-                st.warning("El módulo PDF no está disponible o falló la generación.")
-        except Exception as e:
-            st.error(f"Error generando PDF: {e}")
+        pdf_download(cur)
+
+with tab3:
+    plan_browser(st.session_state.planes, st.session_state.equipos)
+
+# --- TAB 4: CONTROL DE CARGA ---
+@timed_fragment("cargas")
+def load_panel(cargas, planes):
+    """Registro de sesiones y métricas de carga (ACWR, monotonía, strain) por equipo."""
+    st.markdown('<h2 class="section-header">Control de Carga (sRPE)</h2>', unsafe_allow_html=True)
+    st.caption("Carga = RPE (0-10) × minutos de sesión. ACWR = carga aguda (7 días) / crónica (media semanal de 28 días).")
+
+    with st.expander("➕ Registrar Sesión"):
+        with st.form("form_carga", clear_on_submit=True):
+            c_l1, c_l2, c_l3, c_l4 = st.columns(4)
+            l_team = c_l1.selectbox("Equipo", team_names())
+            l_date = c_l2.date_input("Fecha", value=datetime.date.today())
+            l_rpe = c_l3.number_input("RPE medio (0-10)", min_value=0.0, max_value=10.0, value=6.0, step=0.5)
+            l_min = c_l4.number_input("Minutos", min_value=1, max_value=300, value=90)
+            l_note = st.text_input("Nota (opcional)", placeholder="Ej: Partido, sesión recortada...")
+            if st.form_submit_button("💾 Registrar"):
+                if not l_team:
+                    st.error("Primero crea un equipo en Gestión de Club.")
+                else:
+                    entry = {
+                        "id": str(uuid.uuid4()), "equipo": l_team, "fecha": str(l_date),
+                        "rpe": l_rpe, "minutos": l_min, "nota": l_note
+                    }
+                    cargas.append(entry)
+                    save_json(DB_CARGAS, cargas, changed=[entry])
+                    st.success(f"✅ Registrada: {l_team} {l_date} · carga {l_rpe * l_min:.0f} UA")
+
+    c_lf1, c_lf2, c_lf3 = st.columns(3)
+    load_teams = c_lf1.multiselect("Equipos", team_names(), default=team_names())
+    load_source = c_lf2.selectbox("Fuente", ["Registradas y planificadas", "Solo registradas", "Solo planificadas"])
+    default_rpe = c_lf3.number_input(
+        "RPE estimado para planes sin RPE", min_value=0.0, max_value=10.0, value=0.0, step=0.5,
+        help="Las sesiones diarias guardadas entran con su duración y el RPE que mencionan. Con 0, las que no mencionan RPE se omiten."
+    )
+
+    sessions = load_analytics.sessions_frame(cargas, planes, default_rpe or None)
+    sessions = sessions[sessions["equipo"].isin(load_teams)]
+    if load_source == "Solo registradas":
+        sessions = sessions[sessions["fuente"] == "registrada"]
+    elif load_source == "Solo planificadas":
+        sessions = sessions[sessions["fuente"] == "planificada"]
+
+    if sessions.empty:
+        st.info("Sin sesiones con RPE y duración para los filtros elegidos. Registra sesiones arriba o guarda sesiones diarias con RPE.")
+    else:
+        metrics, weekly = compute_load_metrics(sessions)
+        first_day, last_day = metrics["fecha"].min().date(), metrics["fecha"].max().date()
+        period = st.date_input(
+            "Período", value=(max(first_day, last_day - datetime.timedelta(days=120)), last_day),
+            min_value=first_day, max_value=last_day
+        )
+        if isinstance(period, tuple) and len(period) == 2:
+            start, end = pd.Timestamp(period[0]), pd.Timestamp(period[1])
+        else:
+            start, end = pd.Timestamp(first_day), pd.Timestamp(last_day)
+        shown = metrics[metrics["fecha"].between(start, end)]
+
+        st.markdown("#### Estado actual por equipo")
+        st.dataframe(load_analytics.latest_status(metrics), hide_index=True, use_container_width=True)
+
+        st.markdown("#### Carga semanal (UA)")
+        st.bar_chart(weekly[(weekly.index >= start) & (weekly.index <= end + pd.Timedelta(days=6))])
+
+        c_ch1, c_ch2 = st.columns(2)
+        with c_ch1:
+            st.markdown("#### ACWR")
+            st.line_chart(shown.pivot(index="fecha", columns="equipo", values="acwr"))
+            st.caption(f"Zona óptima {load_analytics.ACWR_SAFE[0]}–{load_analytics.ACWR_SAFE[1]}; riesgo > {load_analytics.ACWR_DANGER}.")
+        with c_ch2:
+            st.markdown("#### Monotonía")
+            st.line_chart(shown.pivot(index="fecha", columns="equipo", values="monotonia"))
+            st.caption(f"Monotonía > {load_analytics.MONOTONY_HIGH} indica poca variación día a día.")
+
+        st.markdown("#### Strain (carga semanal × monotonía)")
+        st.line_chart(shown.pivot(index="fecha", columns="equipo", values="strain"))
+
+        with st.expander(f"📋 Sesiones ({len(sessions)})"):
+            st.dataframe(sessions.sort_values("fecha", ascending=False), hide_index=True, use_container_width=True)
+
+with tab4:
+    load_panel(st.session_state.cargas, st.session_state.planes)
 
+log_rerun("app completa", time.perf_counter() - run_start)
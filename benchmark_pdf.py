@@ -0,0 +1,93 @@
+"""Benchmark de regresión del render de PDFs sobre los planes guardados.
+
+Genera cada plan de planificaciones_db.json (después de un render de calentamiento)
+y muestra la latencia por plan y la mediana / p95 del total.
+
+    python benchmark_pdf.py                  # compara con la línea base guardada
+    python benchmark_pdf.py --save-baseline  # guarda los resultados como nueva línea base
+
+Si la mediana supera la de la línea base en más de --tolerance, termina con código 1.
+"""
+import argparse
+import json
+import statistics
+import sys
+from pathlib import Path
+
+import pdf_export
+
+DB_PLANES = "planificaciones_db.json"
+# Se versiona junto al código para que las regresiones se vean en cada cambio
+BASELINE_FILE = Path(__file__).with_name("pdf_benchmark.json")
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def run(plans, repeat):
+    """{título: mejor tiempo (s)} de `repeat` renders por plan."""
+    pdf, _ = pdf_export.timed_pdf("Calentamiento", "# Calentamiento\n\n| a | b |\n|---|---|\n| 1 | 2 |")
+    if pdf is None:
+        print("ERROR: xhtml2pdf/markdown no están instalados o falla la generación.")
+        sys.exit(1)
+    timings = {}
+    for plan in plans:
+        best = None
+        for _ in range(repeat):
+            pdf, seconds = pdf_export.timed_pdf(plan["titulo"], plan["contenido"])
+            if pdf is None:
+                print(f"  ! falló: {plan['titulo']}")
+                break
+            best = seconds if best is None else min(best, seconds)
+        if best is not None:
+            timings[plan["titulo"]] = best
+            print(f"  {best * 1000:8.1f} ms  {plan['titulo'][:70]}")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PLANES)
+    parser.add_argument("--repeat", type=int, default=3, help="renders por plan (se toma el mejor)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regresión admitida en la mediana (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.db, "r", encoding="utf-8") as f:
+        plans = json.load(f)
+    print(f"{len(plans)} planes, plantilla v{pdf_export.TEMPLATE_VERSION}")
+    timings = run(plans, max(1, args.repeat))
+    if not timings:
+        sys.exit(1)
+
+    values = list(timings.values())
+    summary = {
+        "template_version": pdf_export.TEMPLATE_VERSION,
+        "plans": len(values),
+        "median_ms": round(statistics.median(values) * 1000, 1),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+        "total_s": round(sum(values), 2),
+    }
+    print(f"\nMediana {summary['median_ms']} ms · p95 {summary['p95_ms']} ms · total {summary['total_s']} s")
+
+    if args.save_baseline:
+        BASELINE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_FILE.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        print(f"Línea base guardada en {BASELINE_FILE}")
+        return
+
+    if not BASELINE_FILE.exists():
+        print("Sin línea base (usa --save-baseline para crearla).")
+        return
+    baseline = json.loads(BASELINE_FILE.read_text(encoding="utf-8"))
+    change = summary["median_ms"] / baseline["median_ms"] - 1
+    print(f"Línea base: mediana {baseline['median_ms']} ms (plantilla v{baseline['template_version']}) -> {change:+.1%}")
+    if change > args.tolerance:
+        print(f"REGRESIÓN: la mediana empeoró más de {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Sincronización con Firestore: un documento por plan, equipo o registro de carga.
+
+Antes cada colección era un único documento (futsal_data/planes con {"data": [...]}),
+que se reescribía entero en cada cambio y topaba con el límite de 1 MiB por documento.
+Ahora cada item vive en futsal_data/{nombre}/items/{clave} con:
+
+    {"data": item, "created_at": ..., "updated_at": ..., "deleted": bool}
+
+- Guardar escribe solo los items cambiados, en batches (hasta 500 escrituras cada uno).
+- Borrar deja una marca (deleted=True) para que las otras instancias se enteren.
+- Cargar pide solo lo modificado desde el último `updated_at` visto (cursor) y lo
+  aplica sobre la copia en memoria, compartida por todas las sesiones del proceso.
+- El documento viejo con {"data": [...]} se migra la primera vez.
+
+Funciona con el cliente de firebase_admin, con el emulador (FIRESTORE_EMULATOR_HOST)
+o con el fake en memoria de firestore_fake.py.
+"""
+import copy
+import threading
+import time
+from urllib.parse import quote
+
+ROOT_COLLECTION = "futsal_data"
+ITEMS_COLLECTION = "items"
+BATCH_LIMIT = 500  # máximo de escrituras por batch en Firestore
+
+# Campo del item que sirve de clave, por colección
+KEY_FIELDS = {"equipos": "categoria", "planes": "id", "cargas": "id"}
+
+
+def doc_id(key):
+    """Id de documento válido ("/" no está permitido) y reversible."""
+    return quote(str(key), safe="")
+
+
+class FirestoreStore:
+    def __init__(self, client, timestamp=None):
+        """`timestamp` es el valor a escribir en updated_at (firestore.SERVER_TIMESTAMP en
+        producción, para no depender del reloj de cada instancia); por defecto, time.time()."""
+        self.client = client
+        self.timestamp = timestamp
+        self._lock = threading.Lock()
+        self._items = {}  # nombre -> {clave: (created_at, item)}
+        self._cursors = {}  # nombre -> último updated_at leído
+        self._migrated = set()
+
+    def _now(self):
+        return self.timestamp if self.timestamp is not None else time.time()
+
+    def _collection(self, name):
+        return self.client.collection(ROOT_COLLECTION).document(name).collection(ITEMS_COLLECTION)
+
+    def _commit(self, writes):
+        """Aplica [(ref, datos, merge)] en batches de BATCH_LIMIT."""
+        for start in range(0, len(writes), BATCH_LIMIT):
+            batch = self.client.batch()
+            for ref, data, merge in writes[start:start + BATCH_LIMIT]:
+                batch.set(ref, data, merge=merge)
+            batch.commit()
+
+    def _migrate_legacy(self, name):
+        """Pasa el documento único viejo ({"data": [...]}) a un documento por item, una sola vez."""
+        if name in self._migrated:
+            return
+        self._migrated.add(name)
+        legacy_ref = self.client.collection(ROOT_COLLECTION).document(name)
+        legacy = legacy_ref.get()
+        if not legacy.exists:
+            return
+        legacy_data = legacy.to_dict() or {}
+        if legacy_data.get("migrated") or not legacy_data.get("data"):
+            return
+        items = legacy_data["data"]
+        now = self._now()
+        base = time.time()
+        coll = self._collection(name)
+        writes = [
+            # created_at conserva el orden de la lista original, todo antes de ahora
+            (coll.document(doc_id(item[KEY_FIELDS[name]])),
+             {"data": item, "created_at": base - (len(items) - i) * 1e-3, "updated_at": now, "deleted": False}, False)
+            for i, item in enumerate(items)
+        ]
+        writes.append((legacy_ref, {"migrated": True}, True))
+        self._commit(writes)
+        print(f"[firestore] {len(items)} {name} migrados a un documento por item")
+
+    def pull(self, name):
+        """Trae los cambios desde el último cursor. Devuelve cuántos documentos cambiaron."""
+        with self._lock:
+            self._migrate_legacy(name)
+            query = self._collection(name)
+            cursor = self._cursors.get(name)
+            if cursor is not None:
+                query = query.where("updated_at", ">", cursor)
+            docs = list(query.order_by("updated_at").stream())
+            items = self._items.setdefault(name, {})
+            for doc in docs:
+                record = doc.to_dict()
+                key = record["data"][KEY_FIELDS[name]] if record.get("data") else None
+                if record.get("deleted") or key is None:
+                    if key is None:
+                        key = next((k for k in items if doc_id(k) == doc.id), None)
+                    items.pop(key, None)
+                else:
+                    items[key] = (record.get("created_at", 0), record["data"])
+                cursor = record["updated_at"] if cursor is None else max(cursor, record["updated_at"])
+            if cursor is not None:
+                self._cursors[name] = cursor
+            return len(docs)
+
+    def items(self, name):
+        """Copia de los items en memoria, en el orden en que se crearon.
+
+        Es una copia porque la caché la comparten todas las sesiones y cada una edita
+        sus listas en el lugar.
+        """
+        with self._lock:
+            records = sorted(self._items.get(name, {}).values(), key=lambda r: r[0])
+            return copy.deepcopy([item for _, item in records])
+
+    def save(self, name, changed=(), removed=()):
+        """Escribe solo los items cambiados y marca como borradas las claves quitadas."""
+        key_field = KEY_FIELDS[name]
+        coll = self._collection(name)
+        now = self._now()
+        with self._lock:
+            cache = self._items.setdefault(name, {})
+            writes = []
+            for key in removed:
+                cache.pop(key, None)
+                writes.append((coll.document(doc_id(key)), {"deleted": True, "updated_at": now}, True))
+            for item in changed:
+                key = item[key_field]
+                created = cache[key][0] if key in cache else time.time()
+                cache[key] = (created, copy.deepcopy(item))
+                writes.append((coll.document(doc_id(key)),
+                               {"data": item, "created_at": created, "updated_at": now, "deleted": False}, False))
+            self._commit(writes)
+
+    def replace_all(self, name, items):
+        """Guarda la lista completa escribiendo solo la diferencia con lo que ya está en la nube."""
+        key_field = KEY_FIELDS[name]
+        keep = {item[key_field] for item in items}
+        with self._lock:
+            cache = self._items.get(name, {})
+            gone = [key for key in cache if key not in keep]
+            changed = [item for item in items if cache.get(item[key_field], (None, None))[1] != item]
+        self.save(name, changed=changed, removed=gone)
@@ -0,0 +1,105 @@
+"""Firestore en memoria con la parte de la API que usa cloud_sync.py.
+
+Sirve para probar la sincronización sin credenciales ni emulador:
+
+    from cloud_sync import FirestoreStore
+    from firestore_fake import FakeFirestore
+
+    client = FakeFirestore()
+    cloud = FirestoreStore(client)
+    cloud.save("planes", changed=[{"id": "1", "titulo": "..."}])
+    client.writes  # escrituras hechas hasta ahora
+
+Soporta collection/document anidados, get/set (con merge), where (==, <, <=, >, >=),
+order_by, stream y batch.
+"""
+import copy
+import operator
+
+_OPERATORS = {"==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocument:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name):
+        return FakeCollection(self._client, self.path + (name,))
+
+    def get(self):
+        return FakeSnapshot(self.id, self._client.docs.get(self.path))
+
+    def set(self, data, merge=False):
+        current = self._client.docs.get(self.path) if merge else None
+        self._client.docs[self.path] = {**(current or {}), **copy.deepcopy(data)}
+        self._client.writes += 1
+
+
+class FakeQuery:
+    def __init__(self, client, path, filters=(), order=None):
+        self._client = client
+        self.path = path
+        self._filters = list(filters)
+        self._order = order
+
+    def where(self, field, op, value):
+        return FakeQuery(self._client, self.path, self._filters + [(field, _OPERATORS[op], value)], self._order)
+
+    def order_by(self, field):
+        return FakeQuery(self._client, self.path, self._filters, field)
+
+    def stream(self):
+        depth = len(self.path) + 1
+        docs = [
+            FakeSnapshot(path[-1], data) for path, data in self._client.docs.items()
+            if len(path) == depth and path[:-1] == self.path
+            and all(field in data and op(data[field], value) for field, op, value in self._filters)
+        ]
+        if self._order:
+            docs.sort(key=lambda d: d._data.get(self._order))
+        return iter(docs)
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id):
+        return FakeDocument(self._client, self.path + (doc_id,))
+
+
+class FakeBatch:
+    def __init__(self):
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append((ref, data, merge))
+
+    def commit(self):
+        for ref, data, merge in self._ops:
+            ref.set(data, merge=merge)
+        self._ops = []
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.docs = {}  # ruta (tupla) -> datos
+        self.writes = 0
+
+    def collection(self, name):
+        return FakeCollection(self, (name,))
+
+    def batch(self):
+        return FakeBatch()
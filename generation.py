@@ -0,0 +1,379 @@
+"""Llamadas de generación a Gemini.
+
+Las respuestas se piden en streaming: cada fragmento se entrega al llamador en
+cuanto llega (para pintarlo en la UI) y se mide el tiempo hasta el primer token.
+
+La lista de modelos se descubre una vez por proceso y se refresca en segundo plano
+cuando vence su TTL; los modelos que devolvieron 404/429 hace poco se saltan.
+El SDK (google.generativeai, ~1 s de import) se carga recién al configurar la clave,
+en el mismo hilo de fondo que descubre los modelos, o en la primera generación.
+
+`hedged_generate` reparte una solicitud entre modelos: si el preferido no da su
+primer token a tiempo, lanza el siguiente en paralelo y se queda con el primero
+que termine bien. Cada intento pasa antes por el planificador de cuota
+(scheduler.py), que lo encola en vez de dejar que falle con 429.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from response_cache import ResponseCache, cache_key
+from scheduler import MAX_QUOTA_RETRIES, estimate_request_tokens, scheduler
+
+# Priorizamos Flash/Lite sobre Pro (Pro tira error 429 limit:0, y 1.5 tira error 404)
+MODEL_PREFERENCES = [
+    "gemini-3.1-flash-lite",
+    "gemini-2.5-flash",
+    "gemini-3-flash",
+    "gemini-flash",
+]
+FALLBACK_MODELS = ["models/gemini-2.5-flash", "models/gemini-3.1-flash-lite"]
+
+MODELS_TTL = 600  # segundos hasta refrescar la lista de modelos
+DISCOVERY_RETRY = 30  # si list_models() falla, reintentar pronto
+# Cuánto tiempo se evita un modelo según el error que dio
+FAILED_MODEL_TTL = {"404": 3600, "429": 120}
+
+BATCH_WORKERS = 3  # generaciones simultáneas en modo lote (la cuota la regula el planificador)
+HEDGE_DELAY = 8.0  # segundos sin primer token antes de lanzar el siguiente modelo
+REQUEST_TIMEOUT = 120.0  # tope total por solicitud
+
+
+_sdk = None  # google.generativeai, una vez importado
+_api_key = None
+_sdk_lock = threading.Lock()
+
+
+def _genai():
+    """google.generativeai, importado y configurado en el primer uso."""
+    global _sdk
+    with _sdk_lock:
+        if _sdk is None:
+            import google.generativeai as genai
+            if _api_key:
+                genai.configure(api_key=_api_key)
+            _sdk = genai
+    return _sdk
+
+
+def configure(api_key):
+    """Guarda la clave de Gemini y descubre los modelos en segundo plano.
+
+    Se puede llamar en cada rerun: si la clave no cambió no hace nada.
+    """
+    global _api_key
+    with _sdk_lock:
+        if api_key == _api_key:
+            return
+        _api_key = api_key
+        if _sdk is not None:
+            _sdk.configure(api_key=api_key)
+    registry.refresh_async()
+
+
+class GenerationCancelled(Exception):
+    """Se lanza dentro de un intento que perdió la carrera para cortar su streaming."""
+
+
+def classify_error(error):
+    """'429' (cuota), '404' (modelo inexistente) o None."""
+    msg = str(error)
+    if "429" in msg or "quota" in msg.lower():
+        return "429"
+    if "404" in msg or "not found" in msg.lower():
+        return "404"
+    return None
+
+
+class ModelRegistry:
+    """Caché de modelos disponibles, compartida por todas las sesiones del proceso."""
+
+    def __init__(self, ttl=MODELS_TTL):
+        self.ttl = ttl
+        self._models = []
+        self._expires = 0.0
+        self._failed = {}  # modelo -> instante hasta el que se evita
+        self._refreshing = False
+        self._discovered = threading.Event()
+        self._lock = threading.Lock()
+
+    def _discover(self):
+        try:
+            available = [m.name for m in _genai().list_models() if "generateContent" in m.supported_generation_methods]
+        except Exception as e:
+            print(f"Error listando modelos: {e}")
+            return FALLBACK_MODELS[:1], DISCOVERY_RETRY
+        models = []
+        for pref in MODEL_PREFERENCES:
+            for a in available:
+                if pref in a and "pro" not in a.lower() and a not in models:
+                    models.append(a)
+        # Fallback de seguridad usando nombres completos
+        return (models or list(FALLBACK_MODELS)), self.ttl
+
+    def _refresh(self):
+        models, ttl = self._discover()
+        with self._lock:
+            self._models = models
+            self._expires = time.monotonic() + ttl
+            self._refreshing = False
+        self._discovered.set()
+
+    def refresh_async(self):
+        """Descubre los modelos en un hilo de fondo, salvo que ya haya uno en curso."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def models(self):
+        """Modelos en orden de preferencia, sin los que fallaron hace poco.
+
+        La primera vez se espera al descubrimiento en curso (o se hace en línea);
+        después, si venció el TTL, se devuelve la lista actual y se refresca en un
+        hilo de fondo.
+        """
+        with self._lock:
+            first_time = not self._models
+            in_flight = self._refreshing
+        if first_time:
+            if not (in_flight and self._discovered.wait(REQUEST_TIMEOUT)):
+                self._refresh()
+        elif time.monotonic() >= self._expires:
+            self.refresh_async()
+
+        now = time.monotonic()
+        with self._lock:
+            models = list(self._models)
+            usable = [m for m in models if self._failed.get(m, 0) <= now]
+        # Si todos están penalizados, mejor intentar igual que no ofrecer nada
+        return usable or models
+
+    def mark_failed(self, model_name, error):
+        kind = classify_error(error)
+        if kind:
+            with self._lock:
+                self._failed[model_name] = time.monotonic() + FAILED_MODEL_TTL[kind]
+
+    def mark_ok(self, model_name):
+        with self._lock:
+            self._failed.pop(model_name, None)
+
+
+registry = ModelRegistry()
+
+
+def get_available_models():
+    return registry.models()
+
+
+def stream_generate(model_name, prompt, on_text=None, params=None, timeout=REQUEST_TIMEOUT):
+    """Genera con `model_name` en streaming.
+
+    `on_text(texto_acumulado)` se llama con cada fragmento recibido. `params` es el
+    generation_config de Gemini (temperatura, etc.) y `timeout` el límite de la
+    llamada HTTP. Devuelve (texto_final, stats)
+    con stats = {"model", "ttft", "total", "chars", "cached"} (tiempos en segundos).
+    """
+    start = time.perf_counter()
+    ttft = None
+    parts = []
+    model = _genai().GenerativeModel(model_name)
+    try:
+        response = model.generate_content(
+            prompt, stream=True, generation_config=params, request_options={"timeout": timeout}
+        )
+        for chunk in response:
+            try:
+                piece = chunk.text
+            except ValueError:
+                # Fragmento sin texto (p. ej. solo metadatos de seguridad)
+                continue
+            if not piece:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            parts.append(piece)
+            if on_text:
+                on_text("".join(parts))
+    except GenerationCancelled:
+        raise
+    except Exception as e:
+        registry.mark_failed(model_name, e)
+        raise
+
+    text = "".join(parts)
+    if not text:
+        raise ValueError(f"{model_name} no devolvió texto")
+    stats = {"model": model_name, "ttft": ttft, "total": time.perf_counter() - start, "chars": len(text), "cached": False}
+    print(f"[gen] {model_name}: primer token {ttft:.2f}s, total {stats['total']:.2f}s, {len(text)} caracteres")
+    registry.mark_ok(model_name)
+    return text, stats
+
+
+response_cache = ResponseCache()
+
+
+def hedged_generate(models, prompt, on_text=None, params=None, use_cache=True,
+                    hedge_delay=HEDGE_DELAY, timeout=REQUEST_TIMEOUT, on_status=None):
+    """Genera con el primer modelo de `models` que responda, cubriéndose con los siguientes.
+
+    Arranca el preferido; si nadie dio el primer token en `hedge_delay` segundos (o
+    el intento falla), lanza el siguiente en paralelo. Gana el primero que termine
+    bien y el resto se cancela. Ante un 429 el intento espera su backoff y reintenta
+    el mismo modelo (hasta MAX_QUOTA_RETRIES); mientras dura el backoff no se lanza
+    el siguiente, y si la cuota sigue agotada, no se lanzan más modelos. Las respuestas se cachean (ver response_cache);
+    `use_cache=False` la ignora.
+
+    Los intentos corren en hilos, pero `on_text` y `on_status(mensaje)` (cola,
+    reintentos) siempre se llaman desde el hilo que invoca la función (Streamlit
+    solo pinta desde el hilo del script).
+    """
+    models = list(models)
+    if not models:
+        raise ValueError("No hay modelos disponibles")
+    if use_cache:
+        for model_name in models:
+            cached = response_cache.get(cache_key(model_name, prompt, params))
+            if cached is not None:
+                if on_text:
+                    on_text(cached)
+                return cached, {
+                    "model": model_name, "ttft": 0.0, "total": 0.0, "chars": len(cached),
+                    "cached": True, "attempts": 0,
+                }
+
+    events = queue.Queue()
+    cancel = threading.Event()
+    deadline = time.monotonic() + timeout
+
+    def run(idx, model_name):
+        def forward(text):
+            if cancel.is_set():
+                raise GenerationCancelled()
+            events.put(("text", idx, text))
+
+        def queued(position, wait):
+            events.put(("queued", idx, (position, wait)))
+
+        for attempt in range(MAX_QUOTA_RETRIES + 1):
+            if cancel.is_set():
+                return
+            try:
+                # Un intento que ya perdió la carrera sale de la cola sin gastar cupo
+                if not scheduler.acquire(model_name, estimate_request_tokens(prompt), on_wait=queued,
+                                         deadline=deadline, cancel=cancel) or cancel.is_set():
+                    return
+                result = stream_generate(
+                    model_name, prompt, on_text=forward, params=params,
+                    timeout=max(deadline - time.monotonic(), 1.0),
+                )
+                scheduler.report_success(model_name)
+                events.put(("done", idx, result))
+                return
+            except GenerationCancelled:
+                return
+            except Exception as e:
+                if classify_error(e) == "429" and attempt < MAX_QUOTA_RETRIES and not cancel.is_set():
+                    events.put(("retry", idx, scheduler.report_quota_error(model_name, e)))
+                    continue
+                events.put(("error", idx, e))
+                return
+
+    launched = 0
+    running = 0
+    next_hedge = 0.0
+    leader = None  # intento cuyo texto se está mostrando
+    stop_launching = False
+    last_error = None
+
+    def launch():
+        nonlocal launched, running, next_hedge
+        threading.Thread(target=run, args=(launched, models[launched]), daemon=True).start()
+        launched += 1
+        running += 1
+        next_hedge = time.monotonic() + hedge_delay
+
+    launch()
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            cancel.set()
+            raise TimeoutError(f"Sin respuesta de la IA en {timeout:.0f}s")
+        can_hedge = leader is None and not stop_launching and launched < len(models)
+        if can_hedge:
+            # Durante el backoff por 429 el plazo no corre: otro modelo gastaría la misma cuota
+            backoff = scheduler.backoff_remaining(models[launched - 1])
+            if backoff > 0:
+                next_hedge = max(next_hedge, now + backoff + hedge_delay)
+        if can_hedge and now >= next_hedge:
+            launch()
+            continue
+        wait = deadline - now
+        if can_hedge:
+            wait = min(wait, next_hedge - now)
+        try:
+            kind, idx, payload = events.get(timeout=wait)
+        except queue.Empty:
+            continue
+
+        if kind == "queued":
+            if leader is None and on_status:
+                position, seconds = payload
+                on_status(f"⏳ En cola para {models[idx]} (posición {position}, ~{seconds:.0f}s)")
+        elif kind == "retry":
+            if leader is None and on_status:
+                on_status(f"⏳ Cuota alcanzada en {models[idx]}; reintento en {payload:.0f}s")
+        elif kind == "text":
+            if leader is None:
+                leader = idx
+            if idx == leader and on_text:
+                on_text(payload)
+        elif kind == "done":
+            cancel.set()
+            text, stats = payload
+            if idx != leader and on_text:
+                on_text(text)
+            response_cache.put(cache_key(models[idx], prompt, params), models[idx], text)
+            stats["attempts"] = launched
+            return text, stats
+        else:
+            running -= 1
+            last_error = payload
+            if idx == leader:
+                leader = None
+            if classify_error(payload) == "429":
+                stop_launching = True  # No intentar otros modelos si es límite de cuota
+            if not stop_launching and launched < len(models):
+                launch()
+            elif running == 0:
+                raise last_error
+
+
+def run_batch(jobs, max_workers=BATCH_WORKERS, on_progress=None, use_cache=True, hedge_delay=HEDGE_DELAY):
+    """Genera varios prompts a la vez con un pool acotado de hilos.
+
+    `jobs` es [(clave, prompt)]; cada uno pasa por hedged_generate con `hedge_delay`.
+    `on_progress(hechas, total, clave, error)` se llama desde el hilo que invoca la
+    función cada vez que termina una. Devuelve
+    (resultados {clave: (texto, stats)}, errores {clave: excepción}, segundos totales).
+    """
+    start = time.perf_counter()
+    results, errors = {}, {}
+    models = get_available_models()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(hedged_generate, models, prompt, use_cache=use_cache, hedge_delay=hedge_delay): key
+            for key, prompt in jobs
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+            if on_progress:
+                on_progress(len(results) + len(errors), len(jobs), key, errors.get(key))
+    return results, errors, time.perf_counter() - start
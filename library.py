@@ -0,0 +1,389 @@
+"""Lectura de la biblioteca técnica (biblioteca_futsal) con caché persistente en disco.
+
+La carpeta se recorre de forma recursiva y cada formato (PDF, DOCX) se lee con su
+extractor registrado en EXTRACTORS. Los extractores son generadores: producen el
+texto página a página, sin armar un único string gigante.
+
+El texto de cada página se extrae una sola vez y se guarda en CACHE_DIR, indexado
+por el hash del contenido del archivo y la versión del extractor. Solo se vuelve a
+parsear un archivo cuando cambia (o se actualiza el extractor).
+"""
+import hashlib
+import importlib.metadata
+import json
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from xml.etree import ElementTree
+
+# pypdf se importa recién al extraer; su versión (parte de la clave de caché) sale de los metadatos
+try:
+    PYPDF_VERSION = importlib.metadata.version("pypdf")
+except importlib.metadata.PackageNotFoundError:
+    PYPDF_VERSION = "none"
+
+import retrieval
+
+LIBRARY_DIR = Path("biblioteca_futsal")
+CACHE_DIR = Path(".cache") / "biblioteca"
+
+# Los libros grandes se reparten en tramos de páginas entre los procesos
+PAGES_PER_TASK = 40
+# Procesos nuevos (spawn): el servidor de Streamlit tiene hilos y locks vivos que fork copiaría
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+Extractor = namedtuple("Extractor", ["extract", "page_count", "version"])
+EXTRACTORS = {}
+
+
+def register_extractor(suffix, page_count=None, version="1"):
+    """Registra `fn(path, start, stop)` (generador de textos de página) para una extensión.
+
+    Con `page_count` el archivo se puede repartir en tramos de páginas entre procesos;
+    sin él se extrae en una sola tarea.
+    """
+    def decorator(fn):
+        EXTRACTORS[suffix.lower()] = Extractor(fn, page_count, version)
+        return fn
+    return decorator
+
+
+def is_supported(path):
+    path = Path(path)
+    return path.suffix.lower() in EXTRACTORS and not path.name.startswith("~$")
+
+
+def iter_library_files(root=LIBRARY_DIR):
+    """Archivos soportados bajo `root`, recursivo y en orden estable."""
+    root = Path(root)
+    if not root.exists():
+        return []
+    return sorted(p for p in root.rglob("*") if p.is_file() and is_supported(p))
+
+
+def file_hash(path):
+    """SHA-256 del contenido del archivo (lectura por bloques)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _extractor_tag(path):
+    suffix = Path(path).suffix.lower()
+    return f"{suffix.lstrip('.')}{EXTRACTORS[suffix].version}"
+
+
+def _cache_path(digest, tag):
+    return CACHE_DIR / f"{digest}-{tag}.json"
+
+
+def _pdf_page_count(path):
+    from pypdf import PdfReader
+    return len(PdfReader(path).pages)
+
+
+@register_extractor(".pdf", page_count=_pdf_page_count, version=f"-pypdf{PYPDF_VERSION}")
+def extract_pdf(path, start=0, stop=None):
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    pages = reader.pages
+    for i in range(start, len(pages) if stop is None else stop):
+        yield pages[i].extract_text() or ""
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+@register_extractor(".docx", version="-xml1")
+def extract_docx(path, start=0, stop=None):
+    """Texto de un .docx por páginas (saltos de página guardados por Word), sin dependencias extra.
+
+    Se lee word/document.xml en streaming con iterparse, párrafo a párrafo.
+    """
+    page, paragraphs, current = 0, [], []
+    with zipfile.ZipFile(path) as zf, zf.open("word/document.xml") as xml:
+        for event, elem in ElementTree.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                if elem.tag == f"{_W}lastRenderedPageBreak" or (
+                    elem.tag == f"{_W}br" and elem.get(f"{_W}type") == "page"
+                ):
+                    if current:
+                        paragraphs.append("".join(current))
+                        current = []
+                    if paragraphs and start <= page and (stop is None or page < stop):
+                        yield "\n".join(paragraphs)
+                    if paragraphs:
+                        page += 1
+                    paragraphs = []
+                continue
+            if elem.tag == f"{_W}t" and elem.text:
+                current.append(elem.text)
+            elif elem.tag == f"{_W}tab":
+                current.append("\t")
+            elif elem.tag == f"{_W}p":
+                if current:
+                    paragraphs.append("".join(current))
+                current = []
+                elem.clear()
+    if paragraphs and start <= page and (stop is None or page < stop):
+        yield "\n".join(paragraphs)
+
+
+def extract_page_range(path, start, stop):
+    """Extrae las páginas [start, stop) de un archivo. Se ejecuta en los procesos del pool."""
+    return list(EXTRACTORS[Path(path).suffix.lower()].extract(path, start, stop))
+
+
+def read_cached_pages(digest, tag):
+    """Devuelve las páginas guardadas para ese hash, o None si no hay entrada válida."""
+    cache_file = _cache_path(digest, tag)
+    if not cache_file.exists():
+        return None
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)["pages"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cached_pages(digest, tag, source_name, pages):
+    """Guarda las páginas de forma atómica (archivo temporal + replace)."""
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_file = _cache_path(digest, tag)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"source": source_name, "extractor": tag, "pages": pages}, f, ensure_ascii=False)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"No se pudo guardar caché de {source_name}: {e}")
+
+
+def iter_ingest(files, max_workers=None, progress=None):
+    """Produce (archivo, hash, páginas) para cada archivo de `files`, en ese mismo orden.
+
+    Los archivos cacheados se leen directamente; el resto se reparte en un pool de
+    procesos (un tramo de PAGES_PER_TASK páginas por tarea cuando el formato lo
+    permite) y se fusiona en orden, así el resultado es determinista sin importar qué
+    tarea termine primero. Cada archivo se entrega en cuanto él y los anteriores
+    están listos, para que el indexador pueda ir consumiendo.
+    `progress(hechas, total, nombre)` se llama desde el hilo que consume el generador.
+    """
+    files = [Path(f) for f in files]
+    results = {}
+    digests = {}  # archivo -> SHA-256, para que el llamador no vuelva a leerlo
+    pending = []  # (archivo, hash, etiqueta extractor)
+    pending_by_hash = {}
+    copies = {}  # copia idéntica -> archivo que sí se extrae
+    tasks = []
+
+    for path in files:
+        try:
+            digest, tag = file_hash(path), _extractor_tag(path)
+            digests[path] = digest
+            pages = read_cached_pages(digest, tag)
+            if pages is not None:
+                results[path] = pages
+            elif (digest, tag) in pending_by_hash:
+                copies[path] = pending_by_hash[(digest, tag)]
+            else:
+                pending_by_hash[(digest, tag)] = path
+                pending.append((path, digest, tag))
+                page_count = EXTRACTORS[path.suffix.lower()].page_count
+                if page_count:
+                    n_pages = page_count(path)
+                    if not n_pages:
+                        results[path] = []
+                    tasks.extend(
+                        (path, start, min(start + PAGES_PER_TASK, n_pages))
+                        for start in range(0, n_pages, PAGES_PER_TASK)
+                    )
+                else:
+                    tasks.append((path, 0, None))
+        except Exception as e:
+            print(f"Error leyendo {path}: {e}")
+
+    total = len(files)
+    done = len(results)
+    if progress:
+        progress(done, total, "caché")
+
+    chunks = {}
+    failed = set()
+    remaining = {}
+    for path, _, _ in tasks:
+        remaining[path] = remaining.get(path, 0) + 1
+
+    def finish(path):
+        """Fusiona en orden fijo (página inicial) los tramos de un archivo ya completo."""
+        parts = [chunks.pop(t, None) for t in tasks if t[0] == path]
+        if path in failed:
+            return  # Algún tramo falló: no se cachea un documento incompleto
+        pages = [text for part in parts for text in part]
+        _, digest, tag = next(p for p in pending if p[0] == path)
+        write_cached_pages(digest, tag, path.name, pages)
+        results[path] = pages
+
+    position = 0
+
+    def ready():
+        """Entrega, en orden, todos los archivos que ya no esperan a ninguna tarea."""
+        nonlocal position
+        while position < len(files):
+            path = files[position]
+            source = copies.get(path, path)
+            if remaining.get(source, 0) > 0:
+                break
+            position += 1
+            if source in results:
+                yield path, digests[path], results[source]
+
+    def task_done(task, pages, error=None):
+        nonlocal done
+        path = task[0]
+        if error is not None:
+            print(f"Error leyendo {path} (páginas {task[1]}-{task[2]}): {error}")
+            failed.add(path)
+        else:
+            chunks[task] = pages
+        remaining[path] -= 1
+        if remaining[path] == 0:
+            finish(path)
+            done += 1
+            if progress:
+                progress(done, total, path.name)
+
+    yield from ready()
+    if len(tasks) == 1:
+        try:
+            task_done(tasks[0], extract_page_range(*tasks[0]))
+        except Exception as e:
+            task_done(tasks[0], None, e)
+        yield from ready()
+    elif tasks:
+        workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT) as pool:
+            futures = {pool.submit(extract_page_range, *task): task for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    task_done(futures[future], future.result())
+                except Exception as e:
+                    task_done(futures[future], None, e)
+                yield from ready()
+
+    if progress:
+        progress(total, total, "listo")
+
+
+class LibraryState:
+    """Estado de la biblioteca en memoria, de larga vida (uno por proceso).
+
+    Recuerda qué archivos indexó (mtime, tamaño y hash) y en cada `sync()` solo
+    procesa los que se añadieron, cambiaron o desaparecieron. Los fragmentos ya
+    tokenizados de cada archivo se conservan, así reconstruir el índice BM25 tras
+    un cambio no vuelve a tocar los demás documentos.
+
+    Al indexar se descartan las copias exactas (mismo hash) y los pasajes casi
+    idénticos entre documentos distintos (MinHash); `dedup_report` resume lo ahorrado.
+    """
+
+    def __init__(self, root=LIBRARY_DIR):
+        self.root = Path(root)
+        self.files = {}  # ruta -> {"mtime", "size", "hash", "pages", "chunks"}
+        self.version = 0
+        self._index = None
+        self._index_version = -1
+        self.dedup_report = {"duplicate_files": 0, "duplicate_passages": 0, "chars_saved": 0}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.files)
+
+    def sync(self, progress=None):
+        """Sincroniza con el disco. Devuelve {"added", "changed", "removed"} (listas de rutas)."""
+        with self._lock:
+            current = iter_library_files(self.root)
+            present = set(current)
+            report = {"added": [], "changed": [], "removed": [p for p in self.files if p not in present]}
+            to_ingest = []
+            for path in current:
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entry = self.files.get(path)
+                if entry is None:
+                    report["added"].append(path)
+                    to_ingest.append(path)
+                elif (entry["mtime"], entry["size"]) != (stat.st_mtime, stat.st_size):
+                    # mtime distinto no implica contenido distinto (copias, checkout): confirmamos por hash
+                    if file_hash(path) != entry["hash"]:
+                        report["changed"].append(path)
+                        to_ingest.append(path)
+                    else:
+                        entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+
+            for path in report["removed"]:
+                del self.files[path]
+
+            # Cada documento se indexa en cuanto sale del pipeline
+            for path, digest, pages in iter_ingest(to_ingest, progress=progress):
+                self._store(path, digest, pages)
+
+            if report["removed"] or to_ingest:
+                self.version += 1
+            return report
+
+    def _store(self, path, digest, pages):
+        stat = path.stat()
+        chunks = retrieval.chunk_pages({path.relative_to(self.root).as_posix(): pages})
+        self.files[path] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "hash": digest,
+            "pages": pages,
+            "chunks": [
+                (chunk, retrieval.term_counts(chunk.text), retrieval.minhash_signature(chunk.text))
+                for chunk in chunks
+            ],
+        }
+
+    def clear(self):
+        """Olvida lo indexado (solo la biblioteca); el próximo sync() relee desde la caché en disco."""
+        with self._lock:
+            self.files = {}
+            self.version += 1
+
+    def index(self):
+        """Índice BM25 de la biblioteca actual; se reconstruye solo si cambió algún archivo."""
+        with self._lock:
+            if self._index_version != self.version:
+                report = {"duplicate_files": 0, "duplicate_passages": 0, "chars_saved": 0}
+                seen_hashes = set()
+                entries = []  # (ruta, chunk, conteos, firma)
+                for path in sorted(self.files):
+                    entry = self.files[path]
+                    if entry["hash"] in seen_hashes:
+                        report["duplicate_files"] += 1
+                        report["chars_saved"] += sum(len(p) for p in entry["pages"])
+                        continue
+                    seen_hashes.add(entry["hash"])
+                    entries.extend((path, *item) for item in entry["chunks"])
+
+                dropped = retrieval.near_duplicates([(path, sig) for path, _, _, sig in entries])
+                report["duplicate_passages"] = len(dropped)
+                report["chars_saved"] += sum(len(entries[i][1].text) for i in dropped)
+                kept = [e for i, e in enumerate(entries) if i not in dropped]
+
+                self._index = retrieval.BM25Index(
+                    [chunk for _, chunk, _, _ in kept], term_counts=[counts for _, _, counts, _ in kept]
+                )
+                self.dedup_report = report
+                self._index_version = self.version
+            return self._index
@@ -0,0 +1,105 @@
+"""Control de la carga de entrenamiento (método sRPE, Foster / Matzenbacher).
+
+Carga de sesión = RPE (0-10) × minutos. A partir de las sesiones (registradas por el
+PF o estimadas desde los planes guardados) se calcula, por equipo y para toda la
+temporada:
+
+- carga diaria y semanal,
+- carga aguda (7 días), crónica (media semanal de 28 días) y ACWR = aguda / crónica,
+- monotonía = media diaria / desvío diario de la semana, y strain = carga semanal × monotonía.
+
+Todo se hace sobre una matriz día × equipo con operaciones vectorizadas de pandas
+(pivot + rolling), sin recorrer filas en Python.
+"""
+import numpy as np
+import pandas as pd
+
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+
+# Umbrales de alerta habituales en la literatura de control de carga
+ACWR_SAFE = (0.8, 1.3)
+ACWR_DANGER = 1.5
+MONOTONY_HIGH = 2.0
+
+SESSION_COLUMNS = ["equipo", "fecha", "rpe", "minutos", "fuente"]
+
+
+def sessions_frame(logs=(), plans=(), default_rpe=None):
+    """DataFrame de sesiones (equipo, fecha, rpe, minutos, fuente, carga).
+
+    `logs` son los registros del PF ({"equipo", "fecha", "rpe", "minutos"}); `plans`
+    los planes guardados: entran las sesiones diarias con duración detectada y RPE
+    planificado (o `default_rpe` si el plan no lo menciona; sin él, se omiten).
+    """
+    logged = pd.DataFrame(list(logs), columns=SESSION_COLUMNS[:-1])
+    logged["fuente"] = "registrada"
+
+    structs = pd.DataFrame([p["estructura"] for p in plans], columns=["tipo", "equipo", "fecha", "rpe", "duracion_min"])
+    if default_rpe:
+        structs["rpe"] = structs["rpe"].fillna(default_rpe)
+    structs = structs[(structs["tipo"] == "Sesión Diaria") & structs["rpe"].notna() & structs["duracion_min"].notna()]
+    planned = structs.rename(columns={"duracion_min": "minutos"})[SESSION_COLUMNS[:-1]].assign(fuente="planificada")
+
+    frames = [f for f in (logged, planned) if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=SESSION_COLUMNS + ["carga"])
+    df = pd.concat(frames, ignore_index=True)
+    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+    df["rpe"] = pd.to_numeric(df["rpe"], errors="coerce")
+    df["minutos"] = pd.to_numeric(df["minutos"], errors="coerce")
+    df = df.dropna(subset=["fecha", "rpe", "minutos"])
+    df["carga"] = df["rpe"] * df["minutos"]
+    return df
+
+
+def daily_load(df):
+    """Matriz día × equipo con la carga sumada por día (días sin sesión = 0)."""
+    if df.empty:
+        return pd.DataFrame()
+    daily = df.pivot_table(index="fecha", columns="equipo", values="carga", aggfunc="sum", fill_value=0.0)
+    return daily.asfreq("D", fill_value=0.0)
+
+
+def weekly_load(daily):
+    return daily.resample("W-SUN").sum()
+
+
+def load_metrics(df):
+    """Métricas diarias por equipo en formato largo.
+
+    Columnas: fecha, equipo, carga, aguda, cronica, acwr, monotonia, strain.
+    """
+    daily = daily_load(df)
+    if daily.empty:
+        return pd.DataFrame(columns=["fecha", "equipo", "carga", "aguda", "cronica", "acwr", "monotonia", "strain"])
+    acute = daily.rolling(ACUTE_DAYS, min_periods=1).sum()
+    # Crónica expresada como carga semanal media, para que el ACWR sea comparable
+    chronic = daily.rolling(CHRONIC_DAYS, min_periods=ACUTE_DAYS).mean() * ACUTE_DAYS
+    acwr = acute / chronic.replace(0.0, np.nan)
+    week_mean = daily.rolling(ACUTE_DAYS, min_periods=ACUTE_DAYS).mean()
+    week_std = daily.rolling(ACUTE_DAYS, min_periods=ACUTE_DAYS).std(ddof=0)
+    monotony = week_mean / week_std.replace(0.0, np.nan)
+    strain = acute * monotony
+
+    metrics = pd.concat(
+        {"carga": daily, "aguda": acute, "cronica": chronic, "acwr": acwr, "monotonia": monotony, "strain": strain},
+        axis=1,
+    )
+    metrics.columns.names = ["metrica", "equipo"]
+    metrics.index.name = "fecha"
+    return metrics.stack("equipo", future_stack=True).rename_axis(columns=None).reset_index()
+
+
+def latest_status(metrics):
+    """Último valor por equipo, con alertas de ACWR y monotonía."""
+    if metrics.empty:
+        return pd.DataFrame(columns=["equipo", "fecha", "aguda", "cronica", "acwr", "monotonia", "strain", "alerta"])
+    last = metrics.sort_values("fecha").drop_duplicates("equipo", keep="last").reset_index(drop=True)
+    alerts = np.select(
+        [last["acwr"] > ACWR_DANGER, last["acwr"] > ACWR_SAFE[1], last["acwr"] < ACWR_SAFE[0], last["monotonia"] > MONOTONY_HIGH],
+        ["🔴 ACWR muy alto", "🟠 ACWR alto", "🔵 ACWR bajo (desentrenamiento)", "🟠 Monotonía alta"],
+        default="🟢 OK",
+    )
+    last["alerta"] = np.where(last["acwr"].isna() & ~(last["monotonia"] > MONOTONY_HIGH), "⚪ Faltan datos", alerts)
+    return last.sort_values("equipo")[["equipo", "fecha", "aguda", "cronica", "acwr", "monotonia", "strain", "alerta"]]
@@ -0,0 +1,404 @@
+"""Exportación de planificaciones a PDF (Markdown -> HTML -> xhtml2pdf).
+
+Renderizar un plan largo tarda segundos, así que "Mis Planificaciones" no lo hace
+en cada rerun: el PDF se pide con un botón, se genera en segundo plano (hilos del
+`PdfRenderer`) y queda en memoria, indexado por el hash de (título, contenido,
+TEMPLATE_VERSION). Si el plan no cambia, la descarga siguiente es inmediata; si se
+edita, cambia el hash y se vuelve a generar. Los PDFs menos usados se desalojan al
+pasar MAX_CACHE_BYTES.
+
+La exportación masiva (`export_plans`) genera muchos planes a la vez en un pool de
+procesos; cada proceso escribe su PDF en un directorio temporal. El ZIP se arma en
+disco a medida que llegan; el PDF único (con índice y marcadores) junta las páginas
+en un PdfWriter y se escribe al final.
+"""
+import base64
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError, as_completed
+from functools import lru_cache
+from pathlib import Path
+
+# Subirla cuando cambie el CSS, el HTML o la lógica de anchos: invalida los PDFs cacheados
+TEMPLATE_VERSION = 2
+LOGO_PATH = "logo.jpg"
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_WORKERS = 2
+# La exportación en lote usa procesos nuevos (spawn): fork copiaría los hilos y locks del servidor
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+_TH_RE = re.compile(r'<th\b[^>]*>(.*?)</th>', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]+>')
+# Encabezado de cada tabla que genera markdown: se le antepone el <colgroup> en una sola pasada
+_TABLE_HEAD_RE = re.compile(r'<table>(\s*<thead>.*?</thead>)', re.IGNORECASE | re.DOTALL)
+_CSS_SPACE_RE = re.compile(r'\s*([{};:,])\s*|\s+')
+_CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+_FILENAME_RE = re.compile(r'[^\w\-]+')
+
+EXPORT_FORMATS = ("zip", "pdf")
+
+# Resultado de export_plans: ruta del archivo generado, planes incluidos, páginas totales,
+# títulos que fallaron y segundos de renderizado
+ExportResult = namedtuple("ExportResult", ["path", "plans", "pages", "failed", "seconds"])
+
+# Sin border-collapse ni table-layout: xhtml2pdf no los implementa y avisaba en cada render
+CSS_STYLE = """
+    @page { size: A4 landscape; margin: 1cm; }
+    body { font-family: Helvetica, sans-serif; font-size: 10pt; color: #333; }
+    h1 { color: #2E7D32; font-size: 16pt; margin-bottom: 15px; text-align: center; font-weight: bold; }
+    h2 { color: #1565C0; font-size: 13pt; margin-top: 15px; border-bottom: 2px solid #EEE; padding-bottom: 5px; }
+    h3 { color: #444; font-size: 11pt; margin-top: 10px; font-weight: bold; }
+    p { line-height: 1.4; margin-bottom: 8px; text-align: justify; }
+
+    /* Tablas */
+    table { width: 100%; margin-top: 10px; margin-bottom: 15px; }
+    th { background-color: #004d40; color: white; padding: 6px; border: 1px solid #444; font-weight: bold; text-align: center; font-size: 9pt; }
+    td { padding: 6px; border: 1px solid #CCC; text-align: left; vertical-align: top; font-size: 9pt; word-wrap: break-word; }
+
+    /* Listas */
+    ul, ol { margin-bottom: 8px; padding-left: 15px; }
+    li { margin-bottom: 3px; }
+
+    strong { color: #000; font-weight: bold; }
+
+    /* Logo en esquina superior derecha */
+    #header-logo { position: absolute; top: -20px; right: 0px; width: 80px; height: auto; }
+"""
+
+# Peso de cada columna según su encabezado: gana la primera regla con alguna palabra contenida
+BASE_WEIGHT = 12
+WIDTH_RULES = (
+    (("ejercicio", "tarea", "actividad"), 22),
+    (("foco", "descripción", "observaciones", "notas", "logística"), 45),  # mucho espacio para texto largo
+    (("intensidad", "intensity", "objetivo", "capacidades"), 25),
+    (("series", "sets", "reps", "repeticiones", "nº", "grupo", "g1", "g2"), 8),  # columnas estrechas
+    (("pausa", "rest", "recup", "tiempo", "duración", "distancia", "vel", "vam"), 12),
+    (("fase", "mes", "semana"), 18),
+)
+
+
+def render_key(title, content):
+    """Hash de lo que determina el PDF: título, contenido y versión de la plantilla."""
+    h = hashlib.sha256()
+    for part in (str(TEMPLATE_VERSION), title or "", content or ""):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def minify_css(css):
+    return _CSS_SPACE_RE.sub(lambda m: m.group(1) or " ", _CSS_COMMENT_RE.sub("", css)).strip()
+
+
+class PdfTemplate:
+    """Todo lo del PDF que no depende del plan, preparado una vez por proceso.
+
+    Guarda la hoja de estilos compactada, el logo como data URI, el comienzo del
+    documento HTML ya armado y las reglas de anchos compiladas (con memo por
+    encabezado). El conversor de markdown se reutiliza, uno por hilo.
+    """
+
+    def __init__(self, css=CSS_STYLE, logo_path=LOGO_PATH, width_rules=WIDTH_RULES):
+        self.stylesheet = minify_css(css)
+        self.logo_uri = ""
+        if logo_path and os.path.exists(logo_path):
+            with open(logo_path, "rb") as image_file:
+                self.logo_uri = "data:image/jpeg;base64," + base64.b64encode(image_file.read()).decode()
+        self._rules = [(re.compile("|".join(map(re.escape, words))), weight) for words, weight in width_rules]
+        self._weights = {}
+        img_tag = f'<img id="header-logo" src="{self.logo_uri}"/>' if self.logo_uri else ""
+        self._head = f'<!DOCTYPE html><html><head><meta charset="utf-8"><style>{self.stylesheet}</style></head><body>{img_tag}'
+        self._local = threading.local()
+
+    def header_weight(self, header):
+        weight = self._weights.get(header)
+        if weight is None:
+            weight = next((w for rule, w in self._rules if rule.search(header)), BASE_WEIGHT)
+            self._weights[header] = weight
+        return weight
+
+    def column_widths(self, headers):
+        """Anchos (%) de las columnas según el texto de los encabezados."""
+        weights = [self.header_weight(h) for h in headers]
+        total_w = sum(weights)
+        return [f"{(w/total_w)*100:.1f}%" for w in weights]
+
+    def _colgroup(self, match):
+        # Limpiar tags HTML internos de los headers si los hay
+        headers = [_TAG_RE.sub('', h).strip().lower() for h in _TH_RE.findall(match.group(1))]
+        if not headers:
+            return match.group(0)
+        cols = "".join(f'<col width="{w}">' for w in self.column_widths(headers))
+        return f"<table><colgroup>{cols}</colgroup>{match.group(1)}"
+
+    def layout_tables(self, html_text):
+        """Agrega a cada tabla un <colgroup> con anchos según sus encabezados."""
+        return _TABLE_HEAD_RE.sub(self._colgroup, html_text)
+
+    def markdown(self, content):
+        md = getattr(self._local, "md", None)
+        if md is None:
+            import markdown
+            md = self._local.md = markdown.Markdown(extensions=['tables'])
+        return md.reset().convert(content)
+
+    def html(self, title, content):
+        """Documento HTML completo listo para xhtml2pdf."""
+        body = self.layout_tables(self.markdown(content))
+        return f"{self._head}<h1>{title}</h1><hr/>{body}</body></html>"
+
+    def render(self, title, content):
+        """Bytes del PDF, o None si faltan xhtml2pdf/markdown o falla la generación."""
+        try:
+            from xhtml2pdf import pisa
+            full_html = self.html(title, content)
+        except ImportError:
+            return None
+
+        # Generar PDF en memoria
+        pdf_buffer = io.BytesIO()
+        pisa_status = pisa.CreatePDF(io.BytesIO(full_html.encode("utf-8")), dest=pdf_buffer)
+        if pisa_status.err:
+            return None
+        return pdf_buffer.getvalue()
+
+
+@lru_cache(maxsize=1)
+def get_template():
+    """Plantilla del proceso (cada proceso del pool arma la suya la primera vez)."""
+    return PdfTemplate()
+
+
+def create_pdf(title, content):
+    """Bytes del PDF, o None si faltan xhtml2pdf/markdown o falla la generación."""
+    return get_template().render(title, content)
+
+
+def timed_pdf(title, content):
+    """(bytes o None, segundos que tardó el render)."""
+    start = time.perf_counter()
+    pdf = create_pdf(title, content)
+    return pdf, time.perf_counter() - start
+
+
+class PdfRenderer:
+    """PDFs generados en segundo plano y cacheados en memoria (uno por proceso).
+
+    `request()` encola la generación y vuelve enseguida; `get()` nunca espera: devuelve
+    el estado actual ("ready", "pending", "error" o "missing"). Los hilos alcanzan
+    porque la app solo genera un PDF cuando alguien lo pide; la exportación masiva
+    tiene su propio pool.
+    """
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES, max_workers=MAX_WORKERS):
+        self.max_bytes = max_bytes
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdf")
+        self._lock = threading.Lock()
+        self._done = OrderedDict()  # clave -> bytes (o None si falló), del menos al más usado
+        self._pending = {}  # clave -> Future
+        self._seconds = {}  # clave -> segundos que tardó el render
+        self._size = 0
+
+    def request(self, title, content):
+        """Encola el PDF si no está hecho ni en curso. Devuelve su clave."""
+        key = render_key(title, content)
+        with self._lock:
+            if key in self._done or key in self._pending:
+                return key
+            future = self._pool.submit(timed_pdf, title, content)
+            self._pending[key] = future
+        # Fuera del lock: si ya terminó, el callback corre en este mismo hilo
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return key
+
+    def _finish(self, key, future):
+        try:
+            pdf, seconds = future.result()
+        except Exception as e:
+            print(f"Error generando PDF: {e}")
+            pdf, seconds = None, None
+        with self._lock:
+            self._pending.pop(key, None)
+            self._done[key] = pdf
+            self._seconds[key] = seconds
+            self._size += len(pdf or b"")
+            self._evict()
+
+    def _evict(self):
+        # Siempre se conserva el último generado, aunque solo supere el límite
+        while self._size > self.max_bytes and len(self._done) > 1:
+            key, pdf = self._done.popitem(last=False)
+            self._seconds.pop(key, None)
+            self._size -= len(pdf or b"")
+
+    def get(self, title, content):
+        """(estado, bytes) sin bloquear; estado es "ready", "pending", "error" o "missing"."""
+        key = render_key(title, content)
+        with self._lock:
+            if key in self._done:
+                self._done.move_to_end(key)
+                pdf = self._done[key]
+                return ("ready", pdf) if pdf else ("error", None)
+            if key in self._pending:
+                return "pending", None
+        return "missing", None
+
+    def discard(self, title, content):
+        """Olvida un PDF (por ejemplo, para reintentar uno que falló)."""
+        key = render_key(title, content)
+        with self._lock:
+            pdf = self._done.pop(key, None)
+            self._seconds.pop(key, None)
+            self._size -= len(pdf or b"")
+
+    def render_seconds(self, title, content):
+        """Cuánto tardó en generarse el PDF (None si no está hecho)."""
+        with self._lock:
+            return self._seconds.get(render_key(title, content))
+
+    def wait(self, title, content, timeout):
+        """Espera hasta `timeout` segundos a que termine un PDF en curso (solo tras pedirlo)."""
+        with self._lock:
+            future = self._pending.get(render_key(title, content))
+        if future is None:
+            return self.get(title, content)
+        try:
+            # El resultado se lee del Future: el callback que lo guarda puede no haber corrido aún
+            pdf, _ = future.result(timeout=timeout)
+        except TimeoutError:
+            return "pending", None
+        except Exception:
+            return "error", None
+        return ("ready", pdf) if pdf else ("error", None)
+
+
+# --- Exportación masiva ---
+def export_filename(plan, index):
+    """Nombre del PDF de un plan dentro del ZIP (ordenable y sin caracteres raros)."""
+    slug = _FILENAME_RE.sub("_", plan.get("titulo", "")).strip("_")[:60] or "plan"
+    return f"{index + 1:03d}_{slug}_{plan['id'][:8]}.pdf"
+
+
+def render_to_file(title, content, path):
+    """Tarea del pool de procesos: escribe el PDF en `path` y devuelve su número de páginas."""
+    from pypdf import PdfReader
+
+    pdf = create_pdf(title, content)
+    if not pdf:
+        raise RuntimeError("el módulo PDF no está disponible o falló la generación")
+    with open(path, "wb") as f:
+        f.write(pdf)
+    return len(PdfReader(path).pages)
+
+
+def iter_render(plans, workdir, max_workers=None):
+    """Genera en paralelo el PDF de cada plan dentro de `workdir`.
+
+    Produce (índice, ruta, páginas, error) en el orden en que terminan.
+    """
+    workdir = Path(workdir)
+    tasks = [(i, p["titulo"], p["contenido"], workdir / export_filename(p, i)) for i, p in enumerate(plans)]
+    if not tasks:
+        return
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT) as pool:
+        futures = {pool.submit(render_to_file, title, content, path): (i, path) for i, title, content, path in tasks}
+        for future in as_completed(futures):
+            i, path = futures[future]
+            try:
+                yield i, path, future.result(), None
+            except Exception as e:
+                yield i, path, 0, e
+
+
+def _toc_markdown(entries, offset):
+    rows = "\n".join(
+        f"| {n} | {title.replace('|', '/')} | {page + offset} |" for n, (title, page) in enumerate(entries, start=1)
+    )
+    return "| Nº | Planificación | Página |\n|---|---|---|\n" + rows
+
+
+def _render_toc(entries, path):
+    """Escribe el índice en `path`; los números de página cuentan las páginas del propio índice."""
+    from pypdf import PdfReader
+
+    toc_pages = 1
+    for _ in range(3):
+        pdf = create_pdf("Índice", _toc_markdown(entries, toc_pages))
+        if not pdf:
+            raise RuntimeError("no se pudo generar el índice")
+        with open(path, "wb") as f:
+            f.write(pdf)
+        pages = len(PdfReader(path).pages)
+        if pages == toc_pages:
+            break
+        toc_pages = pages
+    return toc_pages
+
+
+def export_plans(plans, fmt="zip", max_workers=None, progress=None, dest_dir=None):
+    """Exporta `plans` a un ZIP (un PDF por plan) o a un único PDF con índice y marcadores.
+
+    Los PDFs se generan en un pool de procesos y se escriben en disco a medida que
+    terminan. El ZIP se escribe plan a plan; con fmt="pdf" el PdfWriter tiene todas
+    las páginas en memoria hasta escribir el archivo final. `progress(hechas, total, título)` se
+    llama desde el hilo que invoca la función. Devuelve un ExportResult; el archivo
+    queda en `dest_dir` (por defecto, el temporal del sistema) y borrarlo es cosa de
+    quien llama.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt}")
+    fd, out_path = tempfile.mkstemp(prefix="planificaciones_", suffix=f".{fmt}", dir=dest_dir)
+    os.close(fd)
+    start = time.perf_counter()
+    pages, failed, done = {}, [], 0
+
+    with tempfile.TemporaryDirectory(prefix="pdf_export_") as workdir:
+        zf = zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) if fmt == "zip" else None
+        try:
+            for i, path, n_pages, error in iter_render(plans, workdir, max_workers):
+                done += 1
+                if error is not None:
+                    print(f"Error exportando '{plans[i]['titulo']}': {error}")
+                    failed.append(plans[i]["titulo"])
+                elif zf:
+                    zf.write(path, arcname=path.name)
+                    os.remove(path)
+                    pages[i] = n_pages
+                else:
+                    pages[i] = n_pages
+                if progress:
+                    progress(done, len(plans), plans[i]["titulo"])
+        finally:
+            if zf:
+                zf.close()
+
+        if fmt == "pdf" and pages:
+            from pypdf import PdfWriter
+
+            order = sorted(pages)
+            entries, page = [], 1
+            for i in order:
+                entries.append((plans[i]["titulo"], page))
+                page += pages[i]
+            toc_path = Path(workdir) / "000_indice.pdf"
+            _render_toc(entries, toc_path)
+            writer = PdfWriter()
+            # Sin importar los marcadores de cada PDF: solo uno por plan
+            writer.append(str(toc_path), outline_item="Índice", import_outline=False)
+            for i in order:
+                writer.append(str(Path(workdir) / export_filename(plans[i], i)), outline_item=plans[i]["titulo"],
+                              import_outline=False)
+            with open(out_path, "wb") as f:
+                writer.write(f)
+            writer.close()
+
+    return ExportResult(out_path, len(pages), sum(pages.values()), failed, time.perf_counter() - start)
@@ -0,0 +1,323 @@
+"""Forma estructurada de los planes guardados.
+
+El markdown que devuelve la IA se parsea una sola vez, al guardar: secciones
+(títulos y minutos), tablas como columnas tipadas (ejercicio, grupo, series, reps,
+trabajo, pausa, %VAM, velocidad, distancia) y los metadatos detectados (tipo,
+equipo, fecha, duración y RPE planificado). Se guarda en el plan bajo "estructura", junto al markdown, y los
+filtros, análisis y prompts usan esta forma en vez de volver a recorrer el texto.
+
+Las filas de todas las tablas de un plan van en un solo bloque columnar ("cargas":
+un dict columna -> lista), con "seccion" y "tabla" indicando de dónde sale cada fila.
+Las tablas sin ninguna columna reconocida (las matrices de los planes mensuales,
+semestrales y anuales) guardan además sus celdas tal cual, para el prompt.
+"""
+import re
+
+from retrieval import normalize
+from vam_calculator import parse_interval_spec
+
+STRUCTURE_VERSION = 3
+
+PLAN_TYPES = ["Sesión Diaria", "Semanal", "Mensual", "Semestral", "Anual"]
+
+# Columna tipada -> comienzos de palabra a buscar en los encabezados (normalizados), en
+# orden de preferencia. Cada encabezado se asigna a una sola columna.
+COLUMN_KEYWORDS = [
+    ("grupo", ("grupo",)),
+    ("pct_vam", ("vam", "intensidad")),
+    ("vel", ("vel",)),
+    ("distancia", ("distancia", "metros")),
+    ("series", ("serie", "vuelta")),
+    ("reps", ("repet", "reps", "volumen")),
+    ("pausa", ("pausa", "recuper", "descanso", "macro")),
+    ("trabajo", ("trabajo", "tiempo", "duracion")),
+    ("ejercicio", ("ejercicio", "tarea", "actividad", "estacion", "contenido")),
+]
+TEXT_COLUMNS = ("ejercicio", "grupo")
+NUMERIC_COLUMNS = ("series", "reps", "trabajo", "pausa", "pct_vam", "vel", "distancia")
+LOAD_COLUMNS = ("seccion", "tabla") + TEXT_COLUMNS + NUMERIC_COLUMNS
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)$")
+_BOLD_LINE_RE = re.compile(r"^\s*(?:[-*]\s*)?\*\*([^*]+)\*\*\s*:?\s*$")
+_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{3,}")
+_NUMBER_RE = re.compile(r"(\d+(?:[.,]\d+)?)")
+_PERCENT_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*%")
+_MULTIROW_RE = re.compile(r"\\multi(?:row|column)\{[^}]*\}\{[^}]*\}\{(.*?)\}\s*$")
+_SECONDS_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(\"|''|seg\w*|s\b|min\w*|'|m\b)?", re.IGNORECASE)
+_MINUTES_RE = re.compile(r"(\d+)\s*(?:min\w*|')", re.IGNORECASE)
+_DURATION_RE = re.compile(r"duraci[oó]n\W{0,6}(\d+)\s*(?:min\w*|')", re.IGNORECASE)
+# "RPE 6", "RPE 4-5", "RPE 8/10" (el "/10" es la escala, no un rango)
+_RPE_RE = re.compile(r"\bs?RPE\W{0,3}(?:objetivo\W{0,3}(?:de\s*)?)?(\d{1,2}(?:[.,]\d)?)(?:\s*([-–/])\s*(\d{1,2}))?", re.IGNORECASE)
+_DATE_RE = re.compile(r"\((\d{4}-\d{2}-\d{2})\)\s*$")
+
+
+def _clean(cell):
+    """Texto de una celda sin marcas de markdown, <br> ni celdas combinadas de LaTeX."""
+    cell = _MULTIROW_RE.sub(r"\1", cell.strip())
+    cell = cell.replace("<br>", " ").replace("**", "").replace("*", "").replace("`", "")
+    return " ".join(cell.split())
+
+
+def _split_row(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [_clean(c) for c in line.split("|")]
+
+
+def _number(text, pattern=_NUMBER_RE):
+    match = pattern.search(text)
+    return float(match.group(1).replace(",", ".")) if match else None
+
+
+def _percent(text):
+    return _number(text, _PERCENT_RE)
+
+
+def _seconds(text):
+    """Primer tiempo del texto en segundos ("30 seg", '15"', "3'", "2 min")."""
+    match = _SECONDS_RE.search(text)
+    if not match:
+        return None
+    value = float(match.group(1).replace(",", "."))
+    unit = (match.group(2) or "").lower()
+    # "m" suelto es ambiguo (metros), solo cuenta como minutos con "min" o apóstrofo
+    return value * 60 if unit.startswith("min") or unit == "'" else value
+
+
+_PARSERS = {
+    "series": _number, "reps": _number, "pct_vam": _percent, "vel": _number, "distancia": _number,
+    "trabajo": _seconds, "pausa": _seconds,
+}
+
+
+def map_columns(headers):
+    """Índice de celda de cada columna tipada reconocida en los encabezados."""
+    normalized = [normalize(h) for h in headers]
+    mapping = {}
+    for column, keywords in COLUMN_KEYWORDS:
+        for keyword in keywords:
+            pattern = re.compile(r"\b" + re.escape(keyword))
+            idx = next((i for i, h in enumerate(normalized) if i not in mapping.values() and pattern.search(h)), None)
+            if idx is not None:
+                mapping[column] = idx
+                break
+    return mapping
+
+
+def detect_tipo(title, tipo=""):
+    """Tipo guardado, o el que aparece en el título (planes viejos sin "tipo")."""
+    if tipo:
+        return tipo
+    for candidate in ("Mensual", "Semanal", "Semestral", "Anual"):
+        if candidate in title:
+            return candidate
+    return "Sesión Diaria" if "Diaria" in title else ""
+
+
+def detect_team(title, teams=()):
+    """Equipo del título "Tipo - Equipo | Etiqueta (fecha)": el nombre conocido más largo que aparece."""
+    found = [t for t in teams if t and t in title]
+    if found:
+        return max(found, key=len)
+    if " - " in title:
+        rest = title.split(" - ", 1)[1]
+        return re.split(r" \| | \(", rest, maxsplit=1)[0].strip()
+    return ""
+
+
+def detect_date(title, fecha=""):
+    if fecha:
+        return fecha
+    match = _DATE_RE.search(title)
+    return match.group(1) if match else ""
+
+
+def detect_rpe(content):
+    """RPE planificado: media de los valores "RPE n" del plan (None si no menciona ninguno)."""
+    values = []
+    for match in _RPE_RE.finditer(content):
+        low = float(match.group(1).replace(",", "."))
+        high = float(match.group(3)) if match.group(2) in ("-", "–") else low
+        if 0 < low <= high <= 10:
+            values.append((low + high) / 2)
+    return round(sum(values) / len(values), 1) if values else None
+
+
+def parse_plan(content, title="", tipo="", fecha="", teams=()):
+    """Estructura de un plan a partir de su markdown y su título."""
+    sections = [{"titulo": "", "nivel": 0, "minutos": None}]
+    tables = []
+    loads = {column: [] for column in LOAD_COLUMNS}
+    context = []  # líneas desde la última tabla o título (nombre de ejercicio, "Estructura: ...")
+    lines = content.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        heading = _HEADING_RE.match(line.strip())
+        if heading:
+            text = _clean(heading.group(2))
+            minutes = _MINUTES_RE.search(text)
+            sections.append({
+                "titulo": text, "nivel": len(heading.group(1)),
+                "minutos": int(minutes.group(1)) if minutes else None,
+            })
+            context = [text]
+            i += 1
+            continue
+        if line.strip().startswith("|") and i + 1 < len(lines) and _SEPARATOR_RE.match(lines[i + 1].strip()):
+            headers = _split_row(line)
+            i += 2
+            rows = []
+            while i < len(lines) and lines[i].strip().startswith("|"):
+                rows.append(_split_row(lines[i]))
+                i += 1
+            _add_table(tables, loads, len(sections) - 1, headers, rows, context)
+            context = []
+            continue
+        if line.strip():
+            context.append(line)
+        i += 1
+
+    if len(sections) > 1 and not sections[0]["titulo"]:
+        # Sin texto antes del primer título: la sección vacía sobra, salvo que tenga tablas
+        if all(t["seccion"] for t in tables):
+            sections.pop(0)
+            loads["seccion"] = [s - 1 for s in loads["seccion"]]
+            for table in tables:
+                table["seccion"] -= 1
+
+    duration = _DURATION_RE.search(content)
+    section_minutes = [s["minutos"] for s in sections if s["minutos"] and s["nivel"] >= 3]
+    return {
+        "version": STRUCTURE_VERSION,
+        "tipo": detect_tipo(title, tipo),
+        "equipo": detect_team(title, teams),
+        "fecha": detect_date(title, fecha),
+        "duracion_min": int(duration.group(1)) if duration else (sum(section_minutes) or None),
+        "rpe": detect_rpe(content),
+        "secciones": sections,
+        "tablas": tables,
+        "cargas": loads,
+    }
+
+
+def _add_table(tables, loads, section, headers, rows, context):
+    mapping = map_columns(headers)
+    # Nombre y estructura del ejercicio escritos arriba de la tabla (formato de la sesión diaria)
+    name = ""
+    for line in reversed(context):
+        bold = _BOLD_LINE_RE.match(line)
+        if bold:
+            name = _clean(bold.group(1)).strip("[]")
+            break
+    if not name and context:
+        name = _clean(context[0])[:80]
+    spec = parse_interval_spec(" ".join(context)) if context else None
+
+    table_idx = len(tables)
+    table = {"seccion": section, "encabezados": headers, "filas": len(rows)}
+    if not mapping:
+        # Sin columnas tipadas (semana/objetivo/capacidades...): lo único útil son las celdas
+        table["celdas"] = rows
+    tables.append(table)
+    for row in rows:
+        row = row + [""] * (len(headers) - len(row))
+        values = {}
+        for column in TEXT_COLUMNS:
+            values[column] = row[mapping[column]] if column in mapping else ""
+        for column in NUMERIC_COLUMNS:
+            values[column] = _PARSERS[column](row[mapping[column]]) if column in mapping else None
+        if not values["ejercicio"]:
+            values["ejercicio"] = name
+        if spec:
+            for column, value in (("series", spec.series), ("reps", spec.reps), ("trabajo", spec.work),
+                                  ("pausa", spec.rest), ("pct_vam", spec.pct)):
+                if values[column] is None:
+                    values[column] = value
+        loads["seccion"].append(section)
+        loads["tabla"].append(table_idx)
+        for column in TEXT_COLUMNS + NUMERIC_COLUMNS:
+            loads[column].append(values[column])
+
+
+def ensure_structure(plan, teams=()):
+    """Estructura del plan, parseándola solo si falta o es de una versión vieja."""
+    struct = plan.get("estructura")
+    if not struct or struct.get("version") != STRUCTURE_VERSION:
+        struct = parse_plan(plan.get("contenido", ""), plan.get("titulo", ""), plan.get("tipo", ""),
+                            plan.get("fecha", ""), teams)
+        plan["estructura"] = struct
+    return struct
+
+
+def refresh_structure(plan, teams=()):
+    """Vuelve a parsear el plan (tras editar título o contenido)."""
+    plan.pop("estructura", None)
+    return ensure_structure(plan, teams)
+
+
+def ensure_all(plans, teams=()):
+    """Completa la estructura de los planes que no la tienen. Devuelve cuántos se parsearon."""
+    missing = [p for p in plans if (p.get("estructura") or {}).get("version") != STRUCTURE_VERSION]
+    for plan in missing:
+        ensure_structure(plan, teams)
+    return len(missing)
+
+
+def table_rows(struct):
+    """Filas de "cargas" como dicts (para DataFrame o prompts)."""
+    loads = struct["cargas"]
+    return [dict(zip(LOAD_COLUMNS, values)) for values in zip(*(loads[c] for c in LOAD_COLUMNS))]
+
+
+def _fmt(value, unit=""):
+    if value is None:
+        return ""
+    return f"{value:g}{unit}"
+
+
+def prompt_summary(plan, max_rows=40, max_cell=150):
+    """Resumen compacto de un plan previo para el prompt: secciones + cargas tipadas.
+
+    Las tablas sin columnas tipadas van con sus celdas (recortadas a `max_cell`); si el
+    plan no tiene tablas, va el comienzo del markdown.
+    """
+    struct = plan["estructura"]
+    lines = [f"Tipo: {struct['tipo'] or '-'} | Fecha: {struct['fecha'] or '-'}"]
+    if struct.get("duracion_min"):
+        lines[0] += f" | Duración: {struct['duracion_min']} min"
+    titles = [s["titulo"] for s in struct["secciones"] if s["titulo"]]
+    if titles:
+        lines.append("Secciones: " + " / ".join(titles))
+    if not struct["tablas"]:
+        content = plan.get("contenido", "").strip()
+        limit = max_rows * max_cell
+        lines.append(content[:limit] + (" [...]" if len(content) > limit else ""))
+        return "\n".join(lines)
+
+    raw_tables = {i for i, t in enumerate(struct["tablas"]) if "celdas" in t}
+    rows = [row for row in table_rows(struct) if row["tabla"] not in raw_tables]
+    budget = max_rows
+    if rows:
+        lines.append("Cargas (ejercicio | grupo | series x reps | trabajo/pausa | %VAM | distancia):")
+        for row in rows[:budget]:
+            volume = f"{_fmt(row['series'])} x {_fmt(row['reps'])}" if row["series"] or row["reps"] else ""
+            timing = f"{_fmt(row['trabajo'], 's')}/{_fmt(row['pausa'], 's')}" if row["trabajo"] or row["pausa"] else ""
+            cells = [row["ejercicio"][:60], row["grupo"], volume, timing, _fmt(row["pct_vam"], "%"), _fmt(row["distancia"], " m")]
+            lines.append("- " + " | ".join(cells))
+        if len(rows) > budget:
+            lines.append(f"- ... ({len(rows) - budget} filas más)")
+        budget = max(0, budget - len(rows))
+
+    for idx in sorted(raw_tables):
+        table = struct["tablas"][idx]
+        lines.append("Tabla (" + " | ".join(h[:max_cell] for h in table["encabezados"]) + "):")
+        for cells in table["celdas"][:budget]:
+            lines.append("- " + " | ".join(c[:max_cell] for c in cells))
+        if len(table["celdas"]) > budget:
+            lines.append(f"- ... ({len(table['celdas']) - budget} filas más)")
+        budget = max(0, budget - len(table["celdas"]))
+    return "\n".join(lines)
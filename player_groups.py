@@ -0,0 +1,117 @@
+"""Tests por jugador y armado automático de los grupos de entrenamiento (G1, G2, ...).
+
+La plantilla se guarda en el equipo como tabla columnar ("jugadores": columna ->
+lista, una posición por jugador). Los grupos salen de un k-means 1-D sobre el test
+elegido (VAM por defecto), vectorizado con numpy: en una dimensión los centros
+ordenados definen cortes en los puntos medios, así que asignar a cada jugador es un
+`searchsorted` y recalcular los centros un `bincount`. G1 es siempre el grupo más rápido.
+
+La velocidad de cada grupo (media de sus jugadores en cada test) reemplaza los
+valores G1/G2/G3 cargados a mano, y de ahí la toman el prompt y vam_calculator.
+"""
+import numpy as np
+import pandas as pd
+
+TESTS = ("vam", "velocidad", "rsa")
+PLAYER_COLUMNS = ("nombre",) + TESTS
+DEFAULT_GROUPS = 3
+MAX_GROUPS = 6
+MAX_ITER = 100
+
+
+def empty_roster():
+    return {column: [] for column in PLAYER_COLUMNS}
+
+
+def roster_arrays(roster):
+    """(nombres, {test: array float}) con NaN donde el jugador no tiene dato (o es 0)."""
+    roster = roster or {}
+    names = [str(n or "") for n in roster.get("nombre", [])]
+    tests = {}
+    for test in TESTS:
+        values = np.full(len(names), np.nan)
+        column = pd.to_numeric(pd.Series(roster.get(test, [])[:len(names)], dtype=object), errors="coerce").to_numpy(float)
+        values[:column.size] = column
+        values[values <= 0] = np.nan
+        tests[test] = values
+    return names, tests
+
+
+def kmeans_1d(values, k):
+    """Etiquetas 0..k-1 (0 = valores más altos) y centros ordenados de mayor a menor.
+
+    Puede devolver menos de k grupos: nunca queda uno vacío.
+    """
+    values = np.asarray(values, dtype=float)
+    k = max(1, min(k, np.unique(values).size))
+    centers = np.quantile(values, (np.arange(k) + 0.5) / k)
+    for _ in range(MAX_ITER):
+        cuts = (centers[1:] + centers[:-1]) / 2
+        labels = np.searchsorted(cuts, values)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.bincount(labels, weights=values, minlength=k)
+        new_centers = np.sort(np.where(counts > 0, sums / np.maximum(counts, 1), centers))
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    labels = np.searchsorted((centers[1:] + centers[:-1]) / 2, values)
+    # Un centro sin jugadores no es un grupo: se descarta y se renumera en orden
+    used = np.unique(labels)
+    labels = np.searchsorted(used, labels)
+    centers = centers[used]
+    k = used.size
+    # Invertir: el centro más alto pasa a ser el grupo 0 (G1)
+    return k - 1 - labels, centers[::-1]
+
+
+def compute_groups(roster, n_groups=DEFAULT_GROUPS, by="vam"):
+    """Agrupa la plantilla por el test `by`.
+
+    Devuelve (labels, speeds): labels es un array con el grupo de cada jugador (0 = G1,
+    -1 = sin dato en `by`) y speeds {test: {"g1": media, ...}} solo para los tests con
+    datos en la plantilla.
+    """
+    names, tests = roster_arrays(roster)
+    labels = np.full(len(names), -1)
+    key = tests[by]
+    valid = ~np.isnan(key)
+    if not valid.any():
+        return labels, {}
+    labels[valid], _ = kmeans_1d(key[valid], n_groups)
+    k = int(labels.max()) + 1
+
+    speeds = {}
+    for test, values in tests.items():
+        mask = (labels >= 0) & ~np.isnan(values)
+        if not mask.any():
+            continue
+        sums = np.bincount(labels[mask], weights=values[mask], minlength=k)
+        counts = np.bincount(labels[mask], minlength=k)
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+        speeds[test] = {f"g{i + 1}": round(float(m), 2) for i, m in enumerate(means)}
+    return labels, speeds
+
+
+def group_members(roster, labels):
+    """{"g1": [nombres], ...} según las etiquetas de compute_groups."""
+    if not labels.size:
+        return {}
+    names = np.array(roster_arrays(roster)[0], dtype=object)
+    return {f"g{g + 1}": names[labels == g].tolist() for g in range(int(labels.max()) + 1)}
+
+
+def roster_frame(roster):
+    """DataFrame para el editor con tipos fijos (de una plantilla vacía no se pueden inferir)."""
+    df = pd.DataFrame(roster or empty_roster(), columns=list(PLAYER_COLUMNS))
+    return df.astype({"nombre": str, **{test: float for test in TESTS}})
+
+
+def roster_from_frame(df):
+    """Tabla columnar a partir del DataFrame del editor (sin filas vacías)."""
+    df = df.reindex(columns=list(PLAYER_COLUMNS))
+    df = df[df["nombre"].fillna("").astype(str).str.strip() != ""]
+    roster = {"nombre": df["nombre"].astype(str).str.strip().tolist()}
+    for test in TESTS:
+        values = pd.to_numeric(df[test], errors="coerce").round(2)
+        roster[test] = values.astype(object).where(values.notna(), None).tolist()
+    return roster
@@ -0,0 +1,134 @@
+"""Perfil de tiempos de import del arranque de app.py (python -X importtime).
+
+Importa, en un proceso nuevo y en el mismo orden que app.py, los módulos que app.py
+importa al arrancar, y después los SDK que se cargan en el primer uso (Gemini,
+Firebase, la cadena de PDF). Muestra cuánto agrega cada módulo y el total.
+
+    python profile_imports.py                  # compara con la línea base guardada
+    python profile_imports.py --save-baseline  # guarda los resultados como nueva línea base
+
+Si el arranque supera al de la línea base en más de --tolerance, termina con código 1.
+"""
+import argparse
+import ast
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+APP_FILE = Path(__file__).with_name("app.py")
+# Se versiona junto al código para que las regresiones se vean en cada cambio
+BASELINE_FILE = APP_FILE.with_name("import_profile.json")
+
+# Se importan recién al usarlos (ver generation._genai, app.connect_firebase y pdf_export)
+LAZY_MODULES = ["google.generativeai", "firebase_admin", "firebase_admin.firestore", "pypdf", "markdown", "xhtml2pdf.pisa"]
+
+_LINE_RE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)")
+_MARKER = "--import "
+_LOADED = "--loaded "
+
+
+def startup_modules(path=APP_FILE):
+    """Módulos que app.py importa a nivel de módulo, en orden."""
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        modules.extend(name for name in names if name not in modules)
+    return modules
+
+
+def profile(startup, lazy):
+    """({módulo: ms que agrega su import}, diferidos que ya cargó el arranque), en un solo proceso y en orden."""
+    lines = ["import sys"]
+    for name in startup + lazy:
+        if name == (lazy or [None])[0]:
+            lines.append(f"sys.stderr.write({_LOADED!r} + ' '.join(m for m in {lazy!r} if m in sys.modules) + '\\n')")
+        lines.append(f"sys.stderr.write({_MARKER + name!r} + '\\n')")
+        lines.append(f"try:\n    import {name}\nexcept Exception as e:\n    sys.stderr.write('! ' + repr(e) + '\\n')")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "\n".join(lines)],
+        cwd=APP_FILE.parent, capture_output=True, text=True,
+    )
+    timings = {}
+    loaded = []
+    current = None
+    for line in proc.stderr.splitlines():
+        if line.startswith(_LOADED):
+            loaded = line[len(_LOADED):].split()
+            current = None
+        elif line.startswith(_MARKER):
+            current = line[len(_MARKER):]
+            timings[current] = 0.0
+        elif line.startswith("! ") and current:
+            print(f"  ! {current}: {line[2:]}")
+            timings.pop(current, None)
+        elif current:
+            match = _LINE_RE.match(line)
+            # Solo los imports de primer nivel: su tiempo acumulado ya incluye los anidados
+            if match and not match.group(2):
+                timings[current] += int(match.group(1)) / 1000
+    return timings, loaded
+
+
+def report(title, timings):
+    print(f"\n{title}")
+    for name, ms in sorted(timings.items(), key=lambda item: -item[1]):
+        print(f"  {ms:8.1f} ms  {name}")
+    total = sum(timings.values())
+    print(f"  {total:8.1f} ms  TOTAL")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regresión admitida en el arranque (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    startup = startup_modules()
+    timings, loaded = profile(startup, [m for m in LAZY_MODULES if m not in startup])
+    startup_ms = report("Arranque (imports de app.py)", {m: timings[m] for m in startup if m in timings})
+    lazy_ms = report("En el primer uso", {m: timings[m] for m in LAZY_MODULES if m in timings})
+    # Un SDK diferido que ya carga el arranque es una regresión aunque los tiempos no cambien
+    eager = [m for m in LAZY_MODULES if m in loaded or m in startup]
+    for name in eager:
+        print(f"  ! {name} ya se importa en el arranque")
+    if eager:
+        print("REGRESIÓN: hay SDK diferidos que se importan al arrancar")
+        sys.exit(1)
+
+    summary = {
+        "startup_ms": round(startup_ms, 1),
+        "lazy_ms": round(lazy_ms, 1),
+        "modules": {name: round(ms, 1) for name, ms in timings.items()},
+    }
+    if args.save_baseline:
+        BASELINE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        BASELINE_FILE.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+        print(f"\nLínea base guardada en {BASELINE_FILE}")
+        return
+
+    if not BASELINE_FILE.exists():
+        print("\nSin línea base (usa --save-baseline para crearla).")
+        return
+    baseline = json.loads(BASELINE_FILE.read_text(encoding="utf-8"))
+    change = summary["startup_ms"] / baseline["startup_ms"] - 1
+    print(f"\nLínea base: arranque {baseline['startup_ms']} ms -> {change:+.1%}")
+    for name, ms in summary["modules"].items():
+        before = baseline["modules"].get(name)
+        if name in startup and before is None:
+            print(f"  nuevo en el arranque: {name} ({ms} ms)")
+    if change > args.tolerance:
+        print(f"REGRESIÓN: el arranque empeoró más de {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Armado del prompt con presupuesto de tokens por secciones.
+
+Cada sección tiene una prioridad (1 = más importante) y un tope opcional. Las
+secciones obligatorias (rol, reglas, solicitud) entran siempre; el resto reparte
+el presupuesto restante por orden de prioridad y se recorta si no cabe. El prompt
+final respeta el orden en que se añadieron las secciones, no el de prioridad.
+"""
+import re
+from functools import lru_cache
+
+DEFAULT_TOKEN_BUDGET = 30000
+
+# Estimación conservadora para texto en español (Gemini ronda ~4 caracteres por token)
+CHARS_PER_TOKEN = 4
+
+TRIM_NOTE = "\n[... recortado por límite de contexto ...]\n"
+
+# Historial: los últimos N mensajes van completos, los anteriores como resumen acotado
+HISTORY_VERBATIM_MESSAGES = 4
+HISTORY_SUMMARY_MAX_CHARS = 3000
+SUMMARY_LINES_PER_MESSAGE = 10
+SUMMARY_LINE_CHARS = 140
+
+_HEADING_RE = re.compile(r"^\s*#{1,6}\s+(.+)$")
+_BOLD_LEAD_RE = re.compile(r"^\s*(?:[-*]\s*)?\*\*(.+?)\*\*")
+_TABLE_SEP_RE = re.compile(r"^\s*\|?\s*:?-{3,}")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def trim_text(text, max_chars, keep="start"):
+    """Recorta a `max_chars` cortando en salto de línea.
+
+    keep="start" conserva el principio (planes, biblioteca); keep="end" conserva el
+    final (historial: lo más reciente es lo que importa).
+    """
+    if len(text) <= max_chars:
+        return text
+    budget = max_chars - len(TRIM_NOTE)
+    if budget <= 0:
+        return ""
+    if keep == "end":
+        piece = text[-budget:]
+        cut = piece.find("\n")
+        if 0 <= cut < budget // 2:
+            piece = piece[cut + 1:]
+        return TRIM_NOTE + piece
+    piece = text[:budget]
+    cut = piece.rfind("\n")
+    if cut > budget // 2:
+        piece = piece[:cut]
+    return piece + TRIM_NOTE
+
+
+class PromptBuilder:
+    def __init__(self, total_tokens=DEFAULT_TOKEN_BUDGET):
+        self.total_tokens = total_tokens
+        self.sections = []
+
+    def add(self, name, body, priority=None, max_tokens=None, header="", footer="", keep="start"):
+        """Añade una sección. Sin `priority` es obligatoria y nunca se recorta.
+
+        `header`/`footer` envuelven el cuerpo y se conservan aunque el cuerpo se recorte.
+        """
+        if not body:
+            return
+        self.sections.append({
+            "name": name, "body": body, "priority": priority, "max_tokens": max_tokens,
+            "header": header, "footer": footer, "keep": keep,
+        })
+
+    def build(self):
+        """Devuelve (prompt, informe). El informe lista cada sección con sus tokens y estado."""
+        def wrap(sec, body):
+            return "\n".join(part for part in (sec["header"], body, sec["footer"]) if part)
+
+        texts = {}
+        report = []
+        remaining = self.total_tokens
+        for sec in self.sections:
+            if sec["priority"] is None:
+                texts[id(sec)] = wrap(sec, sec["body"])
+                remaining -= estimate_tokens(texts[id(sec)])
+
+        for sec in sorted((s for s in self.sections if s["priority"] is not None), key=lambda s: s["priority"]):
+            full = wrap(sec, sec["body"])
+            allowed = max(remaining, 0)
+            if sec["max_tokens"] is not None:
+                allowed = min(allowed, sec["max_tokens"])
+            if estimate_tokens(full) <= allowed:
+                texts[id(sec)] = full
+            else:
+                overhead = len(full) - len(sec["body"])
+                body = trim_text(sec["body"], allowed * CHARS_PER_TOKEN - overhead, sec["keep"])
+                texts[id(sec)] = wrap(sec, body) if body else ""
+            remaining -= estimate_tokens(texts[id(sec)])
+
+        parts = []
+        for sec in self.sections:
+            text = texts[id(sec)]
+            full_tokens = estimate_tokens(wrap(sec, sec["body"]))
+            used_tokens = estimate_tokens(text)
+            if not text:
+                status = "omitido"
+            elif used_tokens < full_tokens:
+                status = "recortado"
+            else:
+                status = "completo"
+            # Una sola clase de dato por columna (el informe se muestra como DataFrame/Arrow)
+            report.append({
+                "seccion": sec["name"], "obligatoria": sec["priority"] is None, "prioridad": sec["priority"],
+                "tokens": used_tokens, "tokens_original": full_tokens, "estado": status,
+            })
+            if text:
+                parts.append(text)
+        return "\n".join(parts), report
+
+
+def _clip(text, limit=SUMMARY_LINE_CHARS):
+    text = " ".join(text.replace("*", "").split())
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+@lru_cache(maxsize=512)
+def summarize_message(role, content):
+    """Resumen local de un mensaje: la petición del usuario o la estructura de la respuesta.
+
+    De las respuestas se extraen encabezados, líneas que empiezan en negrita y la
+    cabecera de cada tabla, que es lo que define un plan (fases, días, ejercicios).
+    """
+    if role == "user":
+        return f"- USUARIO pidió: {_clip(content, 2 * SUMMARY_LINE_CHARS)}"
+    lines = content.splitlines()
+    found = []
+    for i, line in enumerate(lines):
+        heading = _HEADING_RE.match(line)
+        bold = _BOLD_LEAD_RE.match(line)
+        if heading:
+            found.append(_clip(heading.group(1)))
+        elif bold:
+            found.append(_clip(line))
+        elif i + 1 < len(lines) and "|" in line and _TABLE_SEP_RE.match(lines[i + 1]):
+            found.append("Tabla: " + _clip(line.strip().strip("|").replace("|", "/")))
+        if len(found) >= SUMMARY_LINES_PER_MESSAGE:
+            break
+    if not found:
+        found.append(_clip(content))
+    return "- ASISTENTE entregó: " + "; ".join(found)
+
+
+def compact_history(messages, keep_last=HISTORY_VERBATIM_MESSAGES, max_summary_chars=HISTORY_SUMMARY_MAX_CHARS):
+    """Historial de chat para el prompt, de tamaño acotado sin importar cuántos turnos haya.
+
+    Los últimos `keep_last` mensajes van literales; los anteriores se condensan en un
+    resumen (si aun así excede `max_summary_chars`, se conservan los más recientes).
+    """
+    split = max(len(messages) - keep_last, 0)
+    older, recent = messages[:split], messages[split:]
+    parts = []
+    if older:
+        summary = "\n".join(summarize_message(m["role"], m["content"]) for m in older)
+        summary = trim_text(summary, max_summary_chars, keep="end")
+        parts.append(f"RESUMEN DE TURNOS ANTERIORES:\n{summary}\n")
+    if recent:
+        if older:
+            parts.append("ÚLTIMOS TURNOS (TEXTO COMPLETO):")
+        for msg in recent:
+            r = "USUARIO" if msg["role"] == "user" else "ASISTENTE"
+            parts.append(f"{r}: {msg['content']}\n")
+    return "\n".join(parts)
@@ -0,0 +1,93 @@
+"""Caché persistente de respuestas de la IA (SQLite en disco, con desalojo LRU).
+
+La clave es el hash del modelo + prompt normalizado (espacios colapsados) + los
+parámetros de generación, así una misma solicitud repetida (rerun, doble envío)
+se responde al instante sin volver a llamar a la API.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+CACHE_FILE = Path(".cache") / "respuestas.sqlite3"
+MAX_CACHE_BYTES = 50 * 1024 * 1024
+MAX_CACHE_ENTRIES = 2000
+
+
+def normalize_prompt(prompt):
+    """Colapsa espacios y saltos de línea: la indentación del código no cambia la clave."""
+    return " ".join(prompt.split())
+
+
+def cache_key(model_name, prompt, params=None):
+    payload = json.dumps(
+        {"model": model_name, "prompt": normalize_prompt(prompt), "params": params or {}},
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, max_bytes=MAX_CACHE_BYTES, max_entries=MAX_CACHE_ENTRIES):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT, text TEXT, size INTEGER,"
+                " created REAL, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+            self._ready = True
+        return conn
+
+    def get(self, key):
+        """Texto guardado para la clave (y marca el uso para el LRU), o None."""
+        try:
+            with self._lock, closing(self._connect()) as conn, conn:
+                row = conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+                if row:
+                    conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                    return row[0]
+        except sqlite3.Error as e:
+            print(f"Error leyendo caché de respuestas: {e}")
+        return None
+
+    def put(self, key, model_name, text):
+        now = time.time()
+        try:
+            with self._lock, closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, text, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model_name, text, len(text.encode("utf-8")), now, now),
+                )
+                self._evict(conn)
+        except sqlite3.Error as e:
+            print(f"Error guardando caché de respuestas: {e}")
+
+    def _evict(self, conn):
+        """Borra las entradas menos usadas hasta quedar bajo los topes de tamaño y cantidad."""
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        to_free = total - self.max_bytes
+        extra = count - self.max_entries
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if to_free <= 0 and extra <= 0:
+                break
+            doomed.append((key,))
+            to_free -= size
+            extra -= 1
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
@@ -0,0 +1,209 @@
+"""Índice léxico (BM25) sobre fragmentos de la biblioteca técnica.
+
+En lugar de mandar los primeros N caracteres de la biblioteca, el texto se parte en
+fragmentos solapados y se recuperan solo los más relevantes para la solicitud.
+Tokenización en español: minúsculas, sin acentos, sin stopwords y con un stemmer
+ligero de sufijos.
+"""
+import math
+import re
+import unicodedata
+import zlib
+from bisect import bisect_right
+from collections import Counter, defaultdict, namedtuple
+
+Chunk = namedtuple("Chunk", ["source", "page", "text"])
+
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 200
+
+SPANISH_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes asi aun bajo bien cada como con
+contra cual cuales cuando de del desde donde dos el ella ellas ello ellos en entre era eran
+es esa esas ese eso esos esta estaba estan estas este esto estos fue fueron ha han hasta hay
+la las le les lo los mas me mi mis mucho muy nada ni no nos nosotros o otra otras otro otros
+para pero poco por porque que quien se segun ser si sido sin sobre su sus tambien tan tanto
+te tiene tienen todo todos tu un una unas uno unos y ya yo the of and to in is for on with
+""".split())
+
+# Sufijos ordenados de mayor a menor longitud (se elimina el primero que coincide)
+_SUFFIXES = sorted("""
+amientos imientos amiento imiento aciones uciones adoras adores ancias logias encias amente
+idades mente acion ucion adora ador ancia logia encia idad ivas ivos iva ivo ables ibles able
+ible istas ista osas osos osa oso ando iendo ados adas idos idas ado ada ido ida ar er ir es
+as os a o e s
+""".split(), key=len, reverse=True)
+
+# Detección de pasajes casi duplicados (MinHash de una permutación + LSH por bandas)
+SHINGLE_SIZE = 5
+MINHASH_BINS = 32
+LSH_BANDS = 8
+NEAR_DUPLICATE_THRESHOLD = 0.8
+_EMPTY_BIN = 1 << 32
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_SPACE_RE = re.compile(r"\s")
+
+
+def normalize(text):
+    """Minúsculas y sin tildes (vam, VAM y vám cuentan igual)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def stem(word):
+    """Stemmer ligero para español: quita el sufijo más largo dejando al menos 3 letras."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text):
+    return [stem(w) for w in _WORD_RE.findall(normalize(text)) if w not in SPANISH_STOPWORDS and len(w) > 1]
+
+
+def term_counts(text):
+    return Counter(tokenize(text))
+
+
+def split_chunks(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Devuelve [(offset, fragmento)] solapados, empezando y cortando en espacios cuando es posible."""
+    chunks = []
+    start = 0
+    n = len(text)
+    while start < n:
+        end = min(start + size, n)
+        if end < n:
+            cut = text.rfind(" ", start + size // 2, end)
+            if cut > 0:
+                end = cut
+        piece = text[start:end].strip()
+        if piece:
+            chunks.append((start, piece))
+        if end >= n:
+            break
+        start = max(end - overlap, start + 1)
+        # Igual que el corte final: el siguiente fragmento arranca al inicio de una palabra
+        if not text[start - 1].isspace():
+            space = _SPACE_RE.search(text, start, end)
+            start = space.end() if space else end
+    return chunks
+
+
+def chunk_pages(pages_by_file, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Fragmenta cada documento ({archivo: páginas}) guardando el nº de página inicial."""
+    chunks = []
+    for source, pages in pages_by_file.items():
+        name = getattr(source, "name", str(source))
+        page_starts = []
+        offset = 0
+        for page_text in pages:
+            page_starts.append(offset)
+            offset += len(page_text) + 1
+        doc_text = "\n".join(pages)
+        for start, piece in split_chunks(doc_text, size, overlap):
+            chunks.append(Chunk(name, bisect_right(page_starts, start), piece))
+    return chunks
+
+
+def minhash_signature(text, k=SHINGLE_SIZE, bins=MINHASH_BINS):
+    """Firma MinHash (one-permutation hashing) sobre shingles de k palabras."""
+    words = _WORD_RE.findall(normalize(text))
+    sig = [_EMPTY_BIN] * bins
+    for i in range(max(len(words) - k + 1, 1) if words else 0):
+        h = zlib.crc32(" ".join(words[i:i + k]).encode())
+        b, v = h % bins, h // bins
+        if v < sig[b]:
+            sig[b] = v
+    return tuple(sig)
+
+
+def signature_similarity(a, b):
+    """Estimación de Jaccard: fracción de cubetas no vacías con el mismo mínimo."""
+    used = [(x, y) for x, y in zip(a, b) if x != _EMPTY_BIN or y != _EMPTY_BIN]
+    if not used:
+        return 0.0
+    return sum(x == y for x, y in used) / len(used)
+
+
+def near_duplicates(items, threshold=NEAR_DUPLICATE_THRESHOLD, bands=LSH_BANDS):
+    """Índices de `items` [(documento, firma)] que repiten un pasaje anterior de OTRO documento.
+
+    El primero en aparecer se conserva; los candidatos salen de las bandas LSH, así
+    no se compara cada pasaje con todos los demás.
+    """
+    buckets = defaultdict(list)
+    dropped = set()
+    for i, (doc, sig) in enumerate(items):
+        rows = len(sig) // bands
+        keys = []
+        for band in range(bands):
+            part = sig[band * rows:(band + 1) * rows]
+            if any(v != _EMPTY_BIN for v in part):
+                keys.append((band, part))
+        candidates = {j for key in keys for j in buckets.get(key, ())}
+        if any(items[j][0] != doc and signature_similarity(sig, items[j][1]) >= threshold for j in candidates):
+            dropped.add(i)
+            continue
+        for key in keys:
+            buckets[key].append(i)
+    return dropped
+
+
+class BM25Index:
+    """Índice invertido BM25 (Okapi) sobre una lista de Chunk.
+
+    `term_counts` permite pasar los conteos ya calculados (uno por fragmento) para
+    reconstruir el índice sin volver a tokenizar.
+    """
+
+    def __init__(self, chunks, k1=1.5, b=0.75, term_counts=None):
+        self.chunks = list(chunks)
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)  # término -> [(id fragmento, frecuencia)]
+        self.doc_len = []
+        if term_counts is None:
+            term_counts = [Counter(tokenize(chunk.text)) for chunk in self.chunks]
+        for i, terms in enumerate(term_counts):
+            self.doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings[term].append((i, tf))
+        n = len(self.chunks)
+        self.avg_len = (sum(self.doc_len) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search(self, query, top_k=10):
+        """Devuelve [(score, Chunk)] ordenados por relevancia."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[i] / (self.avg_len or 1))
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))[:top_k]
+        return [(score, self.chunks[i]) for i, score in best]
+
+
+def build_context(index, query, max_chars, top_k=12):
+    """Texto de la biblioteca para el prompt: los fragmentos más relevantes dentro del presupuesto."""
+    if not index or max_chars <= 0:
+        return ""
+    parts = []
+    used = 0
+    for _, chunk in index.search(query, top_k):
+        block = f"\n--- INFORMACIÓN DEL LIBRO: {chunk.source} (pág. {chunk.page}) ---\n{chunk.text}\n"
+        if used + len(block) > max_chars:
+            continue
+        parts.append(block)
+        used += len(block)
+    return "".join(parts)
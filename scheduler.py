@@ -0,0 +1,156 @@
+"""Planificador de llamadas a Gemini compartido por todo el proceso.
+
+Varias sesiones (varios PF) comparten una sola API key. En vez de fallar con 429,
+cada llamada pide turno: por modelo hay dos token buckets (solicitudes/minuto y
+tokens estimados/minuto) y una cola FIFO. Si aun así llega un 429, el modelo
+entra en backoff exponencial con jitter (o el tiempo que indique el propio error).
+"""
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# Límites de la capa gratuita (ajustables por variables de entorno)
+DEFAULT_RPM = int(os.getenv("GEMINI_RPM", "10"))
+DEFAULT_TPM = int(os.getenv("GEMINI_TPM", "250000"))
+OUTPUT_TOKENS_ESTIMATE = 3000  # reserva para la respuesta (un plan completo)
+
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 60.0
+MAX_QUOTA_RETRIES = 4
+
+_RETRY_PATTERNS = [
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry-after[:=\s]+([\d.]+)", re.IGNORECASE),
+]
+
+
+def estimate_request_tokens(prompt):
+    return len(prompt) // 4 + OUTPUT_TOKENS_ESTIMATE
+
+
+def retry_after_hint(error):
+    """Segundos de espera sugeridos por el error de cuota, si los trae."""
+    msg = str(error)
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(msg)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_minute):
+        self.capacity = float(capacity)
+        self.rate = per_minute / 60.0
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Segundos hasta poder consumir `amount` (0 si ya se puede)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # una solicitud enorme no debe esperar para siempre
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def queue_wait(self, count, amount, now):
+        """Segundos hasta poder consumir `count` veces `amount` seguidas (estimación para la cola)."""
+        self._refill(now)
+        needed = count * min(amount, self.capacity)
+        return max(0.0, needed - self.tokens) / self.rate
+
+    def consume(self, amount, now):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class QuotaScheduler:
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._cond = threading.Condition()
+        self._buckets = {}  # modelo -> (solicitudes, tokens)
+        self._queues = {}  # modelo -> deque de turnos
+        self._backoff_until = {}
+        self._failures = {}
+
+    def _state(self, model_name):
+        if model_name not in self._buckets:
+            self._buckets[model_name] = (TokenBucket(self.rpm, self.rpm), TokenBucket(self.tpm, self.tpm))
+            self._queues[model_name] = deque()
+        return self._buckets[model_name], self._queues[model_name]
+
+    def acquire(self, model_name, est_tokens, on_wait=None, deadline=None, cancel=None):
+        """Bloquea hasta que `model_name` tenga cupo y sea el turno de esta llamada.
+
+        `on_wait(posición, segundos)` informa mientras se espera (posición 1 = el
+        siguiente en salir). Lanza TimeoutError si se supera `deadline` (monotonic).
+        Si se activa el evento `cancel`, sale de la cola sin gastar cupo. Devuelve
+        True si obtuvo el turno y False si se canceló.
+        """
+        ticket = object()
+        with self._cond:
+            (requests, tokens), waiting = self._state(model_name)
+            waiting.append(ticket)
+            try:
+                while True:
+                    if cancel is not None and cancel.is_set():
+                        return False
+                    now = time.monotonic()
+                    position = waiting.index(ticket) + 1
+                    backoff = self._backoff_until.get(model_name, 0.0) - now
+                    if position == 1:
+                        wait = max(requests.wait_time(1, now), tokens.wait_time(est_tokens, now), backoff)
+                        if wait <= 0:
+                            requests.consume(1, now)
+                            tokens.consume(est_tokens, now)
+                            return True
+                        eta = wait
+                    else:
+                        wait = 1.0
+                        # Los de adelante gastan cupo antes: se estima con el tamaño de esta llamada
+                        eta = max(
+                            requests.queue_wait(position, 1, now),
+                            tokens.queue_wait(position, est_tokens, now),
+                            backoff, wait,
+                        )
+                    if deadline is not None and now + wait > deadline:
+                        raise TimeoutError(f"Cola de {model_name}: sin cupo antes del límite de tiempo")
+                    if on_wait:
+                        on_wait(position, eta)
+                    self._cond.wait(timeout=min(wait, 1.0))
+            finally:
+                waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def report_quota_error(self, model_name, error):
+        """Registra un 429: backoff exponencial con jitter, o el retry-after del error."""
+        with self._cond:
+            failures = self._failures.get(model_name, 0) + 1
+            self._failures[model_name] = failures
+            delay = retry_after_hint(error)
+            if delay is None:
+                delay = min(BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX) * random.uniform(0.5, 1.5)
+            self._backoff_until[model_name] = time.monotonic() + delay
+            self._cond.notify_all()
+            return delay
+
+    def backoff_remaining(self, model_name):
+        """Segundos que le quedan al backoff de `model_name` (0 si no está en backoff)."""
+        with self._cond:
+            return max(0.0, self._backoff_until.get(model_name, 0.0) - time.monotonic())
+
+    def report_success(self, model_name):
+        with self._cond:
+            self._failures.pop(model_name, None)
+
+
+scheduler = QuotaScheduler()
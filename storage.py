@@ -0,0 +1,136 @@
+"""Backend opcional en SQLite para equipos, planes y registros de carga.
+
+Con los JSON cada guardado reescribe el archivo entero; acá cada plan, equipo o
+registro es una fila y guardar/borrar toca solo las filas cambiadas, en una
+transacción. Los planes tienen además un índice FTS5 sobre título y contenido
+(sin distinguir tildes) para la búsqueda de "Mis Planificaciones", ordenada por
+relevancia (bm25).
+
+Se activa con STORAGE_BACKEND=sqlite. La primera vez, si las tablas están vacías,
+se importan los JSON existentes.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from pathlib import Path
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+DB_FILE = Path(os.getenv("STORAGE_DB", "futsal.sqlite3"))
+
+# Tabla -> campo del item que sirve de clave
+KEY_FIELDS = {"equipos": "categoria", "planes": "id", "cargas": "id"}
+TITLE_WEIGHT = 5.0  # en la búsqueda, un acierto en el título pesa más que en el contenido
+
+_WORD_RE = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS equipos (key TEXT PRIMARY KEY, orden INTEGER, data TEXT);
+CREATE TABLE IF NOT EXISTS cargas (key TEXT PRIMARY KEY, orden INTEGER, data TEXT);
+CREATE TABLE IF NOT EXISTS planes (key TEXT PRIMARY KEY, orden INTEGER, data TEXT, titulo TEXT, contenido TEXT);
+-- MAX(orden) al guardar y ORDER BY orden al cargar, sin recorrer la tabla
+CREATE INDEX IF NOT EXISTS equipos_orden ON equipos(orden);
+CREATE INDEX IF NOT EXISTS cargas_orden ON cargas(orden);
+CREATE INDEX IF NOT EXISTS planes_orden ON planes(orden);
+CREATE VIRTUAL TABLE IF NOT EXISTS planes_fts USING fts5(
+    titulo, contenido, content='planes', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS planes_ai AFTER INSERT ON planes BEGIN
+    INSERT INTO planes_fts(rowid, titulo, contenido) VALUES (new.rowid, new.titulo, new.contenido);
+END;
+CREATE TRIGGER IF NOT EXISTS planes_ad AFTER DELETE ON planes BEGIN
+    INSERT INTO planes_fts(planes_fts, rowid, titulo, contenido) VALUES ('delete', old.rowid, old.titulo, old.contenido);
+END;
+CREATE TRIGGER IF NOT EXISTS planes_au AFTER UPDATE ON planes BEGIN
+    INSERT INTO planes_fts(planes_fts, rowid, titulo, contenido) VALUES ('delete', old.rowid, old.titulo, old.contenido);
+    INSERT INTO planes_fts(rowid, titulo, contenido) VALUES (new.rowid, new.titulo, new.contenido);
+END;
+"""
+
+
+def fts_query(text):
+    """Consulta FTS5: cada palabra como prefijo, todas obligatorias ("pliom" encuentra "pliometría")."""
+    return " ".join(f'"{word}"*' for word in _WORD_RE.findall(text))
+
+
+class SQLiteStore:
+    def __init__(self, path=DB_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def is_empty(self, table):
+        with closing(self._connect()) as conn:
+            return conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+
+    def load(self, table):
+        """Items de la tabla en el orden en que se agregaron."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT data FROM {table} ORDER BY orden").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def save(self, table, changed=(), removed=()):
+        """Inserta/actualiza los items `changed` y borra las claves `removed` en una transacción."""
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany(f"DELETE FROM {table} WHERE key = ?", [(key,) for key in removed])
+            self._upsert(conn, table, changed)
+
+    def replace_all(self, table, items):
+        """Reemplaza la tabla completa (guardado sin detalle de cambios)."""
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM {table}")
+            self._upsert(conn, table, items)
+
+    def _upsert(self, conn, table, items):
+        key_field = KEY_FIELDS[table]
+        next_order = conn.execute(f"SELECT COALESCE(MAX(orden), -1) + 1 FROM {table}").fetchone()[0]
+        for item in items:
+            row = {"key": item[key_field], "orden": next_order, "data": json.dumps(item, ensure_ascii=False)}
+            next_order += 1
+            if table == "planes":
+                row.update(titulo=item.get("titulo", ""), contenido=item.get("contenido", ""))
+            updates = ", ".join(f"{c} = excluded.{c}" for c in row if c not in ("key", "orden"))
+            # ON CONFLICT ... DO UPDATE (no INSERT OR REPLACE) conserva el rowid y el orden, y
+            # dispara el trigger que actualiza el FTS
+            conn.execute(
+                f"INSERT INTO {table} ({', '.join(row)}) VALUES ({', '.join('?' * len(row))}) "
+                f"ON CONFLICT(key) DO UPDATE SET {updates}",
+                list(row.values()),
+            )
+
+    def search_plans(self, text, limit=500):
+        """Ids de los planes que contienen todas las palabras, del más relevante al menos."""
+        query = fts_query(text)
+        if not query:
+            return []
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT planes.key FROM planes_fts JOIN planes ON planes.rowid = planes_fts.rowid "
+                "WHERE planes_fts MATCH ? ORDER BY bm25(planes_fts, ?, 1.0) LIMIT ?",
+                (query, TITLE_WEIGHT, limit),
+            ).fetchall()
+        return [key for (key,) in rows]
+
+    def migrate_json(self, sources):
+        """Importa los JSON existentes ({ruta: tabla}) a las tablas vacías. Devuelve cuántos items importó."""
+        imported = 0
+        for filepath, table in sources.items():
+            if not self.is_empty(table) or not os.path.exists(filepath):
+                continue
+            try:
+                with open(filepath, "r", encoding="utf-8") as f:
+                    items = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error migrando {filepath}: {e}")
+                continue
+            self.save(table, changed=items)
+            imported += len(items)
+        return imported
@@ -0,0 +1,59 @@
+from cloud_sync import FirestoreStore
+from firestore_fake import FakeFirestore
+
+PLANES = [{"id": "p1", "titulo": "Semana 1"}, {"id": "p2", "titulo": "Semana 2"}, {"id": "p3", "titulo": "Semana 3"}]
+
+
+def test_migrates_legacy_document_keeping_order():
+    client = FakeFirestore()
+    client.collection("futsal_data").document("planes").set({"data": PLANES})
+    store = FirestoreStore(client)
+
+    assert store.pull("planes") == 3
+    store.save("planes", changed=[{"id": "p0", "titulo": "Nuevo"}])
+
+    assert [p["id"] for p in store.items("planes")] == ["p1", "p2", "p3", "p0"]
+    assert client.collection("futsal_data").document("planes").get().to_dict()["migrated"] is True
+    # Otra instancia no vuelve a migrar y ve el mismo orden
+    other = FirestoreStore(client)
+    other.pull("planes")
+    assert [p["id"] for p in other.items("planes")] == ["p1", "p2", "p3", "p0"]
+
+
+def test_second_pull_returns_only_changed_documents():
+    client = FakeFirestore()
+    writer, reader = FirestoreStore(client), FirestoreStore(client)
+    writer.save("planes", changed=PLANES)
+    assert reader.pull("planes") == 3
+
+    writer.save("planes", changed=[{"id": "p2", "titulo": "Semana 2 (editada)"}])
+
+    assert reader.pull("planes") == 1
+    assert reader.items("planes")[1]["titulo"] == "Semana 2 (editada)"
+    assert reader.pull("planes") == 0
+
+
+def test_tombstone_removes_item_on_other_instance():
+    client = FakeFirestore()
+    writer, reader = FirestoreStore(client), FirestoreStore(client)
+    writer.save("planes", changed=PLANES)
+    reader.pull("planes")
+
+    writer.save("planes", removed=["p1"])
+    reader.pull("planes")
+
+    assert [p["id"] for p in reader.items("planes")] == ["p2", "p3"]
+    assert len(client.docs) == 3  # el borrado deja la marca, no elimina el documento
+
+
+def test_replace_all_writes_only_the_diff():
+    client = FakeFirestore()
+    store = FirestoreStore(client)
+    store.save("planes", changed=PLANES)
+    before = client.writes
+
+    store.replace_all("planes", [PLANES[0], {"id": "p2", "titulo": "Otra"}, {"id": "p4", "titulo": "Semana 4"}])
+
+    # p2 cambia, p4 es nuevo y p3 se marca como borrado; p1 no se reescribe
+    assert client.writes - before == 3
+    assert [p["id"] for p in store.items("planes")] == ["p1", "p2", "p4"]
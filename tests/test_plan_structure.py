@@ -0,0 +1,30 @@
+import plan_structure
+
+MENSUAL = """# Planificación Mensual | Febrero
+
+### Tabla Resumen de Objetivos Semanales
+
+| SEMANA | OBJETIVO PRINCIPAL | CAPACIDADES FÍSICAS A ENFATIZAR |
+|---|---|---|
+| Semana 1 | Adaptación anatómica | **Fuerza preventiva**, técnica de carrera |
+| Semana 2 | Construcción de bases | Resistencia aeróbica @ 90% VAM |
+"""
+
+
+def test_prompt_summary_keeps_cells_of_unmapped_tables():
+    plan = {"titulo": "Mensual - C17 | Febrero (2026-02-01)", "contenido": MENSUAL}
+    plan_structure.ensure_structure(plan)
+    summary = plan_structure.prompt_summary(plan)
+
+    assert "Tipo: Mensual" in summary
+    assert "SEMANA | OBJETIVO PRINCIPAL | CAPACIDADES FÍSICAS A ENFATIZAR" in summary
+    assert "- Semana 1 | Adaptación anatómica | Fuerza preventiva, técnica de carrera" in summary
+    assert "Resistencia aeróbica @ 90% VAM" in summary
+    assert "Cargas (" not in summary
+
+
+def test_prompt_summary_without_tables_uses_markdown():
+    plan = {"titulo": "Anual - C15 | Temporada (2026-01-10)", "contenido": "# Plan anual\n\nFase 1: acumulación."}
+    plan_structure.ensure_structure(plan)
+
+    assert "Fase 1: acumulación." in plan_structure.prompt_summary(plan)
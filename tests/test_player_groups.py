@@ -0,0 +1,15 @@
+import numpy as np
+
+import player_groups
+
+
+def test_compute_groups_has_no_empty_groups_when_players_are_few():
+    vam = [19.7, 16.8, 18.5, 17.0, 17.2, 18.7, 16.5, 18.4, 18.3]
+    roster = {"nombre": [f"J{i}" for i in range(len(vam))], "vam": vam}
+    labels, speeds = player_groups.compute_groups(roster, n_groups=6)
+
+    groups = int(labels.max()) + 1
+    assert np.bincount(labels, minlength=groups).min() > 0
+    means = list(speeds["vam"].values())
+    assert len(means) == groups
+    assert all(a > b for a, b in zip(means, means[1:]))
@@ -0,0 +1,16 @@
+import random
+
+import retrieval
+
+
+def test_split_chunks_never_start_mid_word():
+    rng = random.Random(0)
+    words = ["pliometría", "resistencia", "VAM", "intermitente", "de", "al", "velocidad", "RSA"]
+    text = " ".join(rng.choice(words) for _ in range(2000)).replace(" al ", "\nal ")
+
+    chunks = retrieval.split_chunks(text, size=300, overlap=80)
+
+    assert len(chunks) > 1
+    for offset, piece in chunks:
+        assert offset == 0 or text[offset - 1].isspace()
+        assert piece.split()[0] in words
@@ -0,0 +1,21 @@
+import pytest
+
+import vam_calculator
+
+
+@pytest.mark.parametrize("text, macro", [
+    ('4 x (6 x 15" x 15") al 110% con macro-pausa de 4 min', 240),
+    ('3 x (8 x 10" x 20") al 120%, entre series 150 seg', 150),
+    ('4 x (6 x 15" x 15") al 110%, 2 min entre series', 120),
+    ('2 x (8 x 15" x 15") al 105% y 90" de pausa entre series', 90),
+    ("3 x (6 x 30\" x 30\") al 100%, 2' de macro-pausa", 120),
+])
+def test_parse_interval_spec_macro_rest(text, macro):
+    spec = vam_calculator.parse_interval_spec(text)
+    assert spec.macro_rest == macro
+
+
+def test_parse_interval_spec_default_macro_rest():
+    spec = vam_calculator.parse_interval_spec('4 x (6 x 15" x 15") al 110%')
+    assert (spec.series, spec.reps, spec.work, spec.rest, spec.pct) == (4, 6, 15, 15, 110)
+    assert spec.macro_rest == 180
@@ -0,0 +1,134 @@
+"""Calculadora de cargas por VAM (y velocidad/RSA) para los grupos G1/G2/G3 (o los que tenga el equipo).
+
+Hace localmente la cuenta que antes se pedía a la IA: velocidad = VAM × %VAM,
+distancia por repetición = velocidad × tiempo de trabajo, y conos a distancia / 2
+para ida y vuelta. Las cuentas se hacen vectorizadas sobre todos los grupos a la vez.
+"""
+import re
+from collections import namedtuple
+
+import numpy as np
+
+GROUPS = ("g1", "g2", "g3")
+_GROUP_KEY_RE = re.compile(r"^g(\d+)$")
+
+# Estructura: SERIES x (REPETICIONES x TRABAJO" x PAUSA") al PCT% con MACRO_PAUSA" entre series
+IntervalSpec = namedtuple("IntervalSpec", ["name", "series", "reps", "work", "rest", "pct", "macro_rest"])
+
+# Protocolos HIIT de referencia que se precalculan para el prompt de la sesión diaria
+REFERENCE_PROTOCOLS = [
+    IntervalSpec("HIIT corto 15-15", 2, 8, 15, 15, 110, 180),
+    IntervalSpec("HIIT corto 10-20", 3, 6, 10, 20, 120, 120),
+    IntervalSpec("HIIT largo 30-30", 2, 6, 30, 30, 100, 180),
+]
+
+_SPEC_RE = re.compile(
+    r"(\d+)\s*[x×]\s*\(?\s*(\d+)\s*[x×]\s*(\d+)\s*(?:\"|''|s\b|seg\w*)?\s*[x×/:-]\s*(\d+)\s*(?:\"|''|s\b|seg\w*)?\s*\)?",
+    re.IGNORECASE,
+)
+_PCT_RE = re.compile(r"(\d{2,3}(?:[.,]\d+)?)\s*%")
+# "macro-pausa de 3 min" / "entre series 180 seg" o al revés: "3 min entre series", "2' de macro-pausa"
+_MACRO_UNIT = r"(\"|''|s\b|seg\w*|'|min\w*)"
+_MACRO_RE = re.compile(
+    r"(?:macro|entre series)\D{0,20}(\d+)\s*" + _MACRO_UNIT
+    + r"|(\d+)\s*" + _MACRO_UNIT + r"\s*(?:de\s+)?(?:pausa\s+)?(?:macro|entre series)",
+    re.IGNORECASE,
+)
+
+# Sprints repetidos: distancia recorrida a la velocidad del test RSA, en línea recta
+RSA_PROTOCOL = IntervalSpec("Sprints repetidos (RSA)", 1, 6, 5, 20, 100, 0)
+
+TABLE_HEADER = (
+    "| GRUPO | % {ref} | Vel (m/s) | Distancia a Recorrer (por rep) | Logística (Conos) |\n"
+    "|---|---|---|---|---|"
+)
+
+
+def group_keys(stats):
+    """Grupos del dict del equipo en orden (g1, g2, ...); G1-G3 si no hay ninguno."""
+    keys = [k for k in (stats or {}) if _GROUP_KEY_RE.match(k)]
+    return tuple(sorted(keys, key=lambda k: int(k[1:]))) or GROUPS
+
+
+def group_speeds(stats):
+    """Array [g1, g2, ...] en m/s a partir del dict del equipo (faltantes = 0)."""
+    stats = stats or {}
+    return np.array([float(stats.get(g, 0.0) or 0.0) for g in group_keys(stats)])
+
+
+def has_data(stats):
+    return bool(np.any(group_speeds(stats) > 0))
+
+
+def compute_loads(stats, pct, work_s, shuttle=True):
+    """Velocidad, distancia por repetición y distancia al cono para cada grupo.
+
+    Devuelve un dict de arrays (una posición por grupo): "vel", "dist", "cone".
+    """
+    vel = group_speeds(stats) * (pct / 100.0)
+    dist = vel * work_s
+    cone = dist / 2 if shuttle else dist
+    return {"vel": vel, "dist": dist, "cone": cone}
+
+
+def _cone_label(cone):
+    lo, hi = np.floor(cone).astype(int), np.ceil(cone).astype(int)
+    return [f"{a} m" if a == b else f"{a}-{b} m" for a, b in zip(lo, hi)]
+
+
+def load_table(stats, spec, shuttle=True, ref="VAM"):
+    """Tabla markdown "TABLA DE CARGAS" de un protocolo, una fila por grupo con datos."""
+    loads = compute_loads(stats, spec.pct, spec.work, shuttle)
+    cones = _cone_label(loads["cone"])
+    logistics = "Ida y Vuelta: Conos a" if shuttle else "Línea recta: Cono a"
+    rows = [TABLE_HEADER.format(ref=ref)]
+    for i, group in enumerate(group_keys(stats)):
+        if loads["vel"][i] <= 0:
+            continue
+        rows.append(
+            f"| {group.upper()} | {spec.pct:g}% | {loads['vel'][i]:.2f} | {loads['dist'][i]:.1f} m | {logistics} {cones[i]} |"
+        )
+    return "\n".join(rows)
+
+
+def describe(spec, ref="VAM"):
+    return (
+        f"**{spec.name}** - Estructura: **{spec.series} x ({spec.reps} x {spec.work}\" x {spec.rest}\")** "
+        f"al {spec.pct:g}% {ref}. Macro-Pausa entre Series: **{spec.macro_rest}\"**."
+    )
+
+
+def parse_interval_spec(text, default_pct=100, default_macro=180):
+    """Busca en el texto una estructura tipo `4 x (6 x 15" x 15")` y su %VAM. None si no hay."""
+    match = _SPEC_RE.search(text)
+    if not match:
+        return None
+    series, reps, work, rest = (int(v) for v in match.groups())
+    pct_match = _PCT_RE.search(text)
+    pct = float(pct_match.group(1).replace(",", ".")) if pct_match else default_pct
+    macro = default_macro
+    macro_match = _MACRO_RE.search(text)
+    if macro_match:
+        value, unit = macro_match.group(1, 2) if macro_match.group(1) else macro_match.group(3, 4)
+        macro = int(value) * (60 if unit.lower().startswith(("'", "min")) else 1)
+    return IntervalSpec("Protocolo solicitado", series, reps, work, rest, pct, macro)
+
+
+def precomputed_tables(eq_data, request=""):
+    """Bloque de texto con las TABLAS DE CARGAS ya calculadas para el prompt ("" sin datos VAM).
+
+    Si la solicitud trae su propia estructura de intervalos, esa va primero. Con
+    datos RSA se agrega también la tabla de sprints repetidos.
+    """
+    vam = eq_data.get("vam")
+    if not has_data(vam):
+        return ""
+    specs = list(REFERENCE_PROTOCOLS)
+    requested = parse_interval_spec(request)
+    if requested:
+        specs.insert(0, requested)
+    blocks = [f"{describe(spec)}\n{load_table(vam, spec)}" for spec in specs]
+    rsa = eq_data.get("rsa")
+    if has_data(rsa):
+        blocks.append(f"{describe(RSA_PROTOCOL, 'RSA')}\n{load_table(rsa, RSA_PROTOCOL, shuttle=False, ref='RSA')}")
+    return "\n\n".join(blocks)